@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import TorrentDownload
+from .models import EngineNode, TorrentDownload, TorrentLease
 
 @admin.register(TorrentDownload)
 class TorrentDownloadAdmin(admin.ModelAdmin):
@@ -24,4 +24,15 @@ class TorrentDownloadAdmin(admin.ModelAdmin):
         ('Timestamps', {
             'fields': ('created_at', 'completed_at')
         }),
-    )
\ No newline at end of file
+    )
+
+@admin.register(EngineNode)
+class EngineNodeAdmin(admin.ModelAdmin):
+    list_display = ['node_id', 'hostname', 'started_at', 'heartbeat_at']
+    readonly_fields = ['node_id', 'hostname', 'started_at', 'heartbeat_at']
+
+@admin.register(TorrentLease)
+class TorrentLeaseAdmin(admin.ModelAdmin):
+    list_display = ['torrent', 'node_id', 'acquired_at', 'heartbeat_at', 'expires_at']
+    list_filter = ['node_id']
+    readonly_fields = ['torrent', 'node_id', 'token', 'acquired_at', 'heartbeat_at', 'expires_at']
@@ -0,0 +1,169 @@
+# downloader/leases.py - DB-backed ownership of torrents across worker nodes
+import logging
+import math
+import socket
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from .models import EngineNode, TorrentDownload, TorrentLease
+
+logger = logging.getLogger(__name__)
+
+
+def node_id():
+    """This node's identity, set TORRENT_NODE_ID to keep it stable across container restarts"""
+
+    return settings.TORRENT_NODE_ID or socket.gethostname()
+
+
+def lease_expiry(now):
+    return now + timedelta(seconds=settings.TORRENT_LEASE_TTL)
+
+
+def heartbeat_node():
+    """Record that this node is alive so others count it when balancing"""
+
+    EngineNode.objects.update_or_create(
+        node_id=node_id(),
+        defaults={'hostname': socket.gethostname(), 'heartbeat_at': timezone.now()},
+    )
+
+
+def live_nodes():
+    """Nodes that sent a heartbeat within one lease lifetime"""
+
+    cutoff = timezone.now() - timedelta(seconds=settings.TORRENT_LEASE_TTL)
+    nodes = set(EngineNode.objects.filter(heartbeat_at__gte=cutoff).values_list('node_id', flat=True))
+    nodes.add(node_id())
+    return nodes
+
+
+def lease_counts(nodes):
+    """Unexpired leases held by each of the given nodes"""
+
+    counts = (
+        TorrentLease.objects.filter(node_id__in=nodes, expires_at__gt=timezone.now())
+        .values('node_id')
+        .annotate(leases=Count('torrent'))
+    )
+    totals = {node: 0 for node in nodes}
+    totals.update({row['node_id']: row['leases'] for row in counts})
+    return totals
+
+
+def should_defer():
+    """Whether a less loaded live node should get the chance to claim the next torrent"""
+
+    counts = lease_counts(live_nodes())
+    mine = counts[node_id()]
+    return any(leases < mine for node, leases in counts.items() if node != node_id())
+
+
+def claim_lease(torrent_id):
+    """Take ownership of a torrent, returns the lease token or None if another node owns it
+
+    The torrent row is locked with skip_locked so two nodes racing for the same
+    torrent never wait on each other, the loser simply backs off.
+    """
+
+    me = node_id()
+    now = timezone.now()
+
+    with transaction.atomic():
+        torrent = TorrentDownload.objects.select_for_update(skip_locked=True).filter(id=torrent_id).first()
+        if torrent is None or torrent.status not in ('pending', 'downloading'):
+            return None
+
+        lease = TorrentLease.objects.filter(torrent_id=torrent_id).first()
+        if lease is not None and lease.expires_at > now:
+            return None
+
+        token = uuid.uuid4()
+        TorrentLease.objects.update_or_create(
+            torrent_id=torrent_id,
+            defaults={'node_id': me, 'token': token, 'acquired_at': now, 'heartbeat_at': now, 'expires_at': lease_expiry(now)},
+        )
+        TorrentDownload.objects.filter(id=torrent_id).update(status='downloading')
+
+    if lease is not None:
+        logger.info(
+            "Took over %s from %s", torrent.name, lease.node_id,
+            extra={'torrent_id': str(torrent_id), 'node': me, 'previous_node': lease.node_id},
+        )
+    return token
+
+
+def renew_lease(torrent_id, token):
+    """Extend a held lease, False once it was taken over or revoked"""
+
+    now = timezone.now()
+    renewed = TorrentLease.objects.filter(torrent_id=torrent_id, token=token).update(
+        heartbeat_at=now,
+        expires_at=lease_expiry(now),
+    )
+    heartbeat_node()
+    return renewed == 1
+
+
+def release_lease(torrent_id, token):
+    """Give up a lease this task holds"""
+
+    TorrentLease.objects.filter(torrent_id=torrent_id, token=token).delete()
+
+
+def should_yield(torrent_id):
+    """Whether this node holds more than its fair share and this torrent is one of its newest
+
+    Newly joined nodes start with no leases, overloaded nodes hand their most
+    recently claimed torrents back to the queue where the new node claims them.
+    """
+
+    nodes = live_nodes()
+    if len(nodes) < 2:
+        return False
+
+    counts = lease_counts(nodes)
+    fair_share = math.ceil(sum(counts.values()) / len(nodes))
+    excess = counts[node_id()] - fair_share
+    if excess <= 0 or min(counts.values()) >= fair_share:
+        return False
+
+    newest = (
+        TorrentLease.objects.filter(node_id=node_id(), expires_at__gt=timezone.now())
+        .order_by('-acquired_at')
+        .values_list('torrent_id', flat=True)[:excess]
+    )
+    return str(torrent_id) in {str(pk) for pk in newest}
+
+
+def sweep_expired_leases():
+    """Free torrents whose node stopped heartbeating and return their ids for re-queueing"""
+
+    now = timezone.now()
+    with transaction.atomic():
+        expired = list(
+            TorrentLease.objects.select_for_update(skip_locked=True)
+            .filter(expires_at__lte=now)
+            .values_list('torrent_id', flat=True)
+        )
+        TorrentLease.objects.filter(torrent_id__in=expired, expires_at__lte=now).delete()
+
+        # Rows left downloading by workers from before leases existed have no owner either
+        orphaned = list(
+            TorrentDownload.objects.filter(status='downloading', lease__isnull=True).values_list('id', flat=True)
+        )
+
+        # Paused or deleted meanwhile, only rows still meant to download go back to the queue
+        requeued = list(
+            TorrentDownload.objects.filter(id__in=set(expired) | set(orphaned), status='downloading')
+            .values_list('id', flat=True)
+        )
+        TorrentDownload.objects.filter(id__in=requeued, status='downloading').update(status='pending')
+
+    cutoff = now - timedelta(seconds=settings.TORRENT_LEASE_TTL * 10)
+    EngineNode.objects.filter(heartbeat_at__lt=cutoff).delete()
+
+    return [str(torrent_id) for torrent_id in requeued]
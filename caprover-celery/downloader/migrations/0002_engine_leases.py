@@ -0,0 +1,63 @@
+# Generated by Django 4.2 on 2026-10-19 07:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("downloader", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EngineNode",
+            fields=[
+                (
+                    "node_id",
+                    models.CharField(max_length=255, primary_key=True, serialize=False),
+                ),
+                ("hostname", models.CharField(blank=True, max_length=255)),
+                ("started_at", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "heartbeat_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+            ],
+            options={
+                "ordering": ["node_id"],
+            },
+        ),
+        migrations.CreateModel(
+            name="TorrentLease",
+            fields=[
+                (
+                    "torrent",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="lease",
+                        serialize=False,
+                        to="downloader.torrentdownload",
+                    ),
+                ),
+                ("node_id", models.CharField(db_index=True, max_length=255)),
+                ("token", models.UUIDField(default=uuid.uuid4)),
+                (
+                    "acquired_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "heartbeat_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ("expires_at", models.DateTimeField(db_index=True)),
+            ],
+            options={
+                "ordering": ["acquired_at"],
+            },
+        ),
+    ]
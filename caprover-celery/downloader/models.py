@@ -60,3 +60,31 @@ class TorrentDownload(models.Model):
                 return f"{bytes_val:.1f} {unit}"
             bytes_val /= 1024.0
         return f"{bytes_val:.1f} PB"
+
+
+class EngineNode(models.Model):
+    node_id = models.CharField(max_length=255, primary_key=True)
+    hostname = models.CharField(max_length=255, blank=True)
+    started_at = models.DateTimeField(default=timezone.now)
+    heartbeat_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['node_id']
+
+    def __str__(self):
+        return self.node_id
+
+
+class TorrentLease(models.Model):
+    torrent = models.OneToOneField(TorrentDownload, on_delete=models.CASCADE, primary_key=True, related_name='lease')
+    node_id = models.CharField(max_length=255, db_index=True)
+    token = models.UUIDField(default=uuid.uuid4)     # identifies the task holding the lease
+    acquired_at = models.DateTimeField(default=timezone.now)
+    heartbeat_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)  # another node may take over after this
+
+    class Meta:
+        ordering = ['acquired_at']
+
+    def __str__(self):
+        return f"{self.torrent_id} on {self.node_id}"
@@ -1,55 +1,154 @@
 import libtorrent as lt
+import logging
 import time
 import os
+import glob
 import zipfile
 import shutil
 from celery import shared_task
 from django.conf import settings
 from .models import TorrentDownload
+from . import leases
 from django.utils import timezone
 
-@shared_task
-def download_torrent(torrent_id):
+logger = logging.getLogger(__name__)
+
+def resume_data_path(torrent_id):
+    """Resume data lives on shared storage so whichever node takes a torrent over can continue it"""
+    return os.path.join(settings.TORRENT_STATE_DIR, f"{torrent_id}.fastresume")
+
+def save_resume_data(ses, handle, torrent_id):
+    """Write fast-resume data atomically, the session belongs to this task so its alerts are ours"""
+    handle.save_resume_data(lt.save_resume_flags_t.save_info_dict)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        ses.wait_for_alert(1000)
+        for alert in ses.pop_alerts():
+            if isinstance(alert, lt.save_resume_data_alert):
+                path = resume_data_path(torrent_id)
+                with open(f"{path}.tmp", 'wb') as f:
+                    f.write(lt.write_resume_data_buf(alert.params))
+                os.replace(f"{path}.tmp", path)
+                return True
+            if isinstance(alert, lt.save_resume_data_failed_alert):
+                return False
+    return False
+
+def current_status(torrent_id):
+    """Status of a torrent's row, None once it was deleted"""
+    return TorrentDownload.objects.filter(id=torrent_id).values_list('status', flat=True).first()
+
+def drop_deleted(ses, handle, torrent_id, token):
+    """Stop a torrent whose row is gone, its files are being deleted so resume data is useless"""
+    stop_and_release(ses, handle, torrent_id, token, keep_resume_data=False)
+    resume_path = resume_data_path(torrent_id)
+    if os.path.exists(resume_path):
+        os.remove(resume_path)
+
+def stop_and_release(ses, handle, torrent_id, token, keep_resume_data=True):
+    """Drop the handle and the lease, keeping resume data for the next owner"""
+    if keep_resume_data:
+        try:
+            save_resume_data(ses, handle, torrent_id)
+        except Exception as e:
+            logger.warning("Error saving resume data: %s", e, extra={'torrent_id': str(torrent_id), 'node': leases.node_id()})
+    ses.remove_torrent(handle)
+    leases.release_lease(torrent_id, token)
+
+# Long-running engine work, redelivered after a worker crash and safe to run twice thanks to the lease
+@shared_task(bind=True, max_retries=None, queue='engine', acks_late=True, reject_on_worker_lost=True, ignore_result=True)
+def download_torrent(self, torrent_id):
+    # Give a less loaded node the first chance to claim, but never forever
+    leases.heartbeat_node()
+    if self.request.retries < settings.TORRENT_LEASE_MAX_DEFERRALS and leases.should_defer():
+        raise self.retry(countdown=settings.TORRENT_LEASE_DEFER_DELAY)
+    
+    token = leases.claim_lease(torrent_id)
+    if token is None:
+        # Another node owns it, or it was paused or deleted meanwhile
+        return
+    
     try:
-        torrent = TorrentDownload.objects.get(id=torrent_id)
-        torrent.status = 'downloading'
-        torrent.save()
+        torrent = TorrentDownload.objects.filter(id=torrent_id).first()
+        if torrent is None:
+            leases.release_lease(torrent_id, token)
+            return
         
         # Create session
         ses = lt.session()
         ses.listen_on(6881, 6891)
         
-        # Add torrent
-        params = {
-            'url': torrent.magnet_link,
-            'save_path': str(settings.TORRENT_DOWNLOAD_DIR)
-        }
+        # Add torrent, continuing from resume data when another node already worked on it
+        resume_path = resume_data_path(torrent_id)
+        if os.path.exists(resume_path):
+            with open(resume_path, 'rb') as f:
+                params = lt.read_resume_data(f.read())
+        else:
+            params = lt.parse_magnet_uri(torrent.magnet_link)
+        params.save_path = str(settings.TORRENT_DOWNLOAD_DIR)
         
         handle = ses.add_torrent(params)
+        last_heartbeat = time.time()
+        last_resume_save = time.time()
         
         # Wait for metadata
         while not handle.has_metadata():
             time.sleep(1)
-            if TorrentDownload.objects.get(id=torrent_id).status == 'paused':
-                ses.remove_torrent(handle)
+            status = current_status(torrent_id)
+            if status is None:
+                drop_deleted(ses, handle, torrent_id, token)
+                return
+            if status == 'paused':
+                stop_and_release(ses, handle, torrent_id, token, keep_resume_data=False)
                 return
+            if time.time() - last_heartbeat >= settings.TORRENT_LEASE_HEARTBEAT:
+                last_heartbeat = time.time()
+                if not leases.renew_lease(torrent_id, token):
+                    ses.remove_torrent(handle)
+                    return
         
         # Update torrent info
         info = handle.get_torrent_info()
         torrent.name = info.name()
         torrent.size = info.total_size()
         torrent.is_multi_file = info.num_files() > 1
-        torrent.save()
+        TorrentDownload.objects.filter(id=torrent_id).update(name=torrent.name, size=torrent.size, is_multi_file=torrent.is_multi_file)
         
         # Download loop
         while handle.status().progress < 1:
             time.sleep(1)
             
-            # Check if paused or cancelled
-            current_torrent = TorrentDownload.objects.get(id=torrent_id)
-            if current_torrent.status == 'paused':
-                ses.remove_torrent(handle)
+            # Check if paused or deleted
+            status = current_status(torrent_id)
+            if status is None:
+                drop_deleted(ses, handle, torrent_id, token)
                 return
+            if status == 'paused':
+                stop_and_release(ses, handle, torrent_id, token)
+                return
+            
+            if time.time() - last_heartbeat >= settings.TORRENT_LEASE_HEARTBEAT:
+                last_heartbeat = time.time()
+                
+                # Lease taken over after a stall, the new owner carries on
+                if not leases.renew_lease(torrent_id, token):
+                    logger.warning("Lease on %s lost, stopping", torrent.name,
+                                   extra={'torrent_id': str(torrent_id), 'node': leases.node_id()})
+                    ses.remove_torrent(handle)
+                    return
+                
+                # A node joined with spare capacity, hand this torrent over
+                if leases.should_yield(torrent_id):
+                    logger.info("Handing %s to a less loaded node", torrent.name,
+                                extra={'torrent_id': str(torrent_id), 'node': leases.node_id()})
+                    stop_and_release(ses, handle, torrent_id, token)
+                    TorrentDownload.objects.filter(id=torrent_id, status='downloading').update(status='pending')
+                    download_torrent.delay(torrent_id)
+                    return
+            
+            if time.time() - last_resume_save >= settings.TORRENT_RESUME_DATA_INTERVAL:
+                last_resume_save = time.time()
+                save_resume_data(ses, handle, torrent_id)
             
             # Update progress
             status = handle.status()
@@ -73,40 +172,88 @@ def download_torrent(torrent_id):
             else:
                 torrent.eta = "∞"
             
-            torrent.save()
+            # Status belongs to the user and the lease sweeper, never write it back from here
+            TorrentDownload.objects.filter(id=torrent_id).update(
+                progress=torrent.progress,
+                download_speed=torrent.download_speed,
+                upload_speed=torrent.upload_speed,
+                downloaded=torrent.downloaded,
+                peers=torrent.peers,
+                seeds=torrent.seeds,
+                eta=torrent.eta,
+            )
         
-        # Download completed
-        torrent.status = 'completed'
-        torrent.progress = 1.0
-        torrent.completed_at = timezone.now()
-        torrent.file_path = os.path.join(settings.TORRENT_DOWNLOAD_DIR, info.name())
-        torrent.save()
+        # Download completed, an update so a row deleted meanwhile is not written back
+        completed = TorrentDownload.objects.filter(id=torrent_id).update(
+            status='completed',
+            progress=1.0,
+            completed_at=timezone.now(),
+            file_path=os.path.join(settings.TORRENT_DOWNLOAD_DIR, info.name()),
+        )
+        if not completed:
+            drop_deleted(ses, handle, torrent_id, token)
+            return
         
         ses.remove_torrent(handle)
+        leases.release_lease(torrent_id, token)
+        if os.path.exists(resume_path):
+            os.remove(resume_path)
+        
+        # Build the archive ahead of the first download request, off the engine queue
+        if torrent.is_multi_file:
+            create_zip_file.delay(torrent_id)
         
     except Exception as e:
-        torrent.status = 'failed'
-        torrent.save()
+        leases.release_lease(torrent_id, token)
+        # Matches nothing when the row was deleted, which is what made the task fail
+        TorrentDownload.objects.filter(id=torrent_id).update(status='failed')
         raise e
 
-@shared_task
+@shared_task(queue='cleanup', ignore_result=True)
+def sweep_expired_leases():
+    """Re-queue torrents whose node died, run by celery beat and safe to run on every node"""
+    torrent_ids = leases.sweep_expired_leases()
+    for torrent_id in torrent_ids:
+        download_torrent.delay(torrent_id)
+    return len(torrent_ids)
+
+# CPU-heavy, rate limited per worker so archiving never starves the box
+@shared_task(queue='archive', acks_late=True, reject_on_worker_lost=True, ignore_result=True,
+             rate_limit=settings.CELERY_ARCHIVE_RATE_LIMIT)
 def create_zip_file(torrent_id):
     try:
-        torrent = TorrentDownload.objects.get(id=torrent_id)
-        if not torrent.is_multi_file or torrent.status != 'completed':
+        torrent = TorrentDownload.objects.filter(id=torrent_id).first()
+        if torrent is None or not torrent.is_multi_file or torrent.status != 'completed':
             return
         
         source_dir = torrent.file_path
         zip_path = f"{source_dir}.zip"
         
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        # Already built by an earlier delivery of this task or by a download request
+        if os.path.exists(zip_path):
+            return zip_path
+        
+        # Written under a temporary name so a half-built archive is never served
+        temp_path = f"{zip_path}.{os.getpid()}.tmp"
+        with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
             for root, dirs, files in os.walk(source_dir):
                 for file in files:
                     file_path = os.path.join(root, file)
                     arcname = os.path.relpath(file_path, source_dir)
                     zipf.write(file_path, arcname)
+        os.replace(temp_path, zip_path)
         
         return zip_path
     except Exception as e:
-        print(f"Error creating zip: {e}")
-        return None
\ No newline at end of file
+        logger.error("Error creating zip: %s", e, extra={'torrent_id': str(torrent_id)})
+        return None
+
+# I/O-heavy, missing files are fine so a redelivered task simply finds less to do
+@shared_task(queue='cleanup', acks_late=True, reject_on_worker_lost=True, ignore_result=True,
+             rate_limit=settings.CELERY_CLEANUP_RATE_LIMIT)
+def delete_torrent_files(file_path):
+    for path in [file_path, f"{file_path}.zip"] + glob.glob(f"{glob.escape(file_path)}.zip.*.tmp"):
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
\ No newline at end of file
@@ -1,3 +1,91 @@
-from django.test import TestCase
+# downloader/tests.py - Lease ownership, takeover and rebalancing tests
+import uuid
+from datetime import timedelta
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from .models import EngineNode, TorrentDownload, TorrentLease
+from . import leases
 
-# Create your tests here.
+
+def create_torrent(**fields):
+    fields.setdefault('name', 'torrent')
+    fields.setdefault('magnet_link', f'magnet:?xt=urn:btih:{uuid.uuid4().hex[:32]}{"0" * 8}')
+    return TorrentDownload.objects.create(**fields)
+
+
+@override_settings(TORRENT_NODE_ID='node-a', TORRENT_LEASE_TTL=60)
+class LeaseTests(TestCase):
+    def expire(self, torrent):
+        TorrentLease.objects.filter(torrent=torrent).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+    def test_a_held_lease_is_not_claimed_again(self):
+        torrent = create_torrent()
+
+        self.assertIsNotNone(leases.claim_lease(torrent.id))
+        self.assertIsNone(leases.claim_lease(torrent.id))
+        with override_settings(TORRENT_NODE_ID='node-b'):
+            self.assertIsNone(leases.claim_lease(torrent.id))
+
+        torrent.refresh_from_db()
+        self.assertEqual(torrent.status, 'downloading')
+        self.assertEqual(TorrentLease.objects.get(torrent=torrent).node_id, 'node-a')
+
+    def test_torrents_no_longer_meant_to_download_are_not_claimed(self):
+        for status in ('completed', 'paused', 'failed'):
+            self.assertIsNone(leases.claim_lease(create_torrent(status=status).id))
+        self.assertFalse(TorrentLease.objects.exists())
+
+    def test_expired_lease_is_taken_over_and_the_old_task_loses_it(self):
+        torrent = create_torrent()
+        old_token = leases.claim_lease(torrent.id)
+        self.expire(torrent)
+
+        with override_settings(TORRENT_NODE_ID='node-b'), self.assertLogs('downloader.leases', level='INFO') as logs:
+            new_token = leases.claim_lease(torrent.id)
+
+        self.assertIsNotNone(new_token)
+        record = logs.records[0]
+        self.assertEqual((record.torrent_id, record.node, record.previous_node), (str(torrent.id), 'node-b', 'node-a'))
+
+        self.assertFalse(leases.renew_lease(torrent.id, old_token))
+        with override_settings(TORRENT_NODE_ID='node-b'):
+            self.assertTrue(leases.renew_lease(torrent.id, new_token))
+
+    def test_sweep_requeues_expired_and_unleased_downloads(self):
+        expired = create_torrent()
+        leases.claim_lease(expired.id)
+        self.expire(expired)
+        held = create_torrent()
+        leases.claim_lease(held.id)
+        unleased = create_torrent(status='downloading')
+        paused = create_torrent()
+        leases.claim_lease(paused.id)
+        self.expire(paused)
+        TorrentDownload.objects.filter(id=paused.id).update(status='paused')
+
+        requeued = leases.sweep_expired_leases()
+
+        self.assertEqual(sorted(requeued), sorted([str(expired.id), str(unleased.id)]))
+        for torrent, status in ((expired, 'pending'), (unleased, 'pending'), (held, 'downloading'), (paused, 'paused')):
+            torrent.refresh_from_db()
+            self.assertEqual(torrent.status, status)
+        self.assertEqual(list(TorrentLease.objects.values_list('torrent_id', flat=True)), [held.id])
+
+    def test_busier_node_defers_and_yields_its_newest_torrents(self):
+        EngineNode.objects.create(node_id='node-b', heartbeat_at=timezone.now())
+        torrents = [create_torrent() for _ in range(3)]
+        for age, torrent in zip((30, 20, 10), torrents):
+            leases.claim_lease(torrent.id)
+            TorrentLease.objects.filter(torrent=torrent).update(acquired_at=timezone.now() - timedelta(minutes=age))
+
+        self.assertTrue(leases.should_defer())
+        # Fair share is two of the three, only the newest goes back to the queue
+        self.assertTrue(leases.should_yield(torrents[2].id))
+        self.assertFalse(leases.should_yield(torrents[0].id))
+
+    def test_a_lone_node_keeps_everything(self):
+        torrent = create_torrent()
+        leases.claim_lease(torrent.id)
+
+        self.assertFalse(leases.should_defer())
+        self.assertFalse(leases.should_yield(torrent.id))
@@ -7,11 +7,11 @@ from django.utils.decorators import method_decorator
 from django.views.generic import ListView
 from django.core.paginator import Paginator
 import os
-import shutil
 import zipfile
+from django.conf import settings
 from .models import TorrentDownload
 from .forms import TorrentForm
-from .tasks import download_torrent, create_zip_file
+from .tasks import download_torrent, create_zip_file, delete_torrent_files
 
 class TorrentListView(ListView):
     model = TorrentDownload
@@ -71,21 +71,10 @@ def resume_torrent(request, torrent_id):
 def delete_torrent(request, torrent_id):
     torrent = get_object_or_404(TorrentDownload, id=torrent_id)
     
-    # Delete files if they exist
-    if torrent.file_path and os.path.exists(torrent.file_path):
-        try:
-            if os.path.isdir(torrent.file_path):
-                shutil.rmtree(torrent.file_path)
-            else:
-                os.remove(torrent.file_path)
-            
-            # Also delete zip file if exists
-            zip_path = f"{torrent.file_path}.zip"
-            if os.path.exists(zip_path):
-                os.remove(zip_path)
-                
-        except Exception as e:
-            messages.error(request, f'Error deleting files: {str(e)}')
+    # Files are removed on the cleanup queue, a running download sees its lease gone first
+    if torrent.file_path:
+        countdown = settings.TORRENT_LEASE_HEARTBEAT * 2 if torrent.status == 'downloading' else 0
+        delete_torrent_files.apply_async((torrent.file_path,), countdown=countdown)
     
     torrent_name = torrent.name
     torrent.delete()
@@ -112,12 +101,14 @@ def download_file(request, torrent_id):
         if not os.path.exists(zip_path):
             # Create zip file
             try:
-                with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                # Built under a temporary name so a half-written archive is never served
+                with zipfile.ZipFile(f"{zip_path}.{os.getpid()}.tmp", 'w', zipfile.ZIP_DEFLATED) as zipf:
                     for root, dirs, files in os.walk(file_path):
                         for file in files:
                             file_full_path = os.path.join(root, file)
                             arcname = os.path.relpath(file_full_path, file_path)
                             zipf.write(file_full_path, arcname)
+                os.replace(f"{zip_path}.{os.getpid()}.tmp", zip_path)
             except Exception as e:
                 messages.error(request, f'Error creating zip file: {str(e)}')
                 return redirect('torrent_list')
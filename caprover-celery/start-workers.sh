@@ -0,0 +1,13 @@
+#!/bin/bash
+# Beat runs as a single service: deploy this image once more as its own app with CELERY_ROLE=beat
+# and one instance, a scheduler on every worker node would send each periodic task once per node
+if [ "${CELERY_ROLE}" = "beat" ]; then
+    exec celery -A torrent_downloader beat --loglevel=info
+fi
+
+# One worker per queue with its own concurrency, the container stops when any of them dies
+celery -A torrent_downloader worker -Q engine -n engine@%h -c "${CELERY_ENGINE_CONCURRENCY:-4}" --loglevel=info &
+celery -A torrent_downloader worker -Q archive -n archive@%h -c "${CELERY_ARCHIVE_CONCURRENCY:-1}" --loglevel=info &
+celery -A torrent_downloader worker -Q cleanup -n cleanup@%h -c "${CELERY_CLEANUP_CONCURRENCY:-2}" --loglevel=info &
+wait -n
+exit $?
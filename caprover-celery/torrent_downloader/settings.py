@@ -11,6 +11,8 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from pathlib import Path
+from datetime import timedelta
+from decouple import config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -83,6 +85,17 @@ DATABASES = {
     }
 }
 
+# Several worker nodes share their leases through the database, so they need a shared one
+if config('POSTGRES_HOST', default=''):
+    DATABASES['default'] = {
+        "ENGINE": "django.db.backends.postgresql",
+        "HOST": config('POSTGRES_HOST'),
+        "PORT": config('POSTGRES_PORT', default=5432, cast=int),
+        "NAME": config('POSTGRES_DB', default='torrent_downloader'),
+        "USER": config('POSTGRES_USER', default='postgres'),
+        "PASSWORD": config('POSTGRES_PASSWORD', default=''),
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -125,8 +138,19 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
 # Torrent Settings
-TORRENT_DOWNLOAD_DIR = BASE_DIR / 'downloads'
-TORRENT_DOWNLOAD_DIR.mkdir(exist_ok=True)
+# Point both at shared storage when running more than one worker node
+TORRENT_DOWNLOAD_DIR = Path(config('TORRENT_DOWNLOAD_DIR', default=str(BASE_DIR / 'downloads')))
+TORRENT_DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
+TORRENT_STATE_DIR = Path(config('TORRENT_STATE_DIR', default=str(TORRENT_DOWNLOAD_DIR / '.state')))
+TORRENT_STATE_DIR.mkdir(parents=True, exist_ok=True)
+TORRENT_RESUME_DATA_INTERVAL = config('TORRENT_RESUME_DATA_INTERVAL', default=60, cast=int)  # seconds
+
+# Engine Cluster Settings
+TORRENT_NODE_ID = config('TORRENT_NODE_ID', default='')  # defaults to the hostname
+TORRENT_LEASE_TTL = config('TORRENT_LEASE_TTL', default=60, cast=int)  # seconds without heartbeat before takeover
+TORRENT_LEASE_HEARTBEAT = config('TORRENT_LEASE_HEARTBEAT', default=15, cast=int)  # seconds
+TORRENT_LEASE_MAX_DEFERRALS = config('TORRENT_LEASE_MAX_DEFERRALS', default=5, cast=int)
+TORRENT_LEASE_DEFER_DELAY = config('TORRENT_LEASE_DEFER_DELAY', default=10, cast=int)  # seconds
 
 # Celery Configuration
 CELERY_BROKER_URL = 'redis://:Bd&&969696@srv-captain--torrent-redis:6379/0'
@@ -136,5 +160,30 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 
+# Queues: engine (multi-hour downloads), archive (CPU-heavy zips), cleanup (file
+# deletion and maintenance). start-workers.sh runs one worker per queue so short
+# jobs never wait behind downloads.
+CELERY_TASK_DEFAULT_QUEUE = 'cleanup'
+CELERY_TASK_ROUTES = {
+    'downloader.tasks.download_torrent': {'queue': 'engine'},
+    'downloader.tasks.create_zip_file': {'queue': 'archive'},
+    'downloader.tasks.delete_torrent_files': {'queue': 'cleanup'},
+    'downloader.tasks.sweep_expired_leases': {'queue': 'cleanup'},
+}
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+CELERY_TASK_IGNORE_RESULT = True  # nothing reads task results
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1  # a worker slot never reserves tasks behind a download
+# Unacked tasks are redelivered after this, downloads are protected by their lease anyway
+CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': config('CELERY_VISIBILITY_TIMEOUT', default=12 * 3600, cast=int)}
+CELERY_ARCHIVE_RATE_LIMIT = config('CELERY_ARCHIVE_RATE_LIMIT', default='10/m')
+CELERY_CLEANUP_RATE_LIMIT = config('CELERY_CLEANUP_RATE_LIMIT', default='60/m')
+CELERY_BEAT_SCHEDULE = {
+    'sweep-expired-leases': {
+        'task': 'downloader.tasks.sweep_expired_leases',
+        'schedule': timedelta(seconds=TORRENT_LEASE_TTL),
+    },
+}
+
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
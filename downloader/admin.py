@@ -1,27 +1,75 @@
 from django.contrib import admin
-from .models import TorrentDownload
+from .models import TorrentDownload, TorrentLiveStatus, DeletionJob, ContentFile, VerifyJob, BandwidthSettings, BandwidthSchedule
+
+class TorrentLiveStatusInline(admin.StackedInline):
+    model = TorrentLiveStatus
+    can_delete = False
+    readonly_fields = ['progress', 'progress_percentage', 'download_speed', 'upload_speed', 'downloaded', 'peers', 'seeds', 'eta_seconds', 'eta_display', 'uploaded', 'seed_time', 'status_message']
+    fields = readonly_fields
 
 @admin.register(TorrentDownload)
 class TorrentDownloadAdmin(admin.ModelAdmin):
-    list_display = ['name', 'status', 'progress_percentage', 'size_human', 'created_at']
-    list_filter = ['status', 'is_multi_file', 'created_at']
+    list_display = ['name', 'status', 'priority', 'queue_position', 'progress_percentage', 'size_human', 'created_at']
+    list_filter = ['status', 'priority', 'is_multi_file', 'created_at']
     search_fields = ['name', 'magnet_link']
     readonly_fields = ['id', 'created_at', 'completed_at', 'progress_percentage', 'size_human', 'downloaded_human']
+    list_select_related = ['live']
+    inlines = [TorrentLiveStatusInline]
     
     fieldsets = (
         ('Basic Info', {
-            'fields': ('name', 'magnet_link', 'status')
+            'fields': ('name', 'magnet_link', 'web_seeds', 'status', 'status_message', 'priority', 'queue_position')
         }),
-        ('Download Progress', {
-            'fields': ('progress', 'progress_percentage', 'download_speed', 'upload_speed')
+        ('Seeding', {
+            'fields': ('is_seeding', 'uploaded', 'seed_time')
         }),
         ('File Info', {
-            'fields': ('size', 'size_human', 'downloaded', 'downloaded_human', 'is_multi_file', 'file_path')
+            'fields': ('size', 'size_human', 'downloaded_human', 'is_multi_file', 'save_path', 'file_path')
+        }),
+        ('Retries', {
+            'fields': ('retry_count', 'next_retry_at')
         }),
-        ('Network Info', {
-            'fields': ('peers', 'seeds', 'eta')
+        ('Swarm Health', {
+            'fields': ('swarm_seeders', 'swarm_leechers', 'swarm_completed', 'swarm_dht_peers', 'swarm_checked_at', 'swarm_recheck_at')
+        }),
+        ('Bandwidth', {
+            'fields': ('download_limit', 'upload_limit', 'bandwidth_priority')
         }),
         ('Timestamps', {
             'fields': ('created_at', 'completed_at')
         }),
-    )
\ No newline at end of file
+    )
+
+
+@admin.register(DeletionJob)
+class DeletionJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'status', 'processed', 'total', 'bytes_freed', 'created_at', 'finished_at']
+    list_filter = ['status', 'created_at']
+    readonly_fields = ['id', 'created_at', 'finished_at']
+
+
+@admin.register(ContentFile)
+class ContentFileAdmin(admin.ModelAdmin):
+    list_display = ['path', 'size', 'sha256', 'linked', 'created_at']
+    list_filter = ['linked']
+    search_fields = ['path', 'sha256']
+    raw_id_fields = ['torrent']
+
+
+@admin.register(VerifyJob)
+class VerifyJobAdmin(admin.ModelAdmin):
+    list_display = ['torrent', 'status', 'checked_pieces', 'total_pieces', 'repair_pending', 'created_at']
+    list_filter = ['status', 'repair_pending']
+    readonly_fields = ['id', 'created_at', 'finished_at']
+    raw_id_fields = ['torrent']
+
+
+@admin.register(BandwidthSettings)
+class BandwidthSettingsAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'download_limit', 'upload_limit', 'schedule_enabled']
+
+
+@admin.register(BandwidthSchedule)
+class BandwidthScheduleAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'day_of_week', 'start_time', 'end_time', 'download_limit', 'upload_limit']
+    list_filter = ['day_of_week']
@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
 
 
 class DownloaderConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "downloader"
+
+    def ready(self):
+        from .database import configure_connection
+        from .recovery import recover_embedded_engine
+
+        connection_created.connect(configure_connection, dispatch_uid='downloader.configure_connection')
+        # Not at import: only the worker that turns out to hold the embedded engine may recover
+        request_started.connect(recover_embedded_engine, dispatch_uid='downloader.recover_embedded_engine')
@@ -0,0 +1,129 @@
+# downloader/bandwidth.py - Global, per-torrent and time-of-day bandwidth limits
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from .models import TorrentDownload, BandwidthSettings, BandwidthSchedule
+from . import session, shards
+
+logger = logging.getLogger(__name__)
+
+# Per-torrent (download, upload) caps in KB/s from the priority share, read by download loops
+torrent_caps = {}
+
+# Last (download, upload) global limits pushed to the session
+_applied_limits = None
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def active_window(now=None):
+    """Schedule window covering a moment, None outside all windows or with the schedule off"""
+
+    now = timezone.localtime(now)
+    if not BandwidthSettings.load().schedule_enabled:
+        return None
+
+    # Yesterday's windows may run past midnight into today
+    for window in BandwidthSchedule.objects.filter(day_of_week__in=[now.weekday(), (now.weekday() - 1) % 7]):
+        if window.is_active(now):
+            return window
+    return None
+
+
+def global_limits(now=None):
+    """Global (download, upload) limits in KB/s, a matching schedule window wins over the base limits"""
+
+    window = active_window(now)
+    if window is not None:
+        return window.download_limit, window.upload_limit
+
+    base = BandwidthSettings.load()
+    return base.download_limit, base.upload_limit
+
+
+def apply_limits():
+    """Push global limits into the session and recompute priority shares"""
+
+    global _applied_limits
+    download_limit, upload_limit = global_limits()
+
+    if (download_limit, upload_limit) != _applied_limits:
+        # Every engine shard has its own session, together they stay within the global limits
+        session.get_session().apply_settings({
+            'download_rate_limit': shards.rate_share(download_limit) * 1024,
+            'upload_rate_limit': shards.rate_share(upload_limit) * 1024,
+        })
+        _applied_limits = (download_limit, upload_limit)
+        logger.info(
+            "Global limits: down %s, up %s",
+            f"{download_limit} KB/s" if download_limit else 'unlimited',
+            f"{upload_limit} KB/s" if upload_limit else 'unlimited',
+        )
+
+    torrent_caps.clear()
+    torrent_caps.update(priority_caps(download_limit, upload_limit))
+
+
+def priority_caps(download_limit, upload_limit):
+    """Cap normal torrents to what priority torrents leave over while any are downloading
+
+    The Python bindings can't put a torrent into a libtorrent peer class, so
+    the share is enforced with per-torrent rate limits instead.
+    """
+
+    active = TorrentDownload.objects.filter(status='downloading').values_list('id', 'bandwidth_priority')
+    normal = [str(torrent_id) for torrent_id, priority in active if not priority]
+    if len(normal) == len(active) or not normal:
+        return {}
+
+    leftover = 1 - settings.TORRENT_PRIORITY_BANDWIDTH_SHARE
+    download_cap = int(download_limit * leftover / len(normal)) if download_limit else 0
+    upload_cap = int(upload_limit * leftover / len(normal)) if upload_limit else 0
+    # 1 KB/s minimum so a cap never turns into "unlimited"
+    return {
+        torrent_id: (max(1, download_cap) if download_limit else 0, max(1, upload_cap) if upload_limit else 0)
+        for torrent_id in normal
+    }
+
+
+def combine_limits(*limits):
+    """Tightest of several limits where 0 means unlimited"""
+
+    active = [limit for limit in limits if limit]
+    return min(active) if active else 0
+
+
+def torrent_limits(torrent):
+    """Effective (download, upload) limits in KB/s for a torrent, 0 = unlimited"""
+
+    cap_down, cap_up = torrent_caps.get(str(torrent.id), (0, 0))
+    return (
+        combine_limits(torrent.download_limit, cap_down),
+        combine_limits(torrent.upload_limit, cap_up),
+    )
+
+
+def start_bandwidth_scheduler():
+    """Re-evaluate the weekly schedule and priority shares in the background"""
+
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is not None and _scheduler.is_alive():
+            return
+
+        def run():
+            while True:
+                try:
+                    apply_limits()
+                except Exception as e:
+                    logger.warning("Applying bandwidth limits failed: %s", e)
+                finally:
+                    close_old_connections()
+                time.sleep(settings.TORRENT_BANDWIDTH_INTERVAL)
+
+        _scheduler = threading.Thread(target=run)
+        _scheduler.daemon = True
+        _scheduler.start()
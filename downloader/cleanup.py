@@ -0,0 +1,174 @@
+# downloader/cleanup.py - Background deletion of torrents and their files
+import logging
+import os
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from .models import TorrentDownload, DeletionJob
+from .engine import dispatch_queue
+from . import dedup, executors, seeding, shards, storage
+
+logger = logging.getLogger(__name__)
+
+
+def start_deletion_job(torrents):
+    """Mark torrents as deleting and remove them in a background thread"""
+
+    # Remember each row's status so the ones that can't be deleted get it back
+    previous_statuses = {
+        str(pk): status for pk, status in torrents.exclude(status='deleting').values_list('id', 'status')
+    }
+    TorrentDownload.objects.filter(id__in=list(previous_statuses)).update(status='deleting')
+
+    job = DeletionJob.objects.create(total=len(previous_statuses))
+
+    thread = threading.Thread(target=run_deletion_job, args=(str(job.id), previous_statuses))
+    thread.daemon = True
+    thread.start()
+
+    return job
+
+
+def run_deletion_job(job_id, previous_statuses):
+    """Release engine handles, remove files with throttling and delete rows in batches"""
+
+    job = DeletionJob.objects.get(id=job_id)
+    job.status = 'running'
+    job.save(update_fields=['status'])
+
+    torrent_ids = list(previous_statuses)
+    batch_size = max(1, settings.TORRENT_DELETE_BATCH_SIZE)
+    throttle = FileThrottle(settings.TORRENT_DELETE_MAX_FILES_PER_SECOND)
+    errors = []
+
+    # Engine shards and Celery workers can't be joined, give them time to see the status and drop handles
+    if not shards.runs_engine() or not executors.current().local:
+        time.sleep(settings.TORRENT_ENGINE_RELEASE_GRACE)
+
+    try:
+        for start in range(0, len(torrent_ids), batch_size):
+            batch = torrent_ids[start:start + batch_size]
+            deleted = []
+
+            for torrent in TorrentDownload.objects.filter(id__in=batch):
+                try:
+                    wait_for_engine_release(str(torrent.id))
+
+                    if torrent.file_path:
+                        files, freed = delete_torrent_files(torrent.file_path, throttle, dedup.shared_paths(torrent))
+                        job.files_deleted += files
+                        job.bytes_freed += freed
+                    storage.remove_state_files(str(torrent.id))
+                    deleted.append(torrent.id)
+                except Exception as e:
+                    logger.error("Deleting torrent failed: %s", e, extra={'torrent_id': str(torrent.id)})
+                    errors.append(f"{torrent.name}: {e}")
+                    restore_statuses({str(torrent.id): previous_statuses[str(torrent.id)]})
+
+            TorrentDownload.objects.filter(id__in=deleted).delete()
+
+            job.processed += len(batch)
+            job.error = '\n'.join(errors)
+            job.save(update_fields=['processed', 'files_deleted', 'bytes_freed', 'error'])
+
+        job.status = 'failed' if errors else 'completed'
+    except Exception as e:
+        logger.error("Deletion job %s failed: %s", job_id, e)
+        job.status = 'failed'
+        errors.append(str(e))
+        job.error = '\n'.join(errors)
+
+        # Rows the job never got to go back to what they were
+        unprocessed = torrent_ids[job.processed:]
+        try:
+            restore_statuses({pk: previous_statuses[pk] for pk in unprocessed})
+        except Exception as e:
+            logger.error("Restoring statuses after deletion job %s failed: %s", job_id, e)
+    finally:
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at'])
+
+        # Freed space may admit torrents waiting in the queue
+        try:
+            dispatch_queue()
+        except Exception as e:
+            logger.warning("Queue dispatch failed: %s", e)
+        close_old_connections()
+
+
+def restore_statuses(previous_statuses):
+    """Put rows still marked deleting back to the status they had before the job"""
+
+    by_status = {}
+    for pk, status in previous_statuses.items():
+        # The download job already dropped its handle, the queue has to start it again
+        if status == 'downloading':
+            status = 'pending'
+        by_status.setdefault(status, []).append(pk)
+    for status, ids in by_status.items():
+        TorrentDownload.objects.filter(id__in=ids, status='deleting').update(status=status)
+
+
+def wait_for_engine_release(torrent_id):
+    """Wait until the download job has seen the deleting status and dropped its handle"""
+
+    executor = executors.current()
+    if not executor.wait(torrent_id, settings.TORRENT_DELETE_ENGINE_WAIT):
+        logger.warning("Download job still running, deleting files anyway", extra={'torrent_id': str(torrent_id)})
+
+    executor.forget(torrent_id)
+    seeding.stop_seeding(torrent_id)
+
+
+def delete_torrent_files(file_path, throttle, shared=()):
+    """Remove a torrent's data (and zip archive) file by file, returning (files, bytes) freed"""
+
+    files_deleted = 0
+    bytes_freed = 0
+
+    paths = [file_path, f"{file_path}.zip"]
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, file_names in os.walk(path, topdown=False):
+                for file_name in file_names:
+                    full_path = os.path.join(root, file_name)
+                    bytes_freed += remove_file(full_path, full_path in shared)
+                    files_deleted += 1
+                    throttle.wait()
+                for dir_name in dirs:
+                    os.rmdir(os.path.join(root, dir_name))
+            os.rmdir(path)
+        elif os.path.exists(path):
+            bytes_freed += remove_file(path, path in shared)
+            files_deleted += 1
+            throttle.wait()
+
+    return files_deleted, bytes_freed
+
+
+def remove_file(path, shared=False):
+    """Unlink a file and return the number of bytes actually released"""
+
+    stat = os.lstat(path)
+    os.remove(path)
+    # Other hardlinks or reflinked copies keep the data alive, so nothing is freed yet
+    return stat.st_size if stat.st_nlink <= 1 and not shared else 0
+
+
+class FileThrottle:
+    """Limit unlink calls to a fixed rate so deletes don't starve download I/O"""
+
+    def __init__(self, max_per_second):
+        self.interval = 1.0 / max_per_second if max_per_second > 0 else 0
+        self.next_allowed = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if now < self.next_allowed:
+            time.sleep(self.next_allowed - now)
+            now = self.next_allowed
+        self.next_allowed = now + self.interval
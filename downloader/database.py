@@ -0,0 +1,21 @@
+# downloader/database.py - Per-connection database tuning
+# WAL lets web requests read while a download thread writes, NORMAL only
+# syncs at checkpoints which is safe in WAL mode and far cheaper per tick
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+]
+
+
+def configure_connection(sender, connection, **kwargs):
+    """connection_created handler applying the SQLite pragmas to every new connection"""
+
+    if connection.vendor != 'sqlite':
+        return
+
+    timeout = connection.settings_dict.get('OPTIONS', {}).get('timeout', 20)
+    with connection.cursor() as cursor:
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.execute(f'PRAGMA busy_timeout={int(timeout * 1000)}')
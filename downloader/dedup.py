@@ -0,0 +1,281 @@
+# downloader/dedup.py - Cross-torrent file deduplication with a content index
+import fcntl
+import filecmp
+import logging
+import os
+import shutil
+import threading
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count
+from .models import TorrentDownload, ContentFile
+from .hashing import process_pool, hash_file
+
+logger = logging.getLogger(__name__)
+
+# ioctl request number for cloning a file's extents (Linux, btrfs/XFS)
+FICLONE = 0x40049409
+
+# Background deduplication threads of this process, jobs that end with their process wait for them
+_threads = []
+_threads_lock = threading.Lock()
+
+
+def start_deduplication(torrent_id):
+    """Index and deduplicate a completed torrent in the background"""
+
+    if not settings.TORRENT_DEDUP_ENABLED:
+        return None
+
+    thread = threading.Thread(target=deduplicate_torrent, args=(torrent_id,))
+    thread.daemon = True
+    thread.start()
+    with _threads_lock:
+        _threads[:] = [running for running in _threads if running.is_alive()] + [thread]
+    return thread
+
+
+def wait_for_deduplication():
+    """Block until this process's deduplication threads are done"""
+
+    with _threads_lock:
+        threads = list(_threads)
+    for thread in threads:
+        thread.join()
+
+
+def deduplicate_torrent(torrent_id):
+    """Add a torrent's files to the content index and link files identical to indexed ones"""
+
+    try:
+        torrent = TorrentDownload.objects.get(id=torrent_id)
+        entries = index_torrent_files(torrent)
+        if not entries:
+            return 0
+
+        hash_colliding_files({entry.size for entry in entries})
+
+        saved = 0
+        for entry in ContentFile.objects.filter(torrent=torrent).exclude(sha256=''):
+            saved += link_duplicate(entry)
+
+        logger.info("Deduplicated %s: %s reclaimed", torrent.name, TorrentDownload.format_bytes(saved), extra={'torrent_id': str(torrent.id)})
+        return saved
+    except Exception as e:
+        logger.error("Deduplication failed: %s", e, extra={'torrent_id': str(torrent_id)})
+        return 0
+    finally:
+        close_old_connections()
+
+
+def index_torrent_files(torrent):
+    """Record every file of a torrent above the size threshold, without hashing yet"""
+
+    ContentFile.objects.filter(torrent=torrent).delete()
+
+    if not torrent.file_path or not os.path.exists(torrent.file_path):
+        return []
+
+    if os.path.isdir(torrent.file_path):
+        paths = [
+            os.path.join(root, file_name)
+            for root, dirs, file_names in os.walk(torrent.file_path)
+            for file_name in file_names
+        ]
+    else:
+        paths = [torrent.file_path]
+
+    entries = []
+    for path in paths:
+        if os.path.islink(path):
+            continue
+        size = os.path.getsize(path)
+        if size >= settings.TORRENT_DEDUP_MIN_FILE_SIZE:
+            entries.append(ContentFile(torrent=torrent, path=path, size=size))
+
+    return ContentFile.objects.bulk_create(entries)
+
+
+def hash_colliding_files(sizes):
+    """Hash every unhashed indexed file whose size is shared with another file"""
+
+    # A file with a unique size can't have a duplicate, so it is never read
+    colliding_sizes = (
+        ContentFile.objects.filter(size__in=sizes)
+        .values('size')
+        .annotate(count=Count('id'))
+        .filter(count__gt=1)
+        .values_list('size', flat=True)
+    )
+    pending = {
+        entry.path: entry
+        for entry in ContentFile.objects.filter(size__in=list(colliding_sizes), sha256='')
+        if os.path.exists(entry.path)
+    }
+    if not pending:
+        return
+
+    with process_pool(settings.TORRENT_HASH_WORKERS) as pool:
+        for path, digest in pool.map(hash_file, pending, chunksize=4):
+            pending[path].sha256 = digest
+
+    ContentFile.objects.bulk_update(pending.values(), ['sha256'], batch_size=500)
+
+
+def link_duplicate(entry):
+    """Replace a file with a link to the oldest identical indexed file, returning bytes saved"""
+
+    candidates = (
+        ContentFile.objects.filter(size=entry.size, sha256=entry.sha256)
+        .exclude(id=entry.id)
+        .order_by('created_at', 'id')
+    )
+    for source in candidates:
+        if not os.path.exists(source.path):
+            continue
+
+        if os.path.samefile(source.path, entry.path):
+            saved = 0
+        else:
+            if os.stat(source.path).st_dev != os.stat(entry.path).st_dev:
+                continue  # links can't cross filesystems
+            link_file(source.path, entry.path)
+            saved = entry.size
+
+        entry.linked = True
+        entry.save(update_fields=['linked'])
+        return saved
+
+    return 0
+
+
+def link_file(source, target, method=None):
+    """Atomically replace target with a reflink or hardlink of source"""
+
+    temp_path = f"{target}.dedup"
+    try:
+        if (method or settings.TORRENT_DEDUP_METHOD) == 'reflink':
+            try:
+                reflink(source, temp_path)
+            except OSError:
+                # Filesystem without extent sharing, fall back to a hardlink
+                os.link(source, temp_path)
+        else:
+            os.link(source, temp_path)
+        os.replace(temp_path, target)
+    except OSError:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def reflink(source, target):
+    """Copy-on-write clone of source at target"""
+
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            os.remove(target)
+            raise
+
+
+def shared_paths(torrent):
+    """A torrent's files whose content another torrent still shares, through a link st_nlink can't see"""
+
+    shared = set()
+    for entry in ContentFile.objects.filter(torrent=torrent).exclude(sha256=''):
+        others = ContentFile.objects.filter(size=entry.size, sha256=entry.sha256).exclude(torrent=torrent)
+        # Linked entries point at the oldest copy, which is either this file or one of the others
+        if others.exists() and (entry.linked or others.filter(linked=True).exists()):
+            shared.add(entry.path)
+    return shared
+
+
+def break_links(torrent):
+    """Give a torrent private copies of its hardlinked files before libtorrent writes pieces into them"""
+
+    if not torrent.file_path or not os.path.exists(torrent.file_path):
+        return 0
+
+    if os.path.isdir(torrent.file_path):
+        paths = [
+            os.path.join(root, file_name)
+            for root, dirs, file_names in os.walk(torrent.file_path)
+            for file_name in file_names
+        ]
+    else:
+        paths = [torrent.file_path]
+
+    broken = 0
+    for path in paths:
+        if os.path.islink(path) or os.stat(path).st_nlink <= 1:
+            continue
+        temp_path = f"{path}.dedup"
+        try:
+            shutil.copy2(path, temp_path)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.lexists(temp_path):
+                os.remove(temp_path)
+            raise
+        broken += 1
+
+    # Reflinks are copy-on-write already, only the hardlinks needed copying
+    ContentFile.objects.filter(torrent=torrent, linked=True).update(linked=False)
+    if broken:
+        logger.info("Copied %d hardlinked files before repair", broken, extra={'torrent_id': str(torrent.id)})
+    return broken
+
+
+def archive_manifest(torrent):
+    """Sorted (relative path, size, sha256) of every file of a multi-file torrent, sha256 empty when not hashed"""
+
+    hashes = dict(ContentFile.objects.filter(torrent=torrent).values_list('path', 'sha256'))
+    manifest = []
+    for root, dirs, file_names in os.walk(torrent.file_path):
+        for file_name in file_names:
+            path = os.path.join(root, file_name)
+            manifest.append((os.path.relpath(path, torrent.file_path), os.path.getsize(path), hashes.get(path, '')))
+    return sorted(manifest)
+
+
+def reuse_archive(torrent, zip_path):
+    """Hardlink the zip of a torrent with identical content to zip_path, returning whether one was found"""
+
+    if not settings.TORRENT_DEDUP_ENABLED:
+        return False
+
+    manifest = archive_manifest(torrent)
+    hashed = [sha256 for path, size, sha256 in manifest if sha256]
+    if not hashed:
+        return False
+
+    # Any file of the same size elsewhere got hashed, so an identical torrent shares every hash
+    candidates = (
+        TorrentDownload.objects.filter(status='completed', is_multi_file=True, content_files__sha256=hashed[0])
+        .exclude(id=torrent.id)
+        .distinct()
+    )
+    for other in candidates:
+        other_zip = f"{other.file_path}.zip"
+        if not os.path.exists(other_zip) or archive_manifest(other) != manifest:
+            continue
+
+        # Files below the index threshold were never hashed, compare those byte for byte
+        small_files_match = all(
+            filecmp.cmp(os.path.join(torrent.file_path, path), os.path.join(other.file_path, path), shallow=False)
+            for path, size, sha256 in manifest if not sha256
+        )
+        if not small_files_match:
+            continue
+
+        try:
+            # Always a hardlink, so deleting either copy frees nothing while the other remains
+            link_file(other_zip, zip_path, method='hardlink')
+        except OSError:
+            continue
+        logger.info("Reused the archive of %s", other.name, extra={'torrent_id': str(torrent.id)})
+        return True
+
+    return False
@@ -0,0 +1,146 @@
+# downloader/diagnostics.py - Per-peer, tracker and piece state of a running torrent for troubleshooting
+import base64
+from . import session
+
+# peer_info flags reported by name, in the order libtorrent documents them
+PEER_FLAGS = (
+    'interesting', 'choked', 'remote_interested', 'remote_choked', 'supports_extensions',
+    'outgoing_connection', 'handshake', 'connecting', 'on_parole', 'seed', 'optimistic_unchoke',
+    'snubbed', 'upload_only', 'endgame_mode', 'holepunched', 'rc4_encrypted', 'plaintext_encrypted',
+)
+
+# peer_info source bits, incoming peers are the ones without the outgoing_connection flag
+PEER_SOURCES = ('tracker', 'dht', 'pex', 'lsd', 'resume_data')
+
+# Availability is sent as one byte per piece when run-length encoding would not be smaller
+AVAILABILITY_MAX = 255
+
+
+def find_handle(torrent):
+    """The live handle of a torrent in this process's session, None if it isn't loaded here"""
+
+    ses = session.running_session()
+    if ses is None:
+        return None
+
+    import libtorrent as lt
+
+    try:
+        info_hash = lt.parse_magnet_uri(torrent.magnet_link).info_hashes.get_best()
+        handle = ses.find_torrent(info_hash)
+    except Exception:
+        return None
+    return handle if handle.is_valid() else None
+
+
+def encode_bitfield(pieces):
+    """Have-bits packed eight pieces per byte, first piece in the high bit, as base64"""
+
+    packed = bytearray((len(pieces) + 7) // 8)
+    for index, have in enumerate(pieces):
+        if have:
+            packed[index >> 3] |= 0x80 >> (index & 7)
+    return base64.b64encode(bytes(packed)).decode()
+
+
+def encode_runs(values):
+    """Flat [value, count, value, count, ...] runs, short for the long equal stretches swarms have"""
+
+    runs = []
+    for value in values:
+        if runs and runs[-2] == value:
+            runs[-1] += 1
+        else:
+            runs += [value, 1]
+    return runs
+
+
+def encode_availability(values):
+    """Peer counts per piece as runs, or as base64 bytes capped at 255 when those are smaller"""
+
+    runs = encode_runs(values)
+    # A run costs two JSON numbers, a base64 byte a bit over one character
+    if len(runs) <= len(values) // 2:
+        return {'encoding': 'rle', 'data': runs}
+    capped = bytes(min(value, AVAILABILITY_MAX) for value in values)
+    return {'encoding': 'bytes', 'data': base64.b64encode(capped).decode()}
+
+
+def peer_flags(flags, names):
+    import libtorrent as lt
+
+    return [name for name in names if flags & getattr(lt.peer_info, name)]
+
+
+def peers(handle):
+    """One entry per connected peer, rates in bytes/s"""
+
+    entries = []
+    for peer in handle.get_peer_info():
+        client = peer.client.decode(errors='replace') if isinstance(peer.client, bytes) else peer.client
+        entries.append({
+            'address': f"{peer.ip[0]}:{peer.ip[1]}",
+            'client': client,
+            'down_speed': peer.down_speed,
+            'up_speed': peer.up_speed,
+            'total_download': peer.total_download,
+            'total_upload': peer.total_upload,
+            'progress': round(peer.progress, 4),
+            'flags': peer_flags(peer.flags, PEER_FLAGS),
+            'sources': peer_flags(peer.source, PEER_SOURCES),
+            'download_queue': peer.download_queue_length,
+            'hashfails': peer.num_hashfails,
+            'rtt': peer.rtt,
+        })
+    entries.sort(key=lambda entry: entry['down_speed'] + entry['up_speed'], reverse=True)
+    return entries
+
+
+def trackers(handle):
+    """Announce state per tracker, errors taken from the first endpoint that has one"""
+
+    entries = []
+    for tracker in handle.trackers():
+        message = tracker.get('message', '')
+        fails = tracker.get('fails', 0)
+        updating = tracker.get('updating', False)
+        for endpoint in tracker.get('endpoints', []):
+            fails = max(fails, endpoint.get('fails', 0))
+            updating = updating or endpoint.get('updating', False)
+            if not message:
+                message = endpoint.get('message', '')
+                error = endpoint.get('last_error', {})
+                if not message and error.get('value'):
+                    message = f"{error.get('category')} error {error.get('value')}"
+
+        entries.append({
+            'url': tracker['url'],
+            'tier': tracker.get('tier', 0),
+            'verified': tracker.get('verified', False),
+            'updating': updating,
+            'fails': fails,
+            'message': message,
+            'seeders': tracker.get('scrape_complete', -1),
+            'leechers': tracker.get('scrape_incomplete', -1),
+        })
+    return entries
+
+
+def snapshot(handle):
+    """Everything the detail page diagnostics panel shows, sized for torrents of 100k+ pieces"""
+
+    import libtorrent as lt
+
+    status = handle.status(lt.status_flags_t.query_pieces)
+    pieces = list(status.pieces)
+
+    return {
+        'num_pieces': len(pieces),
+        'pieces_done': status.num_pieces,
+        'pieces': encode_bitfield(pieces),
+        'availability': encode_availability(handle.piece_availability()),
+        'partial_pieces': len(handle.get_download_queue()),
+        'distributed_copies': round(status.distributed_copies, 3),
+        'peers': peers(handle),
+        'trackers': trackers(handle),
+    }
@@ -0,0 +1,661 @@
+# downloader/engine.py - Background download engine and queue
+import logging
+import os
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import TorrentDownload, TorrentLiveStatus
+from . import bandwidth, dedup, diagnostics, events, executors, health, history, metrics, seeding, session, shards, storage, swarm
+
+logger = logging.getLogger(__name__)
+
+# Serializes queue dispatching between request and download threads
+_dispatch_lock = threading.Lock()
+
+# Pending torrents start by priority, then swarms known to be alive, then queue position
+QUEUE_ORDER = ('-priority', '-swarm_rank', 'queue_position', 'created_at')
+
+_queue_ticker = None
+_queue_ticker_lock = threading.Lock()
+
+# Set while an engine process shuts down, nothing new is started
+_draining = False
+
+
+def start_download(torrent_id):
+    """Hand a torrent to the configured executor, False if another dispatcher got it first"""
+
+    return executors.current().submit(torrent_id, release_slot)
+
+
+def active_download_count():
+    """Number of download jobs currently holding a slot"""
+
+    return len(executors.current().running())
+
+
+def dispatch_queue():
+    """Start pending torrents while slots are free and the admission controller allows it"""
+
+    # With an external engine the web tier only enqueues, the shards pick the rows up
+    if not shards.runs_engine() or _draining:
+        return []
+
+    start_queue_ticker()
+    swarm.start_scrape_worker()
+    # One pass over every torrent's history is enough, the other shards skip it
+    if shards.is_primary():
+        history.start_pruning_worker()
+
+    started = []
+    with _dispatch_lock:
+        # A Celery job lost with its worker holds a slot only until its lease runs out
+        reclaimed = executors.current().reclaim()
+        if reclaimed:
+            logger.warning("Requeued %d downloads whose worker stopped responding", reclaimed)
+
+        slots = shards.download_slots() - active_download_count()
+        waiting_critical = 0
+
+        # Stalled torrents sit out their retry backoff, dead swarms wait for their next scrape
+        now = timezone.now()
+        ready = Q(next_retry_at__isnull=True) | Q(next_retry_at__lte=now)
+        alive = Q(swarm_recheck_at__isnull=True) | Q(swarm_recheck_at__lte=now)
+        # Admission reads each torrent's downloaded bytes, the live row comes along in the same query
+        queued = (
+            TorrentDownload.objects.filter(ready, alive, status='pending')
+            .select_related('live')
+            .annotate(swarm_rank=swarm.health_rank())
+        )
+        for torrent in queued.order_by(*QUEUE_ORDER):
+            torrent_id = str(torrent.id)
+            if executors.current().is_running(torrent_id) or not shards.owns(torrent):
+                continue
+
+            if slots <= 0:
+                if torrent.priority == TorrentDownload.PRIORITY_CRITICAL:
+                    waiting_critical += 1
+                    continue
+                break
+
+            volume, reason = storage.place_torrent(torrent)
+            if volume is None:
+                if torrent.status_message != reason:
+                    TorrentDownload.objects.filter(id=torrent.id).update(status_message=reason)
+                continue
+
+            if torrent.save_path != volume:
+                TorrentDownload.objects.filter(id=torrent.id).update(save_path=volume)
+
+            if start_download(torrent_id):
+                started.append(torrent_id)
+                slots -= 1
+
+        if waiting_critical:
+            # Torrents preempted earlier that are still shutting down already promise a slot
+            running = executors.current().running()
+            stopping = TorrentDownload.objects.filter(id__in=running).exclude(status='downloading').count()
+            if waiting_critical > stopping:
+                preempt_downloads(waiting_critical - stopping, running)
+
+    return started
+
+
+def start_queue_ticker():
+    """Dispatch the queue periodically so torrents come back once their retry backoff expires"""
+
+    global _queue_ticker
+    with _queue_ticker_lock:
+        if _queue_ticker is not None and _queue_ticker.is_alive():
+            return
+
+        def run():
+            while True:
+                time.sleep(settings.TORRENT_QUEUE_INTERVAL)
+                try:
+                    dispatch_queue()
+                    # Seeds download jobs handed back since the last tick
+                    seeding.adopt()
+                except Exception as e:
+                    logger.warning("Queue dispatch failed: %s", e)
+                finally:
+                    close_old_connections()
+
+        _queue_ticker = threading.Thread(target=run)
+        _queue_ticker.daemon = True
+        _queue_ticker.start()
+
+
+def preempt_downloads(count, running):
+    """Send the least important running torrents back to the queue to free slots for critical ones
+
+    Their download jobs notice the status change on the next tick, save
+    resume data and release the slot, which dispatches the critical torrent.
+    Only torrents started by this process's executor free a slot here.
+    """
+
+    victims = list(
+        TorrentDownload.objects.filter(id__in=running, status='downloading', priority__lt=TorrentDownload.PRIORITY_CRITICAL)
+        .order_by('priority', '-queue_position')
+        .values_list('id', flat=True)[:count]
+    )
+    if victims:
+        TorrentDownload.objects.filter(id__in=victims, status='downloading').update(
+            status='pending',
+            status_message='Preempted by a critical torrent',
+        )
+        logger.info("Preempted %d downloads for critical torrents", len(victims))
+    return victims
+
+
+def move_in_queue(torrent, direction):
+    """Swap a pending torrent with its neighbour within the same priority level"""
+
+    neighbours = TorrentDownload.objects.filter(status='pending', priority=torrent.priority).exclude(id=torrent.id)
+    if direction == 'up':
+        neighbour = neighbours.filter(queue_position__lte=torrent.queue_position).order_by('-queue_position').first()
+    else:
+        neighbour = neighbours.filter(queue_position__gte=torrent.queue_position).order_by('queue_position').first()
+
+    if neighbour is None:
+        return False
+
+    if neighbour.queue_position == torrent.queue_position:
+        # Rows sharing a position only need this one nudged past the other
+        offset = 1 if direction == 'down' else -1
+        TorrentDownload.objects.filter(id=torrent.id).update(queue_position=torrent.queue_position + offset)
+        return True
+
+    with transaction.atomic():
+        TorrentDownload.objects.filter(id=torrent.id).update(queue_position=neighbour.queue_position)
+        TorrentDownload.objects.filter(id=neighbour.id).update(queue_position=torrent.queue_position)
+    return True
+
+
+def drain_downloads(timeout):
+    """Stop this process's downloads with resume data so another engine run continues them"""
+
+    global _draining
+    _draining = True
+
+    # Celery workers outlive the dispatcher and keep their torrents
+    executor = executors.current()
+    if not executor.local:
+        return 0
+
+    running = executor.running()
+    TorrentDownload.objects.filter(id__in=running, status='downloading').update(
+        status='pending',
+        status_message='Waiting for the engine to restart',
+    )
+
+    # Saved right away as well, a job busy with a slow tick may not notice the status before the timeout
+    for torrent in TorrentDownload.objects.filter(id__in=running):
+        handle = diagnostics.find_handle(torrent)
+        if handle is not None:
+            save_resume_data(handle, str(torrent.id))
+
+    deadline = time.monotonic() + timeout
+    for torrent_id in running:
+        executor.wait(torrent_id, max(0, deadline - time.monotonic()))
+    return len(running)
+
+
+def release_slot(torrent_id):
+    """Forget a finished download job and hand its slot to the queue"""
+
+    executors.current().forget(torrent_id)
+    history.close(torrent_id)
+    try:
+        dispatch_queue()
+    except Exception as e:
+        logger.warning("Queue dispatch failed: %s", e)
+
+
+def move_storage(handle, destination, log=logger):
+    """Move a torrent's data with libtorrent's async move_storage and wait for it to finish"""
+
+    try:
+        handle.move_storage(destination)
+    except Exception as e:
+        log.warning("move_storage failed: %s", e)
+        return False
+
+    # Polled rather than waiting for alerts, the shared session's alerts belong to everyone
+    deadline = time.time() + settings.TORRENT_MOVE_STORAGE_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(1)
+        status = handle.status()
+        if status.errc.value():
+            log.warning("Moving storage failed: %s", status.errc.message())
+            return False
+        if not status.moving_storage and os.path.normpath(status.save_path) == destination:
+            return True
+
+    log.warning("Timed out moving storage to %s", destination)
+    return False
+
+
+def save_resume_data(handle, torrent_id):
+    """Store fast-resume data so the next run skips rechecking what is already on disk"""
+
+    import libtorrent as lt
+
+    waiter = session.expect_alert(
+        lambda alert: (
+            isinstance(alert, (lt.save_resume_data_alert, lt.save_resume_data_failed_alert))
+            and alert.handle == handle
+        ),
+        lambda alert: lt.write_resume_data_buf(alert.params) if isinstance(alert, lt.save_resume_data_alert) else None,
+    )
+    try:
+        handle.save_resume_data(lt.save_resume_flags_t.save_info_dict)
+    except Exception as e:
+        waiter.wait(0)
+        logger.warning("Error requesting resume data: %s", e, extra={'torrent_id': str(torrent_id)})
+        return False
+
+    data = waiter.wait(settings.TORRENT_RESUME_DATA_TIMEOUT)
+    if data is None:
+        logger.warning("No resume data, it will be rechecked next time", extra={'torrent_id': str(torrent_id)})
+        return False
+
+    storage.save_resume_data(torrent_id, data)
+    return True
+
+
+def web_seeds(torrent):
+    """HTTP seeds (BEP 19) from the magnet's ws= parameters plus the torrent's own mirrors"""
+
+    import libtorrent as lt
+
+    urls = list(lt.parse_magnet_uri(torrent.magnet_link).url_seeds)
+    return list(dict.fromkeys(urls + torrent.web_seed_urls))
+
+
+def mark_failed(torrent_id):
+    """Fail a torrent without touching its other fields, a deletion in progress wins"""
+
+    return TorrentDownload.objects.filter(id=torrent_id).exclude(status='deleting').update(status='failed')
+
+
+def run_download(torrent_id):
+    """Synchronous torrent download function compatible with libtorrent 2.0.9"""
+    log = events.torrent_logger(logger, torrent_id)
+    try:
+        try:
+            import libtorrent as lt
+        except ImportError:
+            log.error("libtorrent not available, marking torrent as failed")
+            mark_failed(torrent_id)
+            return
+
+        # Paused or deleted while it waited for a worker, there is nothing to do
+        claimed = TorrentDownload.objects.filter(id=torrent_id, status__in=('pending', 'downloading')).update(
+            status='downloading',
+            status_message='',
+        )
+        if not claimed:
+            return
+        torrent = TorrentDownload.objects.get(id=torrent_id)
+        # Celery jobs stop once the dispatcher requeued the row and gave it to a newer task
+        lease_token = torrent.lease_token
+        log = events.torrent_logger(logger, torrent_id, torrent.magnet_link)
+        # Progress lines and repeated tick errors are rate limited, hundreds of torrents tick every 2s
+        throttle = events.Throttle(settings.TORRENT_PROGRESS_LOG_INTERVAL)
+
+        log.info("Starting download: %s", torrent.name)
+
+        # All downloads share one session configured from the active performance profile
+        try:
+            ses = session.get_session()
+            bandwidth.start_bandwidth_scheduler()
+        except Exception as e:
+            log.error("Error starting libtorrent session: %s", e)
+            mark_failed(torrent_id)
+            return
+
+        # Add torrent using add_torrent_params (available in your version)
+        try:
+            saved_info = storage.load_metadata(torrent_id)
+            resume_data = storage.load_resume_data(torrent_id)
+            repair = torrent.verify_jobs.filter(repair_pending=True).order_by('-created_at').first()
+
+            if saved_info is not None and repair is not None:
+                # Mark everything but the corrupt pieces as present so only those are fetched
+                params = lt.add_torrent_params()
+                params.ti = saved_info
+                corrupt = set(repair.corrupt_pieces)
+                params.have_pieces = [index not in corrupt for index in range(saved_info.num_pieces())]
+            elif resume_data is not None:
+                # Resume data skips rechecking what is already on disk
+                params = lt.read_resume_data(resume_data)
+            elif saved_info is not None:
+                # Saved metadata skips the swarm lookup on every run after the first
+                params = lt.add_torrent_params()
+                params.ti = saved_info
+            else:
+                # Parsed rather than passed as a url so trackers and ws= seeds are kept
+                params = lt.parse_magnet_uri(torrent.magnet_link)
+
+            params.save_path = storage.torrent_volume(torrent)
+            params.url_seeds = list(dict.fromkeys(list(params.url_seeds) + web_seeds(torrent)))
+            applied_mirrors = torrent.web_seed_urls
+
+            # Set storage mode if available, full allocation only pays off for large torrents
+            if hasattr(lt, 'storage_mode_t'):
+                if storage.should_preallocate(torrent.size):
+                    params.storage_mode = lt.storage_mode_t.storage_mode_allocate
+                else:
+                    params.storage_mode = lt.storage_mode_t.storage_mode_sparse
+                
+            # The session hands a second row with the same info hash the first one's handle, and
+            # removing it for either row would pull it from under the other
+            if diagnostics.find_handle(torrent) is not None and seeding.seeding_handle(torrent_id) is None:
+                log.error("Another torrent with the same info hash is already active: %s", torrent.name)
+                TorrentDownload.objects.filter(id=torrent_id, status='downloading').update(
+                    status='failed',
+                    status_message='Duplicate of a torrent that is already active',
+                )
+                return
+
+            # A repair can be queued from another process while this one still seeds the torrent
+            seeding.stop_seeding(torrent_id)
+            handle = ses.add_torrent(params)
+            log.debug("Torrent added to the session")
+
+            if repair is not None:
+                torrent.verify_jobs.filter(repair_pending=True).update(repair_pending=False)
+                
+        except Exception as e:
+            log.error("Error adding torrent: %s", e)
+            mark_failed(torrent_id)
+            return
+
+        # Wait for metadata, reannouncing and adding trackers before giving the slot up
+        monitor = health.StallMonitor(settings.TORRENT_METADATA_TIMEOUT, log)
+        log.info("Waiting for metadata: %s", torrent.name)
+
+        while not handle.has_metadata():
+            if not monitor.check(handle, 0):
+                log.warning("Metadata timeout: %s", torrent.name)
+                try:
+                    ses.remove_torrent(handle)
+                except:
+                    pass
+                health.retry_later(torrent, "No metadata from the swarm")
+                return
+
+            time.sleep(1)
+
+            try:
+                torrent.refresh_from_db()
+                if torrent.lease_token != lease_token:
+                    log.warning("Lease lost, another worker runs this download now")
+                    try:
+                        ses.remove_torrent(handle)
+                    except:
+                        pass
+                    return
+                if torrent.status != 'downloading':
+                    log.info("Torrent %s: %s", torrent.get_status_display().lower(), torrent.name)
+                    try:
+                        ses.remove_torrent(handle)
+                    except:
+                        pass
+                    return
+            except TorrentDownload.DoesNotExist:
+                log.info("Torrent deleted while waiting for metadata")
+                try:
+                    ses.remove_torrent(handle)
+                except:
+                    pass
+                return
+
+        # Metadata received
+        try:
+            info = handle.get_torrent_info()
+            size_was_known = torrent.size > 0
+            torrent.name = info.name()
+            torrent.size = info.total_size()
+            torrent.is_multi_file = info.num_files() > 1
+            torrent.save(update_fields=['name', 'size', 'is_multi_file'])
+            if saved_info is None:
+                storage.save_metadata(torrent_id, info)
+            log.info(
+                "Metadata received, downloading %s (%d bytes, %d files)", torrent.name, torrent.size, info.num_files(),
+                extra={'size': torrent.size, 'files': info.num_files()},
+            )
+        except Exception as e:
+            log.error("Error getting torrent info: %s", e)
+            mark_failed(torrent_id)
+            return
+
+        # Now that the size is known, make sure it fits next to everything else running
+        admitted, reason = storage.check_admission(torrent)
+        if not admitted:
+            log.warning("Not enough disk space, re-queueing %s: %s", torrent.name, reason)
+            try:
+                ses.remove_torrent(handle)
+            except:
+                pass
+            TorrentDownload.objects.filter(id=torrent_id, status='downloading').update(status='pending', status_message=reason)
+            return
+
+        # Magnets are added before their size is known, so allocate the files now instead
+        if not size_was_known and storage.should_preallocate(torrent.size):
+            try:
+                storage.preallocate_files(info, params.save_path)
+                log.info("Preallocated %d bytes for %s", torrent.size, torrent.name)
+            except OSError as e:
+                log.warning("Preallocation failed, continuing sparse: %s", e)
+
+        # Download loop, each tick only rewrites the narrow live status row
+        live, _ = TorrentLiveStatus.objects.get_or_create(torrent_id=torrent_id)
+        last_progress_update = 0
+        last_resume_save = time.monotonic()
+        applied_limits = None
+        monitor = health.StallMonitor(settings.TORRENT_STALL_TIMEOUT, log)
+        consecutive_errors = 0
+        max_consecutive_errors = 10
+        
+        while True:
+            try:
+                status = handle.status()
+                if status.progress >= 1:
+                    break
+                    
+                consecutive_errors = 0  # Reset error counter on success
+
+                # A torrent that stopped moving hands its slot to the next queued one
+                if not monitor.check(handle, status.total_done):
+                    log.warning("Download stalled: %s", torrent.name)
+                    save_resume_data(handle, torrent_id)
+                    try:
+                        ses.remove_torrent(handle)
+                    except:
+                        pass
+                    health.retry_later(torrent, "Stalled without progress")
+                    return
+                
+            except Exception as e:
+                consecutive_errors += 1
+                log.warning("Error getting status (attempt %d): %s", consecutive_errors, e)
+                if consecutive_errors >= max_consecutive_errors:
+                    log.error("Too many consecutive errors, failing torrent")
+                    mark_failed(torrent_id)
+                    return
+                time.sleep(5)
+                continue
+                
+            time.sleep(2)
+
+            # Check if torrent was paused or deleted
+            try:
+                torrent.refresh_from_db()
+                if torrent.lease_token != lease_token:
+                    log.warning("Lease lost, another worker runs this download now")
+                    try:
+                        ses.remove_torrent(handle)
+                    except:
+                        pass
+                    return
+                if torrent.status != 'downloading':
+                    log.info("Download %s: %s", torrent.get_status_display().lower(), torrent.name)
+                    # Paused and preempted torrents come back later, deleted ones don't
+                    if torrent.status in ('paused', 'pending'):
+                        save_resume_data(handle, torrent_id)
+                    try:
+                        ses.remove_torrent(handle)
+                    except:
+                        pass
+                    return
+            except TorrentDownload.DoesNotExist:
+                log.info("Torrent deleted during download")
+                try:
+                    ses.remove_torrent(handle)
+                except:
+                    pass
+                return
+
+            # Mirrors edited while downloading apply without restarting the torrent
+            mirrors = torrent.web_seed_urls
+            if mirrors != applied_mirrors:
+                try:
+                    for url in set(applied_mirrors) - set(mirrors) - set(web_seeds(torrent)):
+                        handle.remove_url_seed(url)
+                    for url in set(mirrors) - set(applied_mirrors):
+                        handle.add_url_seed(url)
+                    applied_mirrors = mirrors
+                except Exception as e:
+                    log.warning("Error updating web seeds: %s", e)
+
+            # A crashed engine only keeps what was saved here, recovery re-adds the torrent from it
+            if time.monotonic() - last_resume_save >= settings.TORRENT_RESUME_DATA_INTERVAL:
+                last_resume_save = time.monotonic()
+                try:
+                    if handle.need_save_resume_data():
+                        save_resume_data(handle, torrent_id)
+                except Exception as e:
+                    log.warning("Error saving resume data: %s", e)
+
+            # Per-torrent limits and priority caps can change at any time
+            limits = bandwidth.torrent_limits(torrent)
+            if limits != applied_limits:
+                try:
+                    handle.set_download_limit(limits[0] * 1024)
+                    handle.set_upload_limit(limits[1] * 1024)
+                    applied_limits = limits
+                except Exception as e:
+                    log.warning("Error applying rate limits: %s", e)
+
+            # Update progress
+            try:
+                flush_started = time.perf_counter()
+                status = handle.status()
+                live.progress = status.progress
+                live.download_speed = status.download_rate / 1024  # KB/s
+                live.upload_speed = status.upload_rate / 1024
+                live.downloaded = status.total_done
+                live.peers = status.num_peers
+                live.seeds = status.num_seeds
+
+                # ETA calculation
+                if status.download_rate > 0:
+                    live.eta_seconds = int((torrent.size - live.downloaded) / status.download_rate)
+                else:
+                    live.eta_seconds = None
+
+                with metrics.DB_WRITE_SECONDS.time(table='live_status'):
+                    live.save()
+                history.record(torrent_id, live.download_speed, live.upload_speed, live.peers, live.progress)
+                metrics.PROGRESS_FLUSH_SECONDS.observe(time.perf_counter() - flush_started, source='download')
+
+                # Log every 10% progress, no more often than the progress interval
+                current_progress = int(live.progress * 10)
+                if current_progress > last_progress_update and throttle.allow('progress'):
+                    last_progress_update = current_progress
+                    log.info(
+                        "Progress %.1f%%, %.1f KB/s, peers %d/%d", live.progress * 100, live.download_speed, live.peers, live.seeds,
+                        extra={'progress': round(live.progress, 4), 'download_speed': round(live.download_speed, 1), 'peers': live.peers},
+                    )
+                    
+            except Exception as e:
+                if throttle.allow('progress_error'):
+                    log.warning("Error updating progress: %s", e, extra={'suppressed': throttle.suppressed_since('progress_error')})
+
+        # Download complete
+        try:
+            info = handle.get_torrent_info()
+            save_path = params.save_path
+
+            # Hand finished data over to the cold volume while the handle is still open
+            cold_volume = storage.cold_volume()
+            if cold_volume and cold_volume != save_path:
+                fits, reason = storage.check_move(torrent, save_path, cold_volume)
+                if not fits:
+                    log.warning("Keeping %s on %s, cold volume is full: %s", torrent.name, save_path, reason)
+                else:
+                    # The slot stays taken until the move is done, say why
+                    TorrentDownload.objects.filter(id=torrent_id, status='downloading').update(
+                        status_message="Moving to cold volume",
+                    )
+                    if move_storage(handle, cold_volume, log):
+                        save_path = cold_volume
+                        log.info("Moved %s to cold volume %s", torrent.name, cold_volume)
+
+            live.progress = 1.0
+            live.downloaded = torrent.size
+            live.download_speed = 0
+            live.eta_seconds = None
+            live.save()
+
+            torrent.status = 'completed'
+            torrent.completed_at = timezone.now()
+            torrent.retry_count = 0
+            torrent.next_retry_at = None
+            torrent.save_path = save_path
+            torrent.file_path = os.path.join(save_path, info.name())
+            # Only the completion fields, a pause or delete that landed meanwhile is kept
+            completed = TorrentDownload.objects.filter(id=torrent_id, status='downloading').update(
+                status=torrent.status,
+                status_message='',
+                completed_at=torrent.completed_at,
+                retry_count=torrent.retry_count,
+                next_retry_at=torrent.next_retry_at,
+                save_path=torrent.save_path,
+                file_path=torrent.file_path,
+            )
+
+            if completed:
+                log.info("Download completed: %s", torrent.name)
+                storage.remove_resume_data(torrent_id)
+                dedup.start_deduplication(torrent_id)
+            else:
+                log.info("Torrent paused or deleted as it completed: %s", torrent.name)
+
+            # The download slot is released either way, seeds are scheduled separately
+            if completed and seeding.should_seed(torrent):
+                if not seeding.hands_off():
+                    seeding.start_seeding(torrent, handle)
+                    return
+                # Download jobs end with the download, the engine process seeds from the same files
+                seeding.hand_off(torrent)
+        except Exception as e:
+            log.error("Error completing download: %s", e)
+            mark_failed(torrent_id)
+
+        try:
+            ses.remove_torrent(handle)
+        except:
+            pass
+
+    except Exception as e:
+        # The one place a traceback is worth its weight, everything above handles its own errors
+        log.exception("Download error: %s", e)
+        
+        mark_failed(torrent_id)
+
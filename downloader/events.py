@@ -0,0 +1,132 @@
+# downloader/events.py - Structured logging: JSON records, torrent context, throttling and recent events per torrent
+import functools
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+# Attributes every LogRecord has, anything else on a record was passed as extra
+RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+# Torrent id -> deque of its most recent events, least recently logged torrent first
+_events = OrderedDict()
+_events_lock = threading.Lock()
+
+
+def record_extras(record):
+    return {key: value for key, value in vars(record).items() if key not in RECORD_ATTRS}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, extra fields like torrent_id and info_hash become keys"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(record_extras(record))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Readable lines for a terminal, extra fields appended as key=value"""
+
+    def formatMessage(self, record):
+        line = super().formatMessage(record)
+        extras = record_extras(record)
+        if extras:
+            line += ' ' + ' '.join(f'{key}={value}' for key, value in extras.items())
+        return line
+
+
+class TorrentEventHandler(logging.Handler):
+    """Keeps the last records about each torrent in memory for its detail page"""
+
+    def __init__(self, capacity=100, max_torrents=1000, level=logging.INFO):
+        super().__init__(level)
+        self.capacity = capacity
+        self.max_torrents = max_torrents
+
+    def emit(self, record):
+        torrent_id = getattr(record, 'torrent_id', None)
+        if torrent_id is None:
+            return
+
+        event = {'time': record.created, 'level': record.levelname.lower(), 'message': record.getMessage()}
+        with _events_lock:
+            events = _events.get(torrent_id)
+            if events is None:
+                events = _events[torrent_id] = deque(maxlen=self.capacity)
+                while len(_events) > self.max_torrents:
+                    _events.popitem(last=False)
+            else:
+                _events.move_to_end(torrent_id)
+            events.append(event)
+
+
+def recent_events(torrent_id):
+    """This process's recent events of a torrent, newest first"""
+
+    with _events_lock:
+        events = list(_events.get(str(torrent_id), ()))
+    return [
+        {**event, 'time': datetime.fromtimestamp(event['time'], tz=timezone.utc)}
+        for event in reversed(events)
+    ]
+
+
+@functools.lru_cache(maxsize=4096)
+def info_hash(magnet_link):
+    """Hex info hash of a magnet link, None if libtorrent can't parse it"""
+
+    try:
+        import libtorrent as lt
+
+        return str(lt.parse_magnet_uri(magnet_link).info_hashes.get_best())
+    except Exception:
+        return None
+
+
+class TorrentLogger(logging.LoggerAdapter):
+    """Logger that stamps every record with a torrent's id and info hash"""
+
+    def process(self, msg, kwargs):
+        kwargs['extra'] = {**self.extra, **kwargs.get('extra', {})}
+        return msg, kwargs
+
+
+def torrent_logger(logger, torrent_id, magnet_link=None):
+    context = {'torrent_id': str(torrent_id)}
+    if magnet_link:
+        context['info_hash'] = info_hash(magnet_link)
+    return TorrentLogger(logger, context)
+
+
+class Throttle:
+    """Lets an event through at most once per interval per key, counting the ones held back"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.last = {}
+        self.suppressed = {}
+
+    def allow(self, key):
+        now = time.monotonic()
+        last = self.last.get(key)
+        if last is not None and now - last < self.interval:
+            self.suppressed[key] = self.suppressed.get(key, 0) + 1
+            return False
+        self.last[key] = now
+        return True
+
+    def suppressed_since(self, key):
+        """How many events of a key were held back since the last one let through"""
+
+        return self.suppressed.pop(key, 0)
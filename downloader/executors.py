@@ -0,0 +1,265 @@
+# downloader/executors.py - Where download jobs run: threads, child processes or Celery workers
+import logging
+import multiprocessing
+import threading
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def run_detached(torrent_id, lease_token=None):
+    """Download job for executors whose workers live outside this process
+
+    The worker gets its own libtorrent session and returns once the download
+    is over, so it never holds a worker slot while seeding. Completed torrents
+    are handed to the engine process, which seeds them under its caps.
+    """
+
+    from . import dedup, engine, history, seeding, shards
+
+    shards.configure_job()
+    seeding.hand_off_seeding()
+
+    lease = None
+    if lease_token is not None:
+        lease = Lease(torrent_id, lease_token)
+        # Requeued and sent again after this task was sent, the newer task owns the row
+        if not lease.renew():
+            logger.info("Lease no longer held, skipping the download", extra={'torrent_id': str(torrent_id)})
+            return
+        lease.start()
+
+    try:
+        engine.run_download(torrent_id)
+    finally:
+        if lease is not None:
+            lease.stop()
+    history.close(torrent_id)
+    dedup.wait_for_deduplication()
+
+
+class Lease:
+    """A Celery job's claim on its row, renewed in the background while the download runs"""
+
+    def __init__(self, torrent_id, token):
+        self.torrent_id = torrent_id
+        self.token = token
+        self.stopped = threading.Event()
+
+    def renew(self):
+        """Push the expiry out again, False once the row was requeued or finished"""
+
+        from .models import TorrentDownload
+
+        expires_at = timezone.now() + timedelta(seconds=settings.TORRENT_LEASE_TTL)
+        return TorrentDownload.objects.filter(id=self.torrent_id, lease_token=self.token, status='downloading').update(
+            lease_expires_at=expires_at,
+        ) == 1
+
+    def start(self):
+        def run():
+            try:
+                while not self.stopped.wait(settings.TORRENT_LEASE_HEARTBEAT):
+                    try:
+                        if not self.renew():
+                            return
+                    except Exception as e:
+                        logger.warning("Renewing lease failed: %s", e, extra={'torrent_id': str(self.torrent_id)})
+                        close_old_connections()
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+
+def run_in_process(torrent_id):
+    """Child process entry point, a fresh interpreter has to set Django up first"""
+
+    import django
+
+    django.setup()
+    from django.db import close_old_connections, connection
+
+    try:
+        run_detached(torrent_id)
+    finally:
+        close_old_connections()
+
+
+class ThreadExecutor:
+    """Downloads run as daemon threads sharing this process's libtorrent session"""
+
+    # Workers run in this process, so they can be counted, joined and recovered here
+    local = True
+
+    def __init__(self):
+        self.workers = {}
+
+    def submit(self, torrent_id, on_exit):
+        """Start a torrent's download job, on_exit(torrent_id) runs once it is over"""
+
+        from .engine import run_download
+
+        def run():
+            try:
+                run_download(torrent_id)
+            finally:
+                on_exit(torrent_id)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        self.workers[torrent_id] = thread
+        thread.start()
+        return True
+
+    def running(self):
+        """Ids of torrents whose job holds a download slot"""
+
+        return [torrent_id for torrent_id, worker in list(self.workers.items()) if worker.is_alive()]
+
+    def is_running(self, torrent_id):
+        worker = self.workers.get(torrent_id)
+        return worker is not None and worker.is_alive()
+
+    def wait(self, torrent_id, timeout):
+        """Wait for a torrent's job to end, False if it is still running after timeout"""
+
+        worker = self.workers.get(torrent_id)
+        if worker is not None:
+            worker.join(timeout)
+        return not self.is_running(torrent_id)
+
+    def forget(self, torrent_id):
+        self.workers.pop(torrent_id, None)
+
+    def reclaim(self):
+        """Local jobs die with this process, startup recovery requeues them instead"""
+
+        return 0
+
+
+class ProcessExecutor(ThreadExecutor):
+    """Each download runs in a child process with its own GIL and libtorrent session"""
+
+    def submit(self, torrent_id, on_exit):
+        # Spawned rather than forked, libtorrent and DB connections don't survive a fork
+        process = multiprocessing.get_context('spawn').Process(target=run_in_process, args=(torrent_id,))
+        process.daemon = True
+        process.start()
+        self.workers[torrent_id] = process
+
+        def watch():
+            from . import seeding
+
+            process.join()
+            try:
+                seeding.adopt([torrent_id])
+            except Exception as e:
+                logger.warning("Taking over seeding failed: %s", e, extra={'torrent_id': str(torrent_id)})
+            finally:
+                connection.close()
+            on_exit(torrent_id)
+
+        watcher = threading.Thread(target=watch)
+        watcher.daemon = True
+        watcher.start()
+        return True
+
+
+class CeleryExecutor:
+    """Downloads run as Celery tasks on a worker fleet, slots are counted in the database"""
+
+    # Workers live on other machines, nothing can be joined or recovered from here
+    local = False
+
+    def submit(self, torrent_id, on_exit):
+        """Claim the row before enqueueing so concurrent dispatchers never send it twice"""
+
+        from .models import TorrentDownload
+        from .tasks import download_torrent
+
+        # Only the task carrying this token may run the download, older copies still in the broker skip it
+        token = uuid.uuid4()
+        claimed = TorrentDownload.objects.filter(id=torrent_id, status='pending').update(
+            status='downloading',
+            status_message='Waiting for a worker',
+            lease_token=token,
+            lease_expires_at=timezone.now() + timedelta(seconds=settings.TORRENT_LEASE_TTL),
+        )
+        if not claimed:
+            return False
+
+        try:
+            download_torrent.delay(torrent_id, str(token))
+        except Exception:
+            TorrentDownload.objects.filter(id=torrent_id, status='downloading').update(
+                status='pending',
+                status_message='Task broker unavailable',
+                lease_token=None,
+                lease_expires_at=None,
+            )
+            raise
+        return True
+
+    def running(self):
+        from .models import TorrentDownload
+
+        return [str(pk) for pk in TorrentDownload.objects.filter(status='downloading').values_list('id', flat=True)]
+
+    def is_running(self, torrent_id):
+        from .models import TorrentDownload
+
+        return TorrentDownload.objects.filter(id=torrent_id, status='downloading').exists()
+
+    def wait(self, torrent_id, timeout):
+        """Workers can't be joined, callers give them a grace period to see the status instead"""
+
+        return True
+
+    def forget(self, torrent_id):
+        pass
+
+    def reclaim(self):
+        """Requeue rows whose job stopped renewing its lease, the task was lost with its worker"""
+
+        from .models import TorrentDownload
+
+        return TorrentDownload.objects.filter(status='downloading', lease_expires_at__lt=timezone.now()).update(
+            status='pending',
+            status_message='Requeued, its worker stopped responding',
+            lease_token=None,
+            lease_expires_at=None,
+        )
+
+
+EXECUTORS = {
+    'thread': ThreadExecutor,
+    'process': ProcessExecutor,
+    'celery': CeleryExecutor,
+}
+
+
+def current():
+    """This process's executor, chosen by TORRENT_EXECUTOR"""
+
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            name = settings.TORRENT_EXECUTOR
+            if name not in EXECUTORS:
+                raise ImproperlyConfigured(f"Unknown TORRENT_EXECUTOR '{name}'")
+            _executor = EXECUTORS[name]()
+        return _executor
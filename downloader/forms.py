@@ -1,21 +1,62 @@
 from django import forms
-from .models import TorrentDownload
+from django.core.validators import URLValidator
+from .models import TorrentDownload, BandwidthSettings
+from . import events
 import re
 
+INPUT_CLASS = 'mt-1 block w-full px-3 py-2 border border-gray-300 rounded-md shadow-sm focus:outline-none focus:ring-blue-500 focus:border-blue-500'
+
+def clean_web_seed_urls(value):
+    """Validate HTTP mirror URLs given one per line and normalize the list"""
+    urls = [url.strip() for url in value.splitlines() if url.strip()]
+    validate = URLValidator(schemes=['http', 'https'])
+    for url in urls:
+        validate(url)
+    return '\n'.join(dict.fromkeys(urls))
+
+def find_duplicate(magnet_link):
+    """Existing torrent with the same info hash, all downloads share one session and so one handle per hash"""
+    info_hash = events.info_hash(magnet_link)
+    if info_hash is None:
+        return None
+    # Magnets carry the hash in hex, btih for v1 and inside the btmh multihash for v2
+    candidates = TorrentDownload.objects.filter(magnet_link__icontains=info_hash).only('id', 'name', 'magnet_link')
+    return next((torrent for torrent in candidates if events.info_hash(torrent.magnet_link) == info_hash), None)
+
 class TorrentForm(forms.ModelForm):
+    torrent_file = forms.FileField(required=False, widget=forms.ClearableFileInput(attrs={
+        'class': INPUT_CLASS,
+        'accept': '.torrent,application/x-bittorrent',
+    }))
+    
     class Meta:
         model = TorrentDownload
-        fields = ['magnet_link']
+        fields = ['magnet_link', 'priority', 'web_seeds']
         widgets = {
             'magnet_link': forms.Textarea(attrs={
                 'class': 'mt-1 block w-full px-3 py-2 border border-gray-300 rounded-md shadow-sm focus:outline-none focus:ring-blue-500 focus:border-blue-500',
                 'rows': 4,
                 'placeholder': 'Paste your magnet link here...'
-            })
+            }),
+            'priority': forms.Select(attrs={
+                'class': 'mt-1 block w-full px-3 py-2 border border-gray-300 rounded-md shadow-sm focus:outline-none focus:ring-blue-500 focus:border-blue-500',
+            }),
+            'web_seeds': forms.Textarea(attrs={
+                'class': INPUT_CLASS,
+                'rows': 2,
+                'placeholder': 'Optional HTTP mirrors, one URL per line',
+            }),
         }
     
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # An uploaded .torrent file replaces the magnet link
+        self.fields['magnet_link'].required = False
+    
     def clean_magnet_link(self):
         magnet_link = self.cleaned_data['magnet_link'].strip()
+        if not magnet_link:
+            return magnet_link
         if not magnet_link.startswith('magnet:'):
             raise forms.ValidationError('Please enter a valid magnet link.')
         
@@ -28,3 +69,84 @@ class TorrentForm(forms.ModelForm):
             self.cleaned_data['name'] = 'Unknown Torrent'
         
         return magnet_link
+    
+    def clean_web_seeds(self):
+        return clean_web_seed_urls(self.cleaned_data['web_seeds'])
+    
+    def clean_torrent_file(self):
+        torrent_file = self.cleaned_data.get('torrent_file')
+        if not torrent_file:
+            return torrent_file
+        
+        import libtorrent as lt
+        try:
+            self.cleaned_data['torrent_info'] = lt.torrent_info(lt.bdecode(torrent_file.read()))
+        except Exception:
+            raise forms.ValidationError('Please upload a valid .torrent file.')
+        return torrent_file
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        info = cleaned_data.get('torrent_info')
+        
+        if info is not None:
+            import libtorrent as lt
+            # Web seeds in the file's url-list travel along in the magnet's ws= parameters
+            cleaned_data['magnet_link'] = lt.make_magnet_uri(info)
+            cleaned_data['name'] = info.name()
+        elif not cleaned_data.get('magnet_link') and not self.errors:
+            raise forms.ValidationError('Please enter a magnet link or upload a .torrent file.')
+        
+        if cleaned_data.get('magnet_link'):
+            duplicate = find_duplicate(cleaned_data['magnet_link'])
+            if duplicate is not None:
+                raise forms.ValidationError(f'This torrent is already in the list as "{duplicate.name}".')
+        
+        return cleaned_data
+
+LIMIT_INPUT_ATTRS = {
+    'class': 'mt-1 block w-full px-3 py-2 border border-gray-300 rounded-md shadow-sm focus:outline-none focus:ring-blue-500 focus:border-blue-500',
+    'min': 0,
+}
+
+class TorrentLimitsForm(forms.ModelForm):
+    class Meta:
+        model = TorrentDownload
+        fields = ['download_limit', 'upload_limit', 'bandwidth_priority']
+        widgets = {
+            'download_limit': forms.NumberInput(attrs=LIMIT_INPUT_ATTRS),
+            'upload_limit': forms.NumberInput(attrs=LIMIT_INPUT_ATTRS),
+        }
+        labels = {
+            'download_limit': 'Download limit (KB/s, 0 = unlimited)',
+            'upload_limit': 'Upload limit (KB/s, 0 = unlimited)',
+            'bandwidth_priority': 'Priority share of limited bandwidth',
+        }
+
+class TorrentWebSeedsForm(forms.ModelForm):
+    class Meta:
+        model = TorrentDownload
+        fields = ['web_seeds']
+        widgets = {
+            'web_seeds': forms.Textarea(attrs={'class': INPUT_CLASS, 'rows': 3}),
+        }
+        labels = {
+            'web_seeds': 'HTTP mirrors (one URL per line)',
+        }
+    
+    def clean_web_seeds(self):
+        return clean_web_seed_urls(self.cleaned_data['web_seeds'])
+
+class BandwidthSettingsForm(forms.ModelForm):
+    class Meta:
+        model = BandwidthSettings
+        fields = ['download_limit', 'upload_limit', 'schedule_enabled']
+        widgets = {
+            'download_limit': forms.NumberInput(attrs=LIMIT_INPUT_ATTRS),
+            'upload_limit': forms.NumberInput(attrs=LIMIT_INPUT_ATTRS),
+        }
+        labels = {
+            'download_limit': 'Global download limit (KB/s)',
+            'upload_limit': 'Global upload limit (KB/s)',
+            'schedule_enabled': 'Use weekly schedule',
+        }
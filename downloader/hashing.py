@@ -0,0 +1,92 @@
+# downloader/hashing.py - CPU-bound hashing workers run in a process pool
+#
+# Kept free of Django imports so spawned worker processes can import it cheaply.
+import bisect
+import hashlib
+import mmap
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+
+def process_pool(workers=0):
+    """Process pool for hashing, spawned so it is safe to start from download threads"""
+
+    return ProcessPoolExecutor(
+        max_workers=workers or os.cpu_count() or 1,
+        mp_context=multiprocessing.get_context('spawn'),
+    )
+
+
+def hash_file(path):
+    """Stream a file through SHA-256 and return (path, hexdigest)"""
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return path, digest.hexdigest()
+
+
+def verify_pieces(layout, piece_length, total_size, first_piece, piece_hashes):
+    """Check a run of pieces against their SHA-1 hashes and return the corrupt indexes
+
+    layout is a list of (path, offset, size) in torrent order, path is None for
+    pad files which are all zeros. Files are memory-mapped so pages come straight
+    from the page cache without copying through a read buffer.
+    """
+
+    offsets = [offset for path, offset, size in layout]
+    maps = {}
+    corrupt = []
+
+    try:
+        for index, expected in enumerate(piece_hashes, start=first_piece):
+            start = index * piece_length
+            end = min(start + piece_length, total_size)
+            digest = hashlib.sha1()
+            position = start
+            file_index = bisect.bisect_right(offsets, start) - 1
+            intact = True
+
+            while position < end and file_index < len(layout):
+                path, offset, size = layout[file_index]
+                length = min(end, offset + size) - position
+
+                if length > 0:
+                    if path is None:
+                        digest.update(bytes(length))
+                    else:
+                        data = _map_file(maps, path, size)
+                        if data is None:
+                            intact = False
+                            break
+                        digest.update(memoryview(data)[position - offset:position - offset + length])
+                    position += length
+                file_index += 1
+
+            if not intact or position < end or digest.digest() != expected:
+                corrupt.append(index)
+    finally:
+        for data in maps.values():
+            if data is not None:
+                data.close()
+
+    return corrupt
+
+
+def _map_file(maps, path, size):
+    """Memory-map a file once per task, None when it is missing or truncated"""
+
+    if path not in maps:
+        try:
+            with open(path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size < size:
+                    maps[path] = None
+                else:
+                    maps[path] = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        except OSError:
+            maps[path] = None
+    return maps[path]
@@ -0,0 +1,98 @@
+# downloader/health.py - Stall detection and retry policy for downloads
+import logging
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from .models import TorrentDownload
+from . import events
+
+logger = logging.getLogger(__name__)
+
+
+class StallMonitor:
+    """Tracks one torrent's progress and escalates recovery while it stops moving
+
+    Within a window without progress the monitor first asks for a reannounce
+    and DHT lookup, then adds extra trackers, and finally gives up so the
+    slot can go to the next queued torrent.
+    """
+
+    def __init__(self, window, log=logger):
+        self.window = window
+        self.log = log
+        self.last_done = None
+        self.last_progress = time.monotonic()
+        self.stage = 0
+
+    def check(self, handle, done):
+        """Feed the bytes done so far, returns False once the torrent should give up its slot"""
+
+        now = time.monotonic()
+        if self.last_done is None or done > self.last_done:
+            self.last_done = done
+            self.last_progress = now
+            self.stage = 0
+            return True
+
+        stalled_for = now - self.last_progress
+
+        if self.stage < 1 and stalled_for >= self.window / 3:
+            self.stage = 1
+            self.log.info("No progress for %ds, reannouncing", stalled_for)
+            try:
+                handle.force_reannounce()
+                handle.force_dht_announce()
+            except Exception as e:
+                self.log.warning("Reannounce failed: %s", e)
+
+        if self.stage < 2 and stalled_for >= self.window * 2 / 3:
+            self.stage = 2
+            add_extra_trackers(handle, self.log)
+
+        return stalled_for < self.window
+
+
+def add_extra_trackers(handle, log=logger):
+    """Add the configured fallback trackers that the torrent doesn't know yet"""
+
+    try:
+        known = {tracker['url'] for tracker in handle.trackers()}
+        added = 0
+        for url in settings.TORRENT_EXTRA_TRACKERS:
+            if url not in known:
+                handle.add_tracker({'url': url, 'tier': 1})
+                added += 1
+        if added:
+            log.info("Added %d extra trackers", added)
+            handle.force_reannounce()
+    except Exception as e:
+        log.warning("Adding extra trackers failed: %s", e)
+
+
+def retry_later(torrent, reason):
+    """Put a stalled torrent back in the queue with exponential backoff, or fail it for good"""
+
+    retry_count = torrent.retry_count + 1
+    log = events.torrent_logger(logger, torrent.id, torrent.magnet_link)
+
+    if retry_count > settings.TORRENT_MAX_RETRIES:
+        log.error("%s, giving up after %d retries: %s", reason, torrent.retry_count, torrent.name)
+        TorrentDownload.objects.filter(id=torrent.id, status='downloading').update(
+            status='failed',
+            status_message=f"{reason}, gave up after {torrent.retry_count} retries",
+            retry_count=retry_count,
+        )
+        return False
+
+    delay = min(settings.TORRENT_RETRY_MAX_DELAY, settings.TORRENT_RETRY_BASE_DELAY * 2 ** (retry_count - 1))
+    next_retry_at = timezone.now() + timedelta(seconds=delay)
+
+    log.warning("%s, retry %d in %ds: %s", reason, retry_count, delay, torrent.name)
+    TorrentDownload.objects.filter(id=torrent.id, status='downloading').update(
+        status='pending',
+        status_message=f"{reason}, retrying at {timezone.localtime(next_retry_at):%H:%M}",
+        retry_count=retry_count,
+        next_retry_at=next_retry_at,
+    )
+    return True
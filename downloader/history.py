@@ -0,0 +1,254 @@
+# downloader/history.py - Per-torrent throughput history, ring buffers in memory rolled up into the DB
+import logging
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from .models import ThroughputRollup
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+MINUTE = ThroughputRollup.RESOLUTION_MINUTE
+HOUR = ThroughputRollup.RESOLUTION_HOUR
+
+# Ranges up to this long are answered from the raw samples when the buffer is in this process
+RAW_RANGE = 15 * 60
+
+# Torrent id -> RingBuffer of its recent samples
+_buffers = {}
+_buffers_lock = threading.Lock()
+
+_pruner = None
+_pruner_lock = threading.Lock()
+
+
+class RingBuffer:
+    """The most recent samples of one torrent in fixed-size typed columns, oldest overwritten first"""
+
+    def __init__(self, size):
+        self.size = size
+        self.times = array('d', [0.0]) * size
+        self.download = array('f', [0.0]) * size
+        self.upload = array('f', [0.0]) * size
+        self.peers = array('H', [0]) * size
+        self.progress = array('f', [0.0]) * size
+        self.head = 0
+        self.count = 0
+        # Epoch second up to which samples have been written to minute rollups
+        self.flushed_until = None
+
+    def append(self, at, download, upload, peers, progress):
+        index = self.head
+        self.times[index] = at
+        self.download[index] = download
+        self.upload[index] = upload
+        self.peers[index] = min(peers, 0xFFFF)
+        self.progress[index] = progress
+        self.head = (index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def samples(self, since=0.0, until=float('inf')):
+        """(time, download, upload, peers, progress) tuples in [since, until), oldest first"""
+
+        start = self.head - self.count
+        for offset in range(self.count):
+            index = (start + offset) % self.size
+            if since <= self.times[index] < until:
+                yield self.times[index], self.download[index], self.upload[index], self.peers[index], self.progress[index]
+
+
+def record(torrent_id, download, upload, peers, progress):
+    """Add one tick's sample and write out the minutes that closed since the previous one"""
+
+    now = time.time()
+    with _buffers_lock:
+        buffer = _buffers.get(torrent_id)
+        if buffer is None:
+            buffer = _buffers[torrent_id] = RingBuffer(settings.TORRENT_HISTORY_BUFFER_SIZE)
+
+    buffer.append(now, download, upload, peers, progress)
+
+    minute = now // MINUTE * MINUTE
+    if buffer.flushed_until is None:
+        buffer.flushed_until = minute
+    elif minute > buffer.flushed_until:
+        flush(torrent_id, buffer, minute)
+
+
+def close(torrent_id):
+    """Write out everything a finished download or seed still holds, partial minute included"""
+
+    with _buffers_lock:
+        buffer = _buffers.pop(torrent_id, None)
+    if buffer is None or buffer.flushed_until is None:
+        return
+
+    try:
+        flush(torrent_id, buffer, time.time() + 1, final=True)
+    except Exception as e:
+        logger.warning("Saving throughput history failed: %s", e, extra={'torrent_id': torrent_id})
+
+
+def flush(torrent_id, buffer, until, final=False):
+    """Roll the buffered samples before until up into minute rows, and closed hours into hour rows
+
+    A final flush also rolls up the hour still in progress, it is recomputed
+    from its minute rows should the torrent come back within the same hour.
+    """
+
+    with metrics.DB_WRITE_SECONDS.time(table='throughput'):
+        write_rollups(torrent_id, buffer, until, final)
+
+
+def write_rollups(torrent_id, buffer, until, final):
+    buckets = {}
+    for sample in buffer.samples(buffer.flushed_until, until):
+        buckets.setdefault(int(sample[0] // MINUTE * MINUTE), []).append(sample)
+
+    for start, samples in sorted(buckets.items()):
+        save_minute(torrent_id, start, summarize(samples))
+
+    previous_hour = int(buffer.flushed_until // HOUR * HOUR)
+    current_hour = int(until // HOUR * HOUR)
+    buffer.flushed_until = until
+    if final:
+        roll_up_hours(torrent_id, previous_hour, current_hour + HOUR)
+    elif current_hour > previous_hour:
+        roll_up_hours(torrent_id, previous_hour, current_hour)
+
+
+def summarize(samples):
+    count = len(samples)
+    return {
+        'samples': count,
+        'download_avg': sum(sample[1] for sample in samples) / count,
+        'download_max': max(sample[1] for sample in samples),
+        'upload_avg': sum(sample[2] for sample in samples) / count,
+        'peers_avg': sum(sample[3] for sample in samples) / count,
+        'progress': samples[-1][4],
+    }
+
+
+def save_minute(torrent_id, start, values):
+    """Store a minute, merging with a row an earlier partial flush left for the same minute"""
+
+    bucket_start = datetime.fromtimestamp(start, tz=dt_timezone.utc)
+    row, created = ThroughputRollup.objects.get_or_create(
+        torrent_id=torrent_id, resolution=MINUTE, bucket_start=bucket_start, defaults=values,
+    )
+    if created:
+        return
+
+    total = row.samples + values['samples']
+    for name in ('download_avg', 'upload_avg', 'peers_avg'):
+        setattr(row, name, (getattr(row, name) * row.samples + values[name] * values['samples']) / total)
+    row.download_max = max(row.download_max, values['download_max'])
+    row.progress = values['progress']
+    row.samples = total
+    row.save()
+
+
+def roll_up_hours(torrent_id, start, end):
+    """Aggregate the minute rows of every hour in [start, end)"""
+
+    minutes = ThroughputRollup.objects.filter(
+        torrent_id=torrent_id,
+        resolution=MINUTE,
+        bucket_start__gte=datetime.fromtimestamp(start, tz=dt_timezone.utc),
+        bucket_start__lt=datetime.fromtimestamp(end, tz=dt_timezone.utc),
+    )
+
+    hours = {}
+    for row in minutes:
+        hours.setdefault(int(row.bucket_start.timestamp() // HOUR * HOUR), []).append(row)
+
+    for hour, rows in sorted(hours.items()):
+        total = sum(row.samples for row in rows)
+        # Always recomputed from all of the hour's minutes, so it replaces what was there
+        ThroughputRollup.objects.update_or_create(
+            torrent_id=torrent_id,
+            resolution=HOUR,
+            bucket_start=datetime.fromtimestamp(hour, tz=dt_timezone.utc),
+            defaults={
+                'samples': total,
+                'download_avg': sum(row.download_avg * row.samples for row in rows) / total,
+                'download_max': max(row.download_max for row in rows),
+                'upload_avg': sum(row.upload_avg * row.samples for row in rows) / total,
+                'peers_avg': sum(row.peers_avg * row.samples for row in rows) / total,
+                'progress': rows[-1].progress,
+            },
+        )
+
+
+def prune():
+    """Delete rollups past retention across all torrents, finished ones never roll over an hour again"""
+
+    now = timezone.now()
+    with metrics.DB_WRITE_SECONDS.time(table='throughput'):
+        minutes, _ = ThroughputRollup.objects.filter(
+            resolution=MINUTE,
+            bucket_start__lt=now - timedelta(seconds=settings.TORRENT_HISTORY_MINUTE_RETENTION),
+        ).delete()
+        hours, _ = ThroughputRollup.objects.filter(
+            resolution=HOUR,
+            bucket_start__lt=now - timedelta(seconds=settings.TORRENT_HISTORY_HOUR_RETENTION),
+        ).delete()
+    return minutes + hours
+
+
+def start_pruning_worker():
+    """Start the retention pruning thread unless it is already running"""
+
+    global _pruner
+    with _pruner_lock:
+        if _pruner is None or not _pruner.is_alive():
+            _pruner = threading.Thread(target=run_pruning_worker)
+            _pruner.daemon = True
+            _pruner.start()
+
+
+def run_pruning_worker():
+    while True:
+        try:
+            pruned = prune()
+            if pruned:
+                logger.info("Pruned %d throughput rollups past retention", pruned)
+        except Exception as e:
+            logger.warning("Pruning throughput history failed: %s", e)
+        finally:
+            close_old_connections()
+        time.sleep(settings.TORRENT_HISTORY_PRUNE_INTERVAL)
+
+
+def history(torrent_id, seconds):
+    """Points covering the last seconds at the finest resolution still kept for that range
+
+    Each point is [epoch seconds, download KB/s, upload KB/s, peers, progress].
+    """
+
+    now = time.time()
+    since = now - seconds
+
+    with _buffers_lock:
+        buffer = _buffers.get(torrent_id)
+    if buffer is not None and seconds <= RAW_RANGE:
+        return {
+            'resolution': 'raw',
+            'points': [[round(sample[0]), *(round(value, 2) for value in sample[1:])] for sample in buffer.samples(since)],
+        }
+
+    resolution = MINUTE if seconds <= settings.TORRENT_HISTORY_MINUTE_RETENTION else HOUR
+    rows = ThroughputRollup.objects.filter(
+        torrent_id=torrent_id,
+        resolution=resolution,
+        bucket_start__gte=datetime.fromtimestamp(since // resolution * resolution, tz=dt_timezone.utc),
+    ).values_list('bucket_start', 'download_avg', 'upload_avg', 'peers_avg', 'progress')
+
+    return {
+        'resolution': 'minute' if resolution == MINUTE else 'hour',
+        'points': [[round(row[0].timestamp()), *(round(value, 2) for value in row[1:])] for row in rows],
+    }
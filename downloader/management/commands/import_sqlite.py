@@ -0,0 +1,111 @@
+# downloader/management/commands/import_sqlite.py - Copy an existing SQLite database into the configured one
+import os
+import shutil
+import sqlite3
+import tempfile
+from django.apps import apps
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections, transaction
+
+# Apps whose rows are carried over, in dependency order
+APPS = ['contenttypes', 'auth', 'admin', 'sessions', 'downloader']
+
+SOURCE_ALIAS = 'sqlite_import'
+
+
+class Command(BaseCommand):
+    help = 'Copy all rows from an old db.sqlite3 into the configured (e.g. PostgreSQL) database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path of the SQLite database to import')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f"{path} does not exist")
+        target = connections['default'].settings_dict['NAME']
+        if connections['default'].vendor == 'sqlite' and os.path.abspath(path) == os.path.abspath(target):
+            raise CommandError('The source is the configured database, point POSTGRES_HOST at the target first')
+
+        # The source is migrated below, work on a copy so a failed import leaves the user's file as it was
+        workdir = tempfile.mkdtemp(prefix='import_sqlite_')
+        try:
+            copy = os.path.join(workdir, 'source.sqlite3')
+            self.copy_database(path, copy)
+            self.import_from(copy, options['batch_size'])
+        finally:
+            # Unregistered again, called in-process the alias would otherwise outlive the command
+            if SOURCE_ALIAS in connections.settings:
+                connections[SOURCE_ALIAS].close()
+                del connections[SOURCE_ALIAS]
+                del connections.settings[SOURCE_ALIAS]
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        self.stdout.write(self.style.SUCCESS(f"✅ Imported {path}"))
+
+    def copy_database(self, path, copy):
+        """Consistent copy through SQLite's backup API, which also picks up pages still in the WAL"""
+
+        source = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        destination = sqlite3.connect(copy)
+        try:
+            source.backup(destination)
+        finally:
+            destination.close()
+            source.close()
+
+    def import_from(self, path, batch_size):
+        connections.settings[SOURCE_ALIAS] = {
+            **connections['default'].settings_dict,
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': path,
+            'OPTIONS': {},
+        }
+
+        # Both sides have to be on the same schema before rows can be copied
+        self.stdout.write('Bringing both databases up to the latest migration')
+        call_command('migrate', database=SOURCE_ALIAS, verbosity=0)
+        call_command('migrate', database='default', verbosity=0)
+
+        models = [
+            model for label in APPS
+            for model in apps.get_app_config(label).get_models(include_auto_created=True)
+        ]
+        with transaction.atomic(using='default'):
+            # migrate just created content types and permissions with its own ids, the source's win
+            ContentType = apps.get_model('contenttypes', 'ContentType')
+            ContentType.objects.using('default').all().delete()
+
+            for model in models:
+                if model.objects.using('default').exists():
+                    raise CommandError(f"{model._meta.label} already has rows in the target, import into an empty database")
+
+            for model in models:
+                copied = self.copy_rows(model, batch_size)
+                self.stdout.write(f"  {model._meta.label}: {copied} rows")
+
+            # Auto-increment ids were inserted explicitly, move the sequences past them
+            connection = connections['default']
+            with connection.cursor() as cursor:
+                for statement in connection.ops.sequence_reset_sql(no_style(), models):
+                    cursor.execute(statement)
+
+    def copy_rows(self, model, batch_size):
+        """Copy one table in primary key order without holding it all in memory"""
+
+        rows = model.objects.using(SOURCE_ALIAS).order_by('pk').iterator(chunk_size=batch_size)
+        batch = []
+        copied = 0
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                model.objects.using('default').bulk_create(batch)
+                copied += len(batch)
+                batch = []
+        if batch:
+            model.objects.using('default').bulk_create(batch)
+            copied += len(batch)
+        return copied
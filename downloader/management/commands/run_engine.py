@@ -0,0 +1,125 @@
+# downloader/management/commands/run_engine.py - Standalone download engine split into shard processes
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from downloader.models import VerifyJob
+from downloader import engine, metrics, recovery, shards, verify
+
+# A shard that ran this long before exiting is restarted without backoff
+STABLE_RUN_SECONDS = 60
+
+
+class Command(BaseCommand):
+    help = 'Run the download engine in N shard processes, torrents are assigned by info hash'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', type=int, default=settings.TORRENT_ENGINE_SHARDS,
+                            help='Number of engine processes to run')
+        # Used by the supervisor to start a single shard
+        parser.add_argument('--shard', type=int, help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        count = options['shards']
+        if count < 1:
+            raise CommandError('--shards must be at least 1')
+
+        if options['shard'] is None:
+            self.supervise(count)
+        elif 0 <= options['shard'] < count:
+            self.run_shard(options['shard'], count)
+        else:
+            raise CommandError(f"--shard must be between 0 and {count - 1}")
+
+    def supervise(self, count):
+        """Start one process per shard and restart shards that exit, backing off while they keep crashing"""
+
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+
+        processes = {}
+        started_at = {}
+        restart_at = {}
+        delays = {index: settings.TORRENT_ENGINE_RESTART_DELAY for index in range(count)}
+
+        for index in range(count):
+            processes[index] = self.spawn(index, count)
+            started_at[index] = time.monotonic()
+        self.stdout.write(f"⚙️ Supervising {count} engine shards")
+
+        while not stopping:
+            time.sleep(1)
+            now = time.monotonic()
+
+            for index in range(count):
+                if index in restart_at:
+                    if now >= restart_at[index]:
+                        del restart_at[index]
+                        processes[index] = self.spawn(index, count)
+                        started_at[index] = now
+                    continue
+
+                code = processes[index].poll()
+                if code is None:
+                    continue
+
+                if now - started_at[index] >= STABLE_RUN_SECONDS:
+                    delays[index] = settings.TORRENT_ENGINE_RESTART_DELAY
+                self.stderr.write(f"💥 Engine shard {index} exited with {code}, restarting in {delays[index]}s")
+                restart_at[index] = now + delays[index]
+                delays[index] = min(delays[index] * 2, 300)
+
+        self.stdout.write("🛑 Stopping engine shards")
+        for process in processes.values():
+            if process.poll() is None:
+                process.terminate()
+        for process in processes.values():
+            try:
+                process.wait(settings.TORRENT_RESUME_DATA_TIMEOUT + 10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def spawn(self, index, count):
+        """Start one shard as a fresh interpreter so it gets its own GIL and libtorrent session"""
+
+        return subprocess.Popen([
+            sys.executable, os.path.abspath(sys.argv[0]), 'run_engine',
+            '--shards', str(count), '--shard', str(index),
+        ])
+
+    def run_shard(self, index, count):
+        """Dispatch this shard's part of the queue until told to stop"""
+
+        shards.configure(index, count)
+        self.stdout.write(f"⚙️ Engine shard {index + 1}/{count} started (pid {os.getpid()})")
+
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+
+        if settings.TORRENT_METRICS_PORT:
+            metrics.start_metrics_server(settings.TORRENT_METRICS_PORT)
+
+        count = recovery.requeue_orphans()
+        if count:
+            self.stdout.write(f"🔁 Requeued {count} downloads from a previous engine run")
+
+        while not stopping:
+            try:
+                engine.dispatch_queue()
+                if shards.is_primary() and VerifyJob.objects.filter(status='pending').exists():
+                    verify.start_verify_worker()
+            except Exception as e:
+                self.stderr.write(f"⚠️ Engine shard {index} dispatch failed: {e}")
+            finally:
+                close_old_connections()
+            time.sleep(settings.TORRENT_ENGINE_POLL_INTERVAL)
+
+        stopped = engine.drain_downloads(settings.TORRENT_RESUME_DATA_TIMEOUT)
+        self.stdout.write(f"🛑 Engine shard {index} stopped, {stopped} downloads saved for later")
@@ -0,0 +1,288 @@
+# downloader/metrics.py - Prometheus text exposition of engine, queue and web tier metrics
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.db import close_old_connections
+from django.db.models import Count, Sum
+from django.http import Http404
+from .models import TorrentDownload, TorrentLiveStatus
+from . import session, shards
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# How long a scrape waits for libtorrent to answer post_session_stats
+SESSION_STATS_TIMEOUT = 2  # seconds
+
+# Counters and histograms fed by this process, in exposition order
+_registry = []
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label combination, kept since the process started"""
+
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for key, value in sorted(values.items()):
+            yield self.name, tuple(zip(self.labels, key)), value
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observed durations per label combination"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        # Label values -> [count per bucket..., +Inf count, sum]
+        self.values = {}
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self.lock:
+            values = {key: list(counts) for key, counts in self.values.items()}
+        for key, counts in sorted(values.items()):
+            labels = tuple(zip(self.labels, key))
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                yield f'{self.name}_bucket', labels + (('le', format_value(float(bound))),), count
+            yield f'{self.name}_count', labels, counts[-2]
+            yield f'{self.name}_sum', labels, counts[-1]
+
+
+DB_WRITE_SECONDS = Histogram(
+    'torrent_db_write_seconds',
+    'Time spent writing engine state to the database',
+    labels=('table',),
+)
+PROGRESS_FLUSH_SECONDS = Histogram(
+    'torrent_progress_flush_seconds',
+    'Time a download or seeding tick spends reading status and flushing it to the database',
+    labels=('source',),
+)
+HTTP_REQUESTS = Counter(
+    'torrent_http_requests_total',
+    'Status API requests served by this process',
+    labels=('endpoint', 'code'),
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    'torrent_http_request_seconds',
+    'Status API request latency',
+    labels=('endpoint',),
+)
+
+
+def instrumented(endpoint):
+    """Count a view's requests and time them under the given endpoint name"""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            code = 500
+            try:
+                with HTTP_REQUEST_SECONDS.time(endpoint=endpoint):
+                    response = view(request, *args, **kwargs)
+                code = response.status_code
+                return response
+            except Http404:
+                code = 404
+                raise
+            finally:
+                HTTP_REQUESTS.inc(endpoint=endpoint, code=code)
+        return wrapper
+    return decorator
+
+
+def queue_metrics():
+    """Rows per status and global rates, read from the database so every process agrees"""
+
+    counts = dict.fromkeys((status for status, label in TorrentDownload.STATUS_CHOICES), 0)
+    counts.update(TorrentDownload.objects.values_list('status').annotate(rows=Count('id')).order_by())
+    for status, rows in counts.items():
+        yield 'torrent_queue_depth', 'gauge', 'Torrents per status', (('status', status),), rows
+
+    seeding = TorrentDownload.objects.filter(is_seeding=True).count()
+    yield 'torrent_seeding', 'gauge', 'Torrents currently seeding', (), seeding
+
+    totals = TorrentLiveStatus.objects.aggregate(download=Sum('download_speed'), upload=Sum('upload_speed'))
+    yield ('torrent_engine_download_bytes_per_second', 'gauge', 'Download rate of all torrents', (),
+           (totals['download'] or 0) * 1024)
+    yield ('torrent_engine_upload_bytes_per_second', 'gauge', 'Upload rate of all torrents', (),
+           (totals['upload'] or 0) * 1024)
+
+
+def torrent_metrics():
+    """Per-torrent rates, limited to torrents downloading or seeding to keep the series count bounded"""
+
+    rows = TorrentLiveStatus.objects.filter(
+        torrent__in=TorrentDownload.objects.filter(status='downloading') | TorrentDownload.objects.filter(is_seeding=True),
+    ).select_related('torrent')
+
+    for live in rows:
+        labels = (('torrent', str(live.torrent_id)), ('name', live.torrent.name))
+        yield 'torrent_download_bytes_per_second', 'gauge', 'Download rate of one torrent', labels, live.download_speed * 1024
+        yield 'torrent_upload_bytes_per_second', 'gauge', 'Upload rate of one torrent', labels, live.upload_speed * 1024
+        yield 'torrent_progress_ratio', 'gauge', 'Fraction of one torrent downloaded', labels, live.progress
+        yield 'torrent_peers', 'gauge', 'Peers connected to one torrent', labels, live.peers
+
+
+def session_metrics():
+    """libtorrent session_stats counters, only where this process runs a session"""
+
+    ses = session.running_session()
+    if ses is None:
+        return
+
+    import libtorrent as lt
+
+    waiter = session.expect_alert(
+        lambda alert: isinstance(alert, lt.session_stats_alert),
+        lambda alert: dict(alert.values),
+    )
+    ses.post_session_stats()
+    values = waiter.wait(SESSION_STATS_TIMEOUT)
+    if values is None:
+        logger.warning("libtorrent did not answer the session stats request in time")
+        return
+
+    for metric in lt.session_stats_metrics():
+        if metric.name not in values:
+            continue
+        kind = 'counter' if metric.type == lt.metric_type_t.counter else 'gauge'
+        name = 'libtorrent_' + metric.name.replace('.', '_')
+        if kind == 'counter':
+            name += '_total'
+        yield name, kind, f'libtorrent session counter {metric.name}', (), values[metric.name]
+
+
+def render():
+    """Every metric of this process in the Prometheus text format"""
+
+    # Samples grouped by metric family, the format wants each family in one block
+    families = {}
+
+    # Gauges read from the database are the same in every process, only the web tier exports them
+    # so that sum() across the engine shards' scrape targets doesn't count every row N times
+    collectors = [session_metrics]
+    if shards.current() is None:
+        collectors = [queue_metrics, torrent_metrics] + collectors
+
+    for collector in collectors:
+        try:
+            for name, kind, description, labels, value in collector():
+                family = families.setdefault(name, [f'# HELP {name} {description}', f'# TYPE {name} {kind}'])
+                family.append(f'{name}{format_labels(labels)} {format_value(value)}')
+        except Exception as e:
+            logger.warning("Collecting %s failed: %s", collector.__name__, e)
+
+    lines = [line for family in families.values() for line in family]
+    for metric in _registry:
+        lines.append(f'# HELP {metric.name} {metric.description}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for name, labels, value in metric.samples():
+            lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves /metrics from engine shards, which have no Django web tier of their own
+
+    Shards export their own session counters and timings, the database-wide
+    queue and torrent gauges come from the web tier's /metrics.
+    """
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        try:
+            body = render().encode()
+        finally:
+            close_old_connections()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port):
+    """Serve this process's metrics on a port of its own, each shard offsets it by its index"""
+
+    current = shards.current()
+    port += current[0] if current else 0
+    server = ThreadingHTTPServer(('', port), MetricsHandler)
+    server.daemon_threads = True
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    logger.info("Metrics served on port %d", port)
+    return server
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-19 06:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("downloader", "0002_deletion_job"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="torrentdownload",
+            name="status_message",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
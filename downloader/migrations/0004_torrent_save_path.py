@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-19 06:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("downloader", "0003_torrent_status_message"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="torrentdownload",
+            name="save_path",
+            field=models.CharField(blank=True, max_length=500),
+        ),
+    ]
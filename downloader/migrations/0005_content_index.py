@@ -0,0 +1,48 @@
+# Generated by Django 4.2 on 2026-10-19 07:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("downloader", "0004_torrent_save_path"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ContentFile",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("path", models.CharField(max_length=1000)),
+                ("size", models.BigIntegerField()),
+                ("sha256", models.CharField(blank=True, max_length=64)),
+                ("linked", models.BooleanField(default=False)),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "torrent",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="content_files",
+                        to="downloader.torrentdownload",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="contentfile",
+            index=models.Index(
+                fields=["size", "sha256"], name="downloader__size_32c431_idx"
+            ),
+        ),
+    ]
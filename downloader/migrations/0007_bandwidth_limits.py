@@ -0,0 +1,83 @@
+# Generated by Django 4.2 on 2026-10-19 07:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("downloader", "0006_verify_job"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BandwidthSchedule",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "day_of_week",
+                    models.IntegerField(
+                        choices=[
+                            (0, "Monday"),
+                            (1, "Tuesday"),
+                            (2, "Wednesday"),
+                            (3, "Thursday"),
+                            (4, "Friday"),
+                            (5, "Saturday"),
+                            (6, "Sunday"),
+                        ]
+                    ),
+                ),
+                ("start_time", models.TimeField()),
+                ("end_time", models.TimeField()),
+                ("download_limit", models.IntegerField(default=0)),
+                ("upload_limit", models.IntegerField(default=0)),
+            ],
+            options={
+                "ordering": ["day_of_week", "start_time"],
+            },
+        ),
+        migrations.CreateModel(
+            name="BandwidthSettings",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("download_limit", models.IntegerField(default=0)),
+                ("upload_limit", models.IntegerField(default=0)),
+                ("schedule_enabled", models.BooleanField(default=True)),
+            ],
+            options={
+                "verbose_name_plural": "bandwidth settings",
+            },
+        ),
+        migrations.AddField(
+            model_name="torrentdownload",
+            name="bandwidth_priority",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="torrentdownload",
+            name="download_limit",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="torrentdownload",
+            name="upload_limit",
+            field=models.IntegerField(default=0),
+        ),
+    ]
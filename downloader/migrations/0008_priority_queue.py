@@ -0,0 +1,26 @@
+# Generated by Django 4.2 on 2026-10-19 07:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("downloader", "0007_bandwidth_limits"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="torrentdownload",
+            name="priority",
+            field=models.IntegerField(
+                choices=[(3, "Critical"), (2, "High"), (1, "Normal"), (0, "Low")],
+                default=1,
+            ),
+        ),
+        migrations.AddField(
+            model_name="torrentdownload",
+            name="queue_position",
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-19 07:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("downloader", "0008_priority_queue"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="torrentdownload",
+            name="next_retry_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="torrentdownload",
+            name="retry_count",
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2 on 2026-10-19 07:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("downloader", "0009_stall_retry"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="torrentdownload",
+            name="swarm_checked_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="torrentdownload",
+            name="swarm_completed",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="torrentdownload",
+            name="swarm_dht_peers",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="torrentdownload",
+            name="swarm_leechers",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="torrentdownload",
+            name="swarm_seeders",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
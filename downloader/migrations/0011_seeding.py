@@ -0,0 +1,28 @@
+# Generated by Django 4.2 on 2026-10-19 07:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("downloader", "0010_swarm_health"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="torrentdownload",
+            name="is_seeding",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="torrentdownload",
+            name="seed_time",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="torrentdownload",
+            name="uploaded",
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
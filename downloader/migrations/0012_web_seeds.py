@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-19 07:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("downloader", "0011_seeding"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="torrentdownload",
+            name="web_seeds",
+            field=models.TextField(blank=True),
+        ),
+    ]
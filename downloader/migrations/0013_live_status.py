@@ -0,0 +1,89 @@
+# Generated by Django 4.2 on 2026-10-19 07:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+LIVE_FIELDS = ["progress", "download_speed", "upload_speed", "downloaded", "peers", "seeds"]
+
+
+def copy_live_status(apps, schema_editor):
+    TorrentDownload = apps.get_model("downloader", "TorrentDownload")
+    TorrentLiveStatus = apps.get_model("downloader", "TorrentLiveStatus")
+    db_alias = schema_editor.connection.alias
+    # ETAs were display strings, the next download tick fills in seconds
+    TorrentLiveStatus.objects.using(db_alias).bulk_create(
+        [
+            TorrentLiveStatus(torrent_id=row["id"], **{name: row[name] for name in LIVE_FIELDS})
+            for row in TorrentDownload.objects.using(db_alias).values("id", *LIVE_FIELDS).iterator()
+        ],
+        batch_size=500,
+    )
+
+
+def restore_live_status(apps, schema_editor):
+    TorrentDownload = apps.get_model("downloader", "TorrentDownload")
+    TorrentLiveStatus = apps.get_model("downloader", "TorrentLiveStatus")
+    db_alias = schema_editor.connection.alias
+    for live in TorrentLiveStatus.objects.using(db_alias).iterator():
+        TorrentDownload.objects.using(db_alias).filter(id=live.torrent_id).update(**{name: getattr(live, name) for name in LIVE_FIELDS})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("downloader", "0012_web_seeds"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TorrentLiveStatus",
+            fields=[
+                (
+                    "torrent",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="live",
+                        serialize=False,
+                        to="downloader.torrentdownload",
+                    ),
+                ),
+                ("progress", models.FloatField(default=0.0)),
+                ("download_speed", models.FloatField(default=0.0)),
+                ("upload_speed", models.FloatField(default=0.0)),
+                ("downloaded", models.BigIntegerField(default=0)),
+                ("peers", models.IntegerField(default=0)),
+                ("seeds", models.IntegerField(default=0)),
+                ("eta_seconds", models.IntegerField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(copy_live_status, restore_live_status),
+        migrations.RemoveField(
+            model_name="torrentdownload",
+            name="download_speed",
+        ),
+        migrations.RemoveField(
+            model_name="torrentdownload",
+            name="downloaded",
+        ),
+        migrations.RemoveField(
+            model_name="torrentdownload",
+            name="eta",
+        ),
+        migrations.RemoveField(
+            model_name="torrentdownload",
+            name="peers",
+        ),
+        migrations.RemoveField(
+            model_name="torrentdownload",
+            name="progress",
+        ),
+        migrations.RemoveField(
+            model_name="torrentdownload",
+            name="seeds",
+        ),
+        migrations.RemoveField(
+            model_name="torrentdownload",
+            name="upload_speed",
+        ),
+    ]
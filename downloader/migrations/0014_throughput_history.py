@@ -0,0 +1,57 @@
+# Generated by Django 4.2 on 2026-10-19 07:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("downloader", "0013_live_status"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ThroughputRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "resolution",
+                    models.IntegerField(choices=[(60, "Minute"), (3600, "Hour")]),
+                ),
+                ("bucket_start", models.DateTimeField()),
+                ("samples", models.IntegerField(default=0)),
+                ("download_avg", models.FloatField(default=0.0)),
+                ("download_max", models.FloatField(default=0.0)),
+                ("upload_avg", models.FloatField(default=0.0)),
+                ("peers_avg", models.FloatField(default=0.0)),
+                ("progress", models.FloatField(default=0.0)),
+                (
+                    "torrent",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="throughput",
+                        to="downloader.torrentdownload",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["bucket_start"],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="throughputrollup",
+            constraint=models.UniqueConstraint(
+                fields=("torrent", "resolution", "bucket_start"),
+                name="unique_throughput_bucket",
+            ),
+        ),
+    ]
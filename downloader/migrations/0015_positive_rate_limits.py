@@ -0,0 +1,55 @@
+# Generated by Django 4.2 on 2026-10-19 07:48
+
+from django.db import migrations, models
+
+RATE_LIMIT_MODELS = ["TorrentDownload", "BandwidthSettings", "BandwidthSchedule"]
+
+
+def clamp_negative_limits(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    # Negative values were accepted before and meant nothing, the new check constraint would reject them
+    for model_name in RATE_LIMIT_MODELS:
+        model = apps.get_model("downloader", model_name)
+        model.objects.using(db_alias).filter(download_limit__lt=0).update(download_limit=0)
+        model.objects.using(db_alias).filter(upload_limit__lt=0).update(upload_limit=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("downloader", "0014_throughput_history"),
+    ]
+
+    operations = [
+        migrations.RunPython(clamp_negative_limits, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="bandwidthschedule",
+            name="download_limit",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name="bandwidthschedule",
+            name="upload_limit",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name="bandwidthsettings",
+            name="download_limit",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name="bandwidthsettings",
+            name="upload_limit",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name="torrentdownload",
+            name="download_limit",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name="torrentdownload",
+            name="upload_limit",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
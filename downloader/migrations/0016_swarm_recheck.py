@@ -0,0 +1,29 @@
+# Generated by Django 4.2 on 2026-10-19 07:49
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def move_dead_swarm_deferrals(apps, schema_editor):
+    TorrentDownload = apps.get_model("downloader", "TorrentDownload")
+    db_alias = schema_editor.connection.alias
+    # Dead swarms used to be deferred through the stall backoff column
+    TorrentDownload.objects.using(db_alias).filter(
+        status_message__startswith="No seeders found", next_retry_at__isnull=False,
+    ).update(swarm_recheck_at=F("next_retry_at"), next_retry_at=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("downloader", "0015_positive_rate_limits"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="torrentdownload",
+            name="swarm_recheck_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(move_dead_swarm_deferrals, migrations.RunPython.noop),
+    ]
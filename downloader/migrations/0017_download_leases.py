@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-19 07:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("downloader", "0016_swarm_recheck"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="torrentdownload",
+            name="lease_expires_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="torrentdownload",
+            name="lease_token",
+            field=models.UUIDField(blank=True, null=True),
+        ),
+    ]
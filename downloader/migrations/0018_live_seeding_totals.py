@@ -0,0 +1,40 @@
+# Generated by Django 4.2 on 2026-10-19 08:12
+
+from django.db import migrations, models
+
+
+def restore_seeding_totals(apps, schema_editor):
+    TorrentDownload = apps.get_model("downloader", "TorrentDownload")
+    TorrentLiveStatus = apps.get_model("downloader", "TorrentLiveStatus")
+    db_alias = schema_editor.connection.alias
+    # Seeds still running hold totals the torrent row has not caught up with
+    for live in TorrentLiveStatus.objects.using(db_alias).filter(torrent__is_seeding=True).iterator():
+        TorrentDownload.objects.using(db_alias).filter(id=live.torrent_id, uploaded__lt=live.uploaded).update(uploaded=live.uploaded)
+        TorrentDownload.objects.using(db_alias).filter(id=live.torrent_id, seed_time__lt=live.seed_time).update(seed_time=live.seed_time)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("downloader", "0017_download_leases"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="torrentlivestatus",
+            name="seed_time",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="torrentlivestatus",
+            name="status_message",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name="torrentlivestatus",
+            name="uploaded",
+            field=models.BigIntegerField(default=0),
+        ),
+        # The torrent row's totals stay valid going forward, the live row only ever runs ahead of them
+        migrations.RunPython(migrations.RunPython.noop, restore_seeding_totals),
+    ]
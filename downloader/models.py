@@ -3,30 +3,57 @@ from django.utils import timezone
 import uuid
 
 class TorrentDownload(models.Model):
+    PRIORITY_LOW = 0
+    PRIORITY_NORMAL = 1
+    PRIORITY_HIGH = 2
+    PRIORITY_CRITICAL = 3
+
+    PRIORITY_CHOICES = [
+        (PRIORITY_CRITICAL, 'Critical'),
+        (PRIORITY_HIGH, 'High'),
+        (PRIORITY_NORMAL, 'Normal'),
+        (PRIORITY_LOW, 'Low'),
+    ]
+
     STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('downloading', 'Downloading'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
         ('paused', 'Paused'),
+        ('deleting', 'Deleting'),
     ]
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=255)
     magnet_link = models.TextField()
+    web_seeds = models.TextField(blank=True)         # extra HTTP mirror URLs, one per line
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
-    progress = models.FloatField(default=0.0)
-    download_speed = models.FloatField(default=0.0)  # KB/s
-    upload_speed = models.FloatField(default=0.0)    # KB/s
+    status_message = models.CharField(max_length=255, blank=True)  # why a torrent is waiting
+    priority = models.IntegerField(choices=PRIORITY_CHOICES, default=PRIORITY_NORMAL)
+    queue_position = models.IntegerField(default=0)  # order within a priority level, lower starts first
+    uploaded = models.BigIntegerField(default=0)     # bytes, all time as of the last seed stop
     size = models.BigIntegerField(default=0)         # bytes
-    downloaded = models.BigIntegerField(default=0)   # bytes
-    peers = models.IntegerField(default=0)
-    seeds = models.IntegerField(default=0)
-    eta = models.CharField(max_length=50, blank=True)
+    retry_count = models.IntegerField(default=0)     # stalls since the last manual restart
+    next_retry_at = models.DateTimeField(null=True, blank=True)  # queue skips the torrent until then
+    lease_token = models.UUIDField(null=True, blank=True)       # the one Celery task allowed to run the download
+    lease_expires_at = models.DateTimeField(null=True, blank=True)  # requeued once its worker stops renewing
+    swarm_seeders = models.IntegerField(null=True, blank=True)    # from tracker scrapes, None = unknown
+    swarm_leechers = models.IntegerField(null=True, blank=True)
+    swarm_completed = models.IntegerField(null=True, blank=True)
+    swarm_dht_peers = models.IntegerField(null=True, blank=True)  # peers the DHT returned
+    swarm_checked_at = models.DateTimeField(null=True, blank=True)
+    swarm_recheck_at = models.DateTimeField(null=True, blank=True)  # dead swarm, queue skips it until rescraped
+    download_limit = models.PositiveIntegerField(default=0)  # KB/s, 0 = unlimited
+    upload_limit = models.PositiveIntegerField(default=0)    # KB/s, 0 = unlimited
+    bandwidth_priority = models.BooleanField(default=False)  # gets the larger share of limited bandwidth
+    save_path = models.CharField(max_length=500, blank=True)  # volume the torrent was placed on
     file_path = models.CharField(max_length=500, blank=True)
     is_multi_file = models.BooleanField(default=False)
     created_at = models.DateTimeField(default=timezone.now)
     completed_at = models.DateTimeField(null=True, blank=True)
+    is_seeding = models.BooleanField(default=False)
+    seed_time = models.IntegerField(default=0)       # seconds spent actively seeding, as of the last seed stop
     
     class Meta:
         ordering = ['-created_at']
@@ -34,9 +61,61 @@ class TorrentDownload(models.Model):
     def __str__(self):
         return self.name
     
+    def save(self, *args, **kwargs):
+        # New torrents join the back of the queue
+        if self._state.adding and not self.queue_position:
+            last = TorrentDownload.objects.aggregate(last=models.Max('queue_position'))['last']
+            self.queue_position = (last or 0) + 1
+        super().save(*args, **kwargs)
+    
+    @property
+    def live_status(self):
+        """The torrent's volatile counters, zeroed until its first download tick"""
+        try:
+            return self.live
+        except TorrentLiveStatus.DoesNotExist:
+            return TorrentLiveStatus(torrent=self)
+    
     @property
     def progress_percentage(self):
-        return min(100, max(0, self.progress * 100))
+        return self.live_status.progress_percentage
+    
+    @property
+    def web_seed_urls(self):
+        return [url.strip() for url in self.web_seeds.splitlines() if url.strip()]
+    
+    # The seeding worker keeps running totals on the live row, this one only catches up when a seed stops
+    @property
+    def uploaded_total(self):
+        return max(self.uploaded, self.live_status.uploaded)
+    
+    @property
+    def seed_time_total(self):
+        return max(self.seed_time, self.live_status.seed_time)
+    
+    @property
+    def current_status_message(self):
+        """The seeding worker's message while the torrent seeds, the row's own otherwise"""
+        if self.is_seeding and self.live_status.status_message:
+            return self.live_status.status_message
+        return self.status_message
+    
+    @property
+    def seed_ratio(self):
+        if not self.size:
+            return 0.0
+        return self.uploaded_total / self.size
+    
+    @property
+    def swarm_summary(self):
+        if self.swarm_checked_at is None:
+            return ''
+        parts = []
+        if self.swarm_seeders is not None:
+            parts.append(f"{self.swarm_seeders} seeders, {self.swarm_leechers} leechers, {self.swarm_completed} completed")
+        if self.swarm_dht_peers is not None:
+            parts.append(f"{self.swarm_dht_peers} DHT peers")
+        return ' · '.join(parts) or 'No trackers answered'
     
     @property
     def size_human(self):
@@ -44,11 +123,11 @@ class TorrentDownload(models.Model):
     
     @property
     def downloaded_human(self):
-        return self.format_bytes(self.downloaded)
+        return self.format_bytes(self.live_status.downloaded)
     
     @property
     def download_speed_human(self):
-        return f"{self.format_bytes(self.download_speed * 1024)}/s"
+        return f"{self.format_bytes(self.live_status.download_speed * 1024)}/s"
     
     @staticmethod
     def format_bytes(bytes_val):
@@ -60,3 +139,195 @@ class TorrentDownload(models.Model):
                 return f"{bytes_val:.1f} {unit}"
             bytes_val /= 1024.0
         return f"{bytes_val:.1f} PB"
+
+
+# Counters rewritten on every download tick, kept out of the wide torrent row
+class TorrentLiveStatus(models.Model):
+    torrent = models.OneToOneField(TorrentDownload, on_delete=models.CASCADE, primary_key=True, related_name='live')
+    progress = models.FloatField(default=0.0)
+    download_speed = models.FloatField(default=0.0)  # KB/s
+    upload_speed = models.FloatField(default=0.0)    # KB/s
+    downloaded = models.BigIntegerField(default=0)   # bytes
+    peers = models.IntegerField(default=0)
+    seeds = models.IntegerField(default=0)
+    eta_seconds = models.IntegerField(null=True, blank=True)  # None = not moving
+    uploaded = models.BigIntegerField(default=0)     # bytes, all time while seeding
+    seed_time = models.IntegerField(default=0)       # seconds spent actively seeding
+    status_message = models.CharField(max_length=255, blank=True)  # seeding worker's per-tick message
+
+    def __str__(self):
+        return f"{self.torrent_id}: {self.progress_percentage:.1f}%"
+
+    @property
+    def progress_percentage(self):
+        return min(100, max(0, self.progress * 100))
+
+    @property
+    def eta_display(self):
+        if self.eta_seconds is None:
+            return "∞"
+        if self.eta_seconds < 60:
+            return f"{self.eta_seconds}s"
+        if self.eta_seconds < 3600:
+            return f"{self.eta_seconds // 60}m"
+        return f"{self.eta_seconds // 3600}h {self.eta_seconds % 3600 // 60}m"
+
+
+# Throughput averaged over a minute or an hour, the raw per-tick samples only live in memory
+class ThroughputRollup(models.Model):
+    RESOLUTION_MINUTE = 60
+    RESOLUTION_HOUR = 3600
+
+    RESOLUTION_CHOICES = [
+        (RESOLUTION_MINUTE, 'Minute'),
+        (RESOLUTION_HOUR, 'Hour'),
+    ]
+
+    torrent = models.ForeignKey(TorrentDownload, on_delete=models.CASCADE, related_name='throughput')
+    resolution = models.IntegerField(choices=RESOLUTION_CHOICES)  # seconds per bucket
+    bucket_start = models.DateTimeField()
+    samples = models.IntegerField(default=0)
+    download_avg = models.FloatField(default=0.0)  # KB/s
+    download_max = models.FloatField(default=0.0)  # KB/s
+    upload_avg = models.FloatField(default=0.0)    # KB/s
+    peers_avg = models.FloatField(default=0.0)
+    progress = models.FloatField(default=0.0)      # at the end of the bucket
+
+    class Meta:
+        ordering = ['bucket_start']
+        constraints = [
+            models.UniqueConstraint(fields=['torrent', 'resolution', 'bucket_start'], name='unique_throughput_bucket'),
+        ]
+
+    def __str__(self):
+        return f"{self.torrent_id} {self.get_resolution_display()} {self.bucket_start:%Y-%m-%d %H:%M}"
+
+
+class DeletionJob(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    total = models.IntegerField(default=0)           # torrents
+    processed = models.IntegerField(default=0)       # torrents
+    files_deleted = models.IntegerField(default=0)
+    bytes_freed = models.BigIntegerField(default=0)  # bytes
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Deletion job {self.id} ({self.processed}/{self.total})"
+
+    @property
+    def progress_percentage(self):
+        if not self.total:
+            return 100
+        return min(100, max(0, self.processed * 100 / self.total))
+
+
+class ContentFile(models.Model):
+    torrent = models.ForeignKey(TorrentDownload, on_delete=models.CASCADE, related_name='content_files')
+    path = models.CharField(max_length=1000)
+    size = models.BigIntegerField()                  # bytes
+    sha256 = models.CharField(max_length=64, blank=True)  # empty until another file has the same size
+    linked = models.BooleanField(default=False)      # replaced with a link to identical content
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=['size', 'sha256'])]
+
+    def __str__(self):
+        return self.path
+
+
+class VerifyJob(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    torrent = models.ForeignKey(TorrentDownload, on_delete=models.CASCADE, related_name='verify_jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    total_pieces = models.IntegerField(default=0)
+    checked_pieces = models.IntegerField(default=0)
+    corrupt_pieces = models.JSONField(default=list, blank=True)
+    repair_pending = models.BooleanField(default=False)  # corrupt pieces still to be re-downloaded
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f"Verify {self.torrent} ({self.checked_pieces}/{self.total_pieces})"
+
+    @property
+    def progress_percentage(self):
+        if not self.total_pieces:
+            return 0
+        return min(100, max(0, self.checked_pieces * 100 / self.total_pieces))
+
+
+class BandwidthSettings(models.Model):
+    download_limit = models.PositiveIntegerField(default=0)  # KB/s, 0 = unlimited
+    upload_limit = models.PositiveIntegerField(default=0)    # KB/s, 0 = unlimited
+    schedule_enabled = models.BooleanField(default=True)
+
+    class Meta:
+        verbose_name_plural = 'bandwidth settings'
+
+    def __str__(self):
+        return "Bandwidth settings"
+
+    @classmethod
+    def load(cls):
+        """The single settings row, created with defaults on first use"""
+        instance, created = cls.objects.get_or_create(pk=1)
+        return instance
+
+
+class BandwidthSchedule(models.Model):
+    DAY_CHOICES = [
+        (0, 'Monday'),
+        (1, 'Tuesday'),
+        (2, 'Wednesday'),
+        (3, 'Thursday'),
+        (4, 'Friday'),
+        (5, 'Saturday'),
+        (6, 'Sunday'),
+    ]
+
+    day_of_week = models.IntegerField(choices=DAY_CHOICES)
+    start_time = models.TimeField()
+    end_time = models.TimeField()                    # may be before start_time to run past midnight
+    download_limit = models.PositiveIntegerField(default=0)  # KB/s, 0 = unlimited
+    upload_limit = models.PositiveIntegerField(default=0)    # KB/s, 0 = unlimited
+
+    class Meta:
+        ordering = ['day_of_week', 'start_time']
+
+    def __str__(self):
+        return f"{self.get_day_of_week_display()} {self.start_time:%H:%M}-{self.end_time:%H:%M}"
+
+    def is_active(self, now):
+        """Whether this window covers a local datetime"""
+        current = now.time()
+        if self.start_time <= self.end_time:
+            return now.weekday() == self.day_of_week and self.start_time <= current < self.end_time
+        # Window wraps midnight into the next day
+        if now.weekday() == self.day_of_week:
+            return current >= self.start_time
+        return now.weekday() == (self.day_of_week + 1) % 7 and current < self.end_time
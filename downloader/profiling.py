@@ -0,0 +1,191 @@
+# downloader/profiling.py - Opt-in per-request query count, DB, template and total latency profiling
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils import timezone
+
+# Latency histogram bucket upper bounds in milliseconds
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Profile of the request this thread or task is handling
+_current = ContextVar('profile', default=None)
+
+# URL name -> deque of its most recent request summaries
+_windows = {}
+_slow = deque()
+_stats_lock = threading.Lock()
+
+_template_timing_installed = False
+
+
+class RequestProfile:
+    """Counters of one request, fed by the DB execute wrapper and the template timer"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        # SQL text -> times run, the same statement over and over is the N+1 signature
+        self.statements = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] = self.statements.get(sql, 0) + 1
+
+    @property
+    def duplicate_queries(self):
+        """Runs of statements beyond their first, per request"""
+
+        return sum(count - 1 for count in self.statements.values())
+
+
+def install_template_timing():
+    """Time top-level template renders, includes and extends are part of their parent's time"""
+
+    global _template_timing_installed
+    if _template_timing_installed:
+        return
+    _template_timing_installed = True
+
+    from django.template.backends.django import Template
+
+    original = Template.render
+
+    def render(self, context=None, request=None):
+        profile = _current.get()
+        if profile is None:
+            return original(self, context, request)
+        started = time.perf_counter()
+        try:
+            return original(self, context, request)
+        finally:
+            profile.template_time += time.perf_counter() - started
+
+    Template.render = render
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def record(url_name, summary):
+    with _stats_lock:
+        window = _windows.get(url_name)
+        if window is None:
+            window = _windows[url_name] = deque(maxlen=settings.TORRENT_PROFILING_WINDOW)
+        window.append(summary)
+
+        if summary['total_ms'] >= settings.TORRENT_PROFILING_SLOW_MS:
+            _slow.append(summary)
+            while len(_slow) > settings.TORRENT_PROFILING_SLOW_KEEP:
+                _slow.popleft()
+
+
+def report():
+    """Latency histogram, percentiles and query counts per URL name plus the recent slow requests"""
+
+    with _stats_lock:
+        windows = {url_name: list(window) for url_name, window in _windows.items()}
+        slow = list(_slow)
+
+    views = {}
+    for url_name, samples in sorted(windows.items()):
+        latencies = [sample['total_ms'] for sample in samples]
+        queries = [sample['queries'] for sample in samples]
+        count = len(samples)
+
+        histogram = {}
+        for bound in LATENCY_BUCKETS:
+            histogram[f'le_{bound}'] = sum(1 for latency in latencies if latency <= bound)
+        histogram['inf'] = count
+
+        views[url_name] = {
+            'requests': count,
+            'latency_ms': {
+                'p50': percentile(latencies, 0.5),
+                'p95': percentile(latencies, 0.95),
+                'p99': percentile(latencies, 0.99),
+                'max': max(latencies),
+            },
+            'histogram_ms': histogram,
+            'queries': {'avg': round(sum(queries) / count, 1), 'max': max(queries)},
+            'duplicate_queries_max': max(sample['duplicate_queries'] for sample in samples),
+            'db_ms_avg': round(sum(sample['db_ms'] for sample in samples) / count, 2),
+            'template_ms_avg': round(sum(sample['template_ms'] for sample in samples) / count, 2),
+        }
+
+    return {
+        'window': settings.TORRENT_PROFILING_WINDOW,
+        'slow_threshold_ms': settings.TORRENT_PROFILING_SLOW_MS,
+        'views': views,
+        'slow_requests': sorted(slow, key=lambda sample: sample['total_ms'], reverse=True),
+    }
+
+
+def server_timing(profile, total):
+    """Server-Timing header value, browsers show it in the network panel's timing tab"""
+
+    db_ms = profile.db_time * 1000
+    template_ms = profile.template_time * 1000
+    app_ms = max(0.0, total * 1000 - db_ms - template_ms)
+    return ', '.join([
+        f'db;dur={db_ms:.1f};desc="{profile.queries} queries"',
+        f'tpl;dur={template_ms:.1f};desc="Templates"',
+        f'app;dur={app_ms:.1f};desc="Python"',
+        f'total;dur={total * 1000:.1f}',
+    ])
+
+
+class ProfilingMiddleware:
+    """Profiles every routed request when TORRENT_PROFILING is on, the report is at /profiling/"""
+
+    def __init__(self, get_response):
+        if not settings.TORRENT_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        install_template_timing()
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        total = time.perf_counter() - profile.started
+        response['Server-Timing'] = server_timing(profile, total)
+
+        # Static files and 404s for unknown paths have no URL name to group them by
+        match = request.resolver_match
+        if match is not None and match.url_name != 'profiling_report':
+            record(match.url_name or match.view_name, {
+                'url_name': match.url_name or match.view_name,
+                'path': request.path,
+                'method': request.method,
+                'status': response.status_code,
+                'total_ms': round(total * 1000, 2),
+                'db_ms': round(profile.db_time * 1000, 2),
+                'template_ms': round(profile.template_time * 1000, 2),
+                'queries': profile.queries,
+                'duplicate_queries': profile.duplicate_queries,
+                'at': timezone.now().isoformat(timespec='seconds'),
+            })
+        return response
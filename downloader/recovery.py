@@ -0,0 +1,104 @@
+# downloader/recovery.py - Re-queueing work a previous process left behind when it stopped
+import logging
+import threading
+from django.conf import settings
+from django.db import close_old_connections
+from .models import TorrentDownload, TorrentLiveStatus, VerifyJob
+from . import engine, executors, seeding, shards, verify
+
+logger = logging.getLogger(__name__)
+
+_recovered = False
+_recovery_lock = threading.Lock()
+
+
+def owned_orphans(queryset):
+    """Rows of a queryset this process is responsible for that have no thread here"""
+
+    # Celery workers outlive the web process, their rows are not orphaned by a restart
+    executor = executors.current()
+    if not executor.local:
+        return queryset.none()
+
+    orphans = queryset.exclude(id__in=executor.running())
+    if shards.current() is None:
+        return orphans
+    # Other shards' rows are theirs to recover
+    return queryset.filter(id__in=[torrent.id for torrent in orphans if shards.owns(torrent)])
+
+
+def requeue_orphans():
+    """Send rows left downloading by a dead process back to the queue, returns how many
+
+    Their resume data and metadata stay on disk, so the download threads pick
+    up where the old ones stopped instead of rechecking everything.
+    """
+
+    orphans = list(owned_orphans(TorrentDownload.objects.filter(status='downloading')).values_list('id', flat=True))
+    count = TorrentDownload.objects.filter(id__in=orphans, status='downloading').update(
+        status='pending',
+        status_message='Requeued after an engine restart',
+    )
+
+    TorrentLiveStatus.objects.filter(torrent_id__in=orphans).update(
+        download_speed=0,
+        upload_speed=0,
+        peers=0,
+        seeds=0,
+        eta_seconds=None,
+    )
+    # Verifier threads did not survive the restart either
+    if shards.is_primary():
+        VerifyJob.objects.filter(status='running').update(status='pending')
+
+    # Seeding handles did not survive either, the ones that still owe the swarm go straight back in
+    reseeded = seeding.adopt()
+    if reseeded:
+        logger.info("Resumed seeding %d torrents from a previous engine run", reseeded)
+
+    return count
+
+
+def recover_on_startup():
+    """Re-queue orphans once per process and dispatch them within the usual slot limits"""
+
+    global _recovered
+    with _recovery_lock:
+        if _recovered or not shards.runs_engine():
+            return
+        _recovered = True
+
+    try:
+        count = requeue_orphans()
+        if count:
+            logger.info("Requeued %d downloads from a previous engine run", count)
+
+        # Only as many as there are free slots start now, the queue releases the rest one by one
+        engine.dispatch_queue()
+        if shards.is_primary() and VerifyJob.objects.filter(status='pending').exists():
+            verify.start_verify_worker()
+    except Exception as e:
+        logger.exception("Startup recovery failed: %s", e)
+    finally:
+        close_old_connections()
+
+
+def recover_embedded_engine(**kwargs):
+    """Request hook: the web worker that runs the embedded engine recovers its orphans once
+
+    External engines recover in run_engine, and web workers that lost the
+    engine lock to another worker must not touch that worker's downloads.
+    """
+
+    if _recovered or settings.TORRENT_ENGINE_MODE != 'embedded' or not shards.runs_engine():
+        return
+    start_startup_recovery()
+
+
+def start_startup_recovery():
+    """Run the startup recovery in the background so the server starts serving right away"""
+
+    thread = threading.Thread(target=recover_on_startup)
+    thread.daemon = True
+    thread.start()
+    return thread
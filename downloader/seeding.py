@@ -0,0 +1,276 @@
+# downloader/seeding.py - Seeding completed torrents within ratio, time and concurrency rules
+import logging
+import os
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Value
+from django.db.models.functions import Greatest
+from .models import TorrentDownload, TorrentLiveStatus
+from . import bandwidth, history, metrics, session, shards, storage
+
+logger = logging.getLogger(__name__)
+
+# Handles of completed torrents kept in the session for seeding
+_seeds = {}
+_seeds_lock = threading.Lock()
+
+_worker = None
+_worker_lock = threading.Lock()
+
+# Set in download job processes, the engine process seeds what they download
+_hand_off = False
+
+# Serializes adoptions, the queue ticker and executor watchers may both find the same seed
+_adopt_lock = threading.Lock()
+
+
+def hand_off_seeding():
+    """Leave seeding to the engine process, this one exits once its download is over"""
+
+    global _hand_off
+    _hand_off = True
+
+
+def hands_off():
+    return _hand_off
+
+
+def should_seed(torrent):
+    """Whether a freshly completed torrent still owes the swarm anything"""
+
+    if not settings.TORRENT_SEEDING_ENABLED:
+        return False
+    return seed_limit_reached(torrent) is None
+
+
+def hand_off(torrent):
+    """Mark a completed torrent for the engine process to seed, its download job is about to end"""
+
+    TorrentDownload.objects.filter(id=torrent.id, status='completed').update(
+        is_seeding=True,
+        status_message='Waiting for the engine to seed',
+    )
+    # A message left from an earlier seed would hide the one above
+    TorrentLiveStatus.objects.filter(torrent_id=torrent.id).update(status_message='')
+    logger.info("Seeding handed to the engine: %s", torrent.name, extra={'torrent_id': str(torrent.id)})
+
+
+def adopt(torrent_ids=None):
+    """Seed rows marked seeding that have no handle in this process, returns how many it took over
+
+    These are torrents download jobs handed off and seeds a previous engine
+    run left behind. Rows that no longer owe the swarm anything are unmarked.
+    """
+
+    with _adopt_lock:
+        with _seeds_lock:
+            local = list(_seeds)
+        rows = TorrentDownload.objects.filter(is_seeding=True).exclude(id__in=local).select_related('live')
+        if torrent_ids is not None:
+            rows = rows.filter(id__in=torrent_ids)
+
+        adopted = 0
+        dropped = []
+        for torrent in rows:
+            # Other shards seed what they own
+            if not shards.owns(torrent):
+                continue
+            if torrent.status == 'completed' and should_seed(torrent):
+                try:
+                    if resume_seeding(torrent):
+                        adopted += 1
+                        continue
+                except Exception as e:
+                    logger.warning("Resuming seeding failed: %s", e, extra={'torrent_id': str(torrent.id)})
+            dropped.append(torrent.id)
+
+        if dropped:
+            TorrentDownload.objects.filter(id__in=dropped).update(is_seeding=False)
+            TorrentLiveStatus.objects.filter(torrent_id__in=dropped).update(upload_speed=0, peers=0, status_message='')
+        return adopted
+
+
+def seed_limit_reached(torrent):
+    """Reason seeding is done for a torrent, None while it should keep going"""
+
+    ratio = settings.TORRENT_SEED_RATIO
+    if ratio and torrent.seed_ratio >= ratio:
+        return f"ratio {torrent.seed_ratio:.2f} reached"
+
+    max_time = settings.TORRENT_SEED_MAX_TIME
+    if max_time and torrent.seed_time_total >= max_time:
+        return f"seeded for {torrent.seed_time_total / 3600:.1f}h"
+
+    return None
+
+
+def start_seeding(torrent, handle):
+    """Take over a completed torrent's handle from its download thread"""
+
+    import libtorrent as lt
+
+    # Seeds are paused and resumed by the policy below, not by libtorrent's queue
+    handle.unset_flags(lt.torrent_flags.auto_managed)
+
+    with _seeds_lock:
+        _seeds[str(torrent.id)] = handle
+    TorrentDownload.objects.filter(id=torrent.id).update(is_seeding=True, status_message='Seeding')
+    TorrentLiveStatus.objects.filter(torrent_id=torrent.id).update(status_message='')
+    logger.info("Seeding: %s", torrent.name, extra={'torrent_id': str(torrent.id)})
+
+    start_seeding_worker()
+
+
+def resume_seeding(torrent):
+    """Add a completed torrent back to the session from its saved metadata and seed it, returns whether it could"""
+
+    import libtorrent as lt
+
+    info = storage.load_metadata(str(torrent.id))
+    if info is None or not torrent.file_path or not os.path.exists(torrent.file_path):
+        return False
+
+    params = lt.add_torrent_params()
+    params.ti = info
+    params.save_path = storage.torrent_volume(torrent)
+    # The data was complete when it last seeded, pieces are hashed as peers ask for them instead of up front
+    params.flags |= lt.torrent_flags.seed_mode
+    handle = session.get_session().add_torrent(params)
+
+    start_seeding(torrent, handle)
+    return True
+
+
+def seeding_handle(torrent_id):
+    """The handle this process seeds a torrent with, None if it doesn't"""
+
+    with _seeds_lock:
+        return _seeds.get(torrent_id)
+
+
+def stop_seeding(torrent_id, reason=None):
+    """Remove a torrent's seeding handle, returns whether it was seeding"""
+
+    with _seeds_lock:
+        handle = _seeds.pop(torrent_id, None)
+    if handle is None:
+        return False
+
+    try:
+        session.get_session().remove_torrent(handle)
+    except Exception as e:
+        logger.warning("Error removing seeding torrent: %s", e, extra={'torrent_id': torrent_id})
+
+    history.close(torrent_id)
+
+    # The one write to the torrent row a seed makes, it catches up with the live row's totals
+    update = {'is_seeding': False}
+    live = TorrentLiveStatus.objects.filter(torrent_id=torrent_id).values('uploaded', 'seed_time').first()
+    if live:
+        update['uploaded'] = Greatest('uploaded', Value(live['uploaded']))
+        update['seed_time'] = Greatest('seed_time', Value(live['seed_time']))
+    if reason:
+        update['status_message'] = f"Seeding finished: {reason}"
+    TorrentDownload.objects.filter(id=torrent_id).update(**update)
+    TorrentLiveStatus.objects.filter(torrent_id=torrent_id).update(upload_speed=0, peers=0, status_message='')
+    return True
+
+
+def start_seeding_worker():
+    """Start the seeding policy thread unless it is already running"""
+
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=run_seeding_worker)
+            _worker.daemon = True
+            _worker.start()
+
+
+def run_seeding_worker():
+    """Apply the seeding rules on an interval"""
+
+    last_tick = time.monotonic()
+    while True:
+        time.sleep(settings.TORRENT_SEED_INTERVAL)
+        now = time.monotonic()
+        try:
+            apply_seeding_policy(int(now - last_tick))
+        except Exception as e:
+            logger.warning("Applying seeding policy failed: %s", e)
+        finally:
+            close_old_connections()
+        last_tick = now
+
+
+def apply_seeding_policy(elapsed):
+    """Record upload progress, retire finished seeds and decide which ones may run now"""
+
+    import libtorrent as lt
+
+    with _seeds_lock:
+        seeds = dict(_seeds)
+
+    torrents = {str(t.id): t for t in TorrentDownload.objects.filter(id__in=list(seeds)).select_related('live')}
+    active = []
+
+    for torrent_id, handle in seeds.items():
+        torrent = torrents.get(torrent_id)
+        # Deleted, or sent back to the queue for a repair
+        if torrent is None or torrent.status != 'completed':
+            stop_seeding(torrent_id)
+            continue
+
+        try:
+            flush_started = time.perf_counter()
+            status = handle.status()
+        except Exception as e:
+            logger.warning("Error getting seeding status: %s", e, extra={'torrent_id': torrent_id})
+            continue
+
+        running = not status.flags & lt.torrent_flags.paused
+        live = torrent.live_status
+        # Totals build on the torrent row's in case the live row was reset since the last stop
+        live.uploaded = max(torrent.uploaded_total, status.all_time_upload)
+        live.seed_time = torrent.seed_time_total + (elapsed if running else 0)
+        live.upload_speed = status.upload_rate / 1024 if running else 0
+        live.peers = status.num_peers
+
+        reason = seed_limit_reached(torrent)
+        if reason:
+            logger.info("Seeding finished (%s): %s", reason, torrent.name, extra={'torrent_id': str(torrent.id)})
+            live.save()
+            stop_seeding(torrent_id, reason)
+            continue
+
+        # Only the narrow live row is written per tick, the torrent row waits for the seed to stop
+        live.status_message = f"Seeding, ratio {torrent.seed_ratio:.2f}" if running else "Seeding queued"
+        with metrics.DB_WRITE_SECONDS.time(table='live_status'):
+            live.save()
+        history.record(torrent_id, 0.0, live.upload_speed, live.peers, 1.0)
+        metrics.PROGRESS_FLUSH_SECONDS.observe(time.perf_counter() - flush_started, source='seeding')
+        active.append((torrent, handle))
+
+    downloading = TorrentDownload.objects.filter(status='downloading').exists()
+
+    # Least seeded torrents get the slots, they are the ones the swarm needs most
+    active.sort(key=lambda item: item[0].seed_ratio)
+    idle_only = downloading and settings.TORRENT_SEED_ONLY_WHILE_IDLE
+
+    for index, (torrent, handle) in enumerate(active):
+        if idle_only or index >= settings.TORRENT_MAX_ACTIVE_SEEDS:
+            handle.pause()
+            continue
+
+        handle.resume()
+        upload_limit = bandwidth.torrent_limits(torrent)[1]
+        max_connections = -1
+        # Seeds keep a trickle going while downloads run so they never compete for the link
+        if downloading:
+            upload_limit = bandwidth.combine_limits(upload_limit, settings.TORRENT_SEED_UPLOAD_LIMIT_WHILE_DOWNLOADING)
+            max_connections = settings.TORRENT_SEED_MAX_CONNECTIONS_WHILE_DOWNLOADING
+        handle.set_upload_limit(upload_limit * 1024)
+        handle.set_max_connections(max_connections)
+
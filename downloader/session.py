@@ -0,0 +1,241 @@
+# downloader/session.py - Shared libtorrent session, performance profiles and persisted state
+import atexit
+import logging
+import os
+import threading
+import time
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from . import shards
+
+logger = logging.getLogger(__name__)
+
+# Settings whose values are given by enum name in the profiles
+ENUM_SETTINGS = {
+    'choking_algorithm': 'choking_algorithm_t',
+    'seed_choking_algorithm': 'seed_choking_algorithm_t',
+}
+
+_session = None
+_session_lock = threading.Lock()
+_active_profile = None
+
+# Threads waiting for an alert, fed by the single alert router thread
+_waiters = []
+_waiters_lock = threading.Lock()
+
+
+def get_session():
+    """Process-wide libtorrent session, created on first use with the configured profile"""
+
+    global _session, _active_profile
+    with _session_lock:
+        if _session is None:
+            import libtorrent as lt
+
+            profile = settings.TORRENT_SESSION_PROFILE
+            _session = lt.session(load_session_params(build_settings_pack(profile)))
+            _active_profile = profile
+            logger.info("libtorrent %s session started with '%s' profile", getattr(lt, '__version__', 'unknown'), profile)
+
+            if shards.saves_state():
+                start_state_saver()
+            start_alert_router()
+        return _session
+
+
+def running_session():
+    """The session if this process already started one, never starts it"""
+
+    return _session
+
+
+class AlertWaiter:
+    """One expected alert, register it before triggering the action that posts it"""
+
+    def __init__(self, match, extract):
+        self.match = match
+        self.extract = extract
+        self.event = threading.Event()
+        self.result = None
+
+    def wait(self, timeout):
+        """The extracted value, None on timeout"""
+
+        self.event.wait(timeout)
+        with _waiters_lock:
+            if self in _waiters:
+                _waiters.remove(self)
+        return self.result
+
+
+def expect_alert(match, extract):
+    """Register interest in an alert matching a predicate
+
+    Alerts are only valid until the next pop_alerts call, so extract runs on
+    the router thread and must copy out everything the caller needs.
+    """
+
+    waiter = AlertWaiter(match, extract)
+    with _waiters_lock:
+        _waiters.append(waiter)
+    return waiter
+
+
+def start_alert_router():
+    """Pop alerts from the shared session and hand them to waiting threads"""
+
+    def run():
+        while True:
+            try:
+                if not _session.wait_for_alert(1000):
+                    continue
+                for alert in _session.pop_alerts():
+                    with _waiters_lock:
+                        matched = [waiter for waiter in _waiters if waiter.match(alert)]
+                        for waiter in matched:
+                            _waiters.remove(waiter)
+                    for waiter in matched:
+                        waiter.result = waiter.extract(alert)
+                        waiter.event.set()
+            except Exception as e:
+                logger.warning("Alert router error: %s", e)
+                time.sleep(1)
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+
+
+def state_path():
+    """Where the session state survives restarts and deploys"""
+
+    return os.path.join(settings.TORRENT_STATE_DIR, f"session{shards.state_suffix()}.state")
+
+
+def load_session_params(pack):
+    """Session params from the last saved state so DHT lookups start from known nodes"""
+
+    import libtorrent as lt
+
+    params = lt.session_params()
+    try:
+        with open(state_path(), 'rb') as f:
+            params = lt.read_session_params(f.read())
+        logger.info("Restored saved session state")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning("Ignoring unreadable session state: %s", e)
+        params = lt.session_params()
+
+    # The configured profile always wins over settings saved by an older deploy
+    params.settings = {**params.settings, **pack}
+    return params
+
+
+def save_session_state():
+    """Write DHT node table, node id and settings atomically"""
+
+    import libtorrent as lt
+
+    if _session is None:
+        return
+
+    path = state_path()
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(lt.write_session_params_buf(_session.session_state()))
+        os.replace(temp_path, path)
+    except Exception as e:
+        logger.warning("Saving session state failed: %s", e)
+
+
+def start_state_saver():
+    """Save session state periodically and once more when the process exits"""
+
+    def run():
+        while True:
+            time.sleep(settings.TORRENT_SESSION_STATE_INTERVAL)
+            save_session_state()
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    atexit.register(save_session_state)
+
+
+def build_settings_pack(profile):
+    """Base session settings overlaid with a named performance profile"""
+
+    import libtorrent as lt
+
+    if profile not in settings.TORRENT_SESSION_PROFILES:
+        raise ImproperlyConfigured(f"Unknown TORRENT_SESSION_PROFILE '{profile}'")
+
+    pack = {
+        'user_agent': f'libtorrent/{getattr(lt, "__version__", "2.0.9")}',
+        'listen_interfaces': shards.listen_interfaces(settings.TORRENT_LISTEN_INTERFACES),
+        'dht_bootstrap_nodes': settings.TORRENT_DHT_BOOTSTRAP_NODES,
+        'enable_upnp': True,
+        'enable_natpmp': True,
+        'enable_dht': True,
+        'enable_lsd': True,
+        'enable_outgoing_utp': True,
+        'enable_incoming_utp': True,
+        'alert_mask': int(
+            lt.alert.category_t.error_notification
+            | lt.alert.category_t.status_notification
+            | lt.alert.category_t.storage_notification
+            | lt.alert.category_t.dht_operation_notification
+        ),
+    }
+
+    for name, value in settings.TORRENT_SESSION_PROFILES[profile].items():
+        if name in ENUM_SETTINGS and isinstance(value, str):
+            value = int(getattr(getattr(lt, ENUM_SETTINGS[name]), value))
+        pack[name] = value
+
+    return pack
+
+
+def apply_profile(profile):
+    """Switch the running session to another profile without restarting downloads"""
+
+    import libtorrent as lt
+
+    global _active_profile
+    pack = build_settings_pack(profile)
+
+    # Settings only the previous profile touched go back to libtorrent's defaults instead of lingering
+    defaults = lt.default_settings()
+    profiled = {name for values in settings.TORRENT_SESSION_PROFILES.values() for name in values}
+    reset = {name: defaults[name] for name in profiled if name in defaults}
+
+    get_session().apply_settings({**reset, **pack})
+    _active_profile = profile
+    logger.info("Switched the session to the '%s' profile", profile)
+
+
+def active_settings():
+    """Profile name and the values the session actually runs with, for inspection"""
+
+    # The web tier of an external engine has no session, report what the shards are configured with
+    if not shards.runs_engine():
+        profile = settings.TORRENT_SESSION_PROFILE
+        return {
+            'profile': profile,
+            'profiles': sorted(settings.TORRENT_SESSION_PROFILES),
+            'settings': dict(sorted(build_settings_pack(profile).items())),
+            'engine': 'external',
+        }
+
+    current = get_session().get_settings()
+    names = sorted(set(build_settings_pack(_active_profile)))
+
+    return {
+        'profile': _active_profile,
+        'profiles': sorted(settings.TORRENT_SESSION_PROFILES),
+        'settings': {name: current.get(name) for name in names},
+    }
@@ -0,0 +1,150 @@
+# downloader/shards.py - Which engine shard this process is and which torrents it owns
+import fcntl
+import math
+import os
+import threading
+from django.conf import settings
+
+# (index, count) once this process runs as an engine shard under run_engine
+_shard = None
+
+# Set in processes that run single download jobs for the process or Celery executors
+_job = False
+
+# Torrent id -> shard index, the info hash of a row never changes
+_assignments = {}
+
+# Lock file kept open by the one web worker that runs the embedded engine
+_engine_lock = None
+_engine_lock_guard = threading.Lock()
+
+
+def configure(index, count):
+    """Turn this process into engine shard index of count"""
+
+    global _shard
+    _shard = (index, count)
+
+
+def configure_job():
+    """Turn this process into a download job worker next to the dispatching engine"""
+
+    global _job
+    _job = True
+
+
+def current():
+    """(index, count) of this engine shard, None outside run_engine"""
+
+    return _shard
+
+
+def runs_engine():
+    """Whether downloads run in this process, in external mode the web tier only enqueues"""
+
+    if _shard is not None or _job:
+        return True
+    return settings.TORRENT_ENGINE_MODE == 'embedded' and holds_engine_lock()
+
+
+def holds_engine_lock():
+    """Whether this process is the embedded engine, web servers with several workers elect one by file lock
+
+    The lock goes away with the process, so when the engine's worker dies the
+    next worker to ask takes over and recovers what the old one left running.
+    """
+
+    global _engine_lock
+    with _engine_lock_guard:
+        if _engine_lock is None:
+            lock_file = open(os.path.join(settings.TORRENT_STATE_DIR, 'engine.lock'), 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            _engine_lock = lock_file
+        return True
+
+
+def is_primary():
+    """The process that also runs single-instance background work like verification"""
+
+    return not _job and (_shard is None or _shard[0] == 0)
+
+
+def shard_of(torrent, count):
+    """Shard a torrent belongs to, taken from its info hash so it is stable across restarts"""
+
+    torrent_id = str(torrent.id)
+    if torrent_id not in _assignments:
+        import libtorrent as lt
+
+        try:
+            info_hash = str(lt.parse_magnet_uri(torrent.magnet_link).info_hashes.get_best())
+            _assignments[torrent_id] = int(info_hash, 16) % count
+        except Exception:
+            _assignments[torrent_id] = int(torrent.id.hex, 16) % count
+    return _assignments[torrent_id]
+
+
+def owns(torrent):
+    """Whether this process is responsible for downloading a torrent"""
+
+    if _shard is None:
+        return runs_engine()
+    index, count = _shard
+    return shard_of(torrent, count) == index
+
+
+def download_slots():
+    """This process's share of TORRENT_MAX_ACTIVE_DOWNLOADS"""
+
+    if _shard is None:
+        return settings.TORRENT_MAX_ACTIVE_DOWNLOADS
+    return max(1, math.ceil(settings.TORRENT_MAX_ACTIVE_DOWNLOADS / _shard[1]))
+
+
+def rate_share(limit):
+    """This process's share of a global rate limit in KB/s, 0 = unlimited"""
+
+    if not limit:
+        return limit
+    if _job:
+        # Every job process runs one download, the link is split over all download slots
+        return max(1, limit // max(1, settings.TORRENT_MAX_ACTIVE_DOWNLOADS))
+    if _shard is None:
+        return limit
+    return max(1, limit // _shard[1])
+
+
+def listen_interfaces(interfaces):
+    """Offset every listen port by the shard index so shards don't fight over one port"""
+
+    if _job:
+        # Job processes come and go, any free port will do
+        return ','.join(f"{interface.rpartition(':')[0]}:0" for interface in interfaces.split(','))
+    if _shard is None or not _shard[0]:
+        return interfaces
+
+    shifted = []
+    for interface in interfaces.split(','):
+        host, _, port = interface.rpartition(':')
+        if port.isdigit() and int(port):
+            interface = f"{host}:{int(port) + _shard[0]}"
+        shifted.append(interface)
+    return ','.join(shifted)
+
+
+def saves_state():
+    """Whether this process owns its session state file, short-lived job processes only read it"""
+
+    return not _job
+
+
+def state_suffix():
+    """Suffix keeping each shard's session state file apart"""
+
+    if _shard is None or not _shard[0]:
+        return ''
+    return f"-{_shard[0]}"
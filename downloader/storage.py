@@ -0,0 +1,246 @@
+# downloader/storage.py - Download volumes, disk space admission control, preallocation and engine state files
+import itertools
+import os
+import shutil
+from django.conf import settings
+from django.db.models import BigIntegerField, F, Q, Sum
+from django.db.models.functions import Coalesce
+from .models import TorrentDownload
+
+
+# Rotates through the volumes for the round-robin placement policy
+_round_robin = itertools.count()
+
+
+def download_volumes():
+    """Configured storage volumes, the default download directory when none are set"""
+
+    volumes = settings.TORRENT_DOWNLOAD_VOLUMES or [settings.TORRENT_DOWNLOAD_DIR]
+    # Skip volumes that are not mounted instead of failing placement for everything
+    return [os.path.normpath(str(volume)) for volume in volumes if os.path.isdir(volume)]
+
+
+def default_volume():
+    """Volume used by rows created before placement was recorded"""
+
+    return os.path.normpath(str(settings.TORRENT_DOWNLOAD_DIR))
+
+
+def torrent_volume(torrent):
+    """Volume a torrent was placed on, rows from before placement use the default directory"""
+
+    return torrent.save_path or default_volume()
+
+
+def on_volume(volume):
+    """Filter for torrents stored on a volume"""
+
+    query = Q(save_path=volume)
+    if volume == default_volume():
+        query |= Q(save_path='')
+    return query
+
+
+def free_space(path):
+    """Bytes available on the volume holding path"""
+
+    return shutil.disk_usage(path).free
+
+
+def committed_space(volume, exclude_id=None):
+    """Bytes still to be written to a volume by torrents that are already downloading"""
+
+    running = TorrentDownload.objects.filter(on_volume(volume), status='downloading', size__gt=0)
+    if exclude_id is not None:
+        running = running.exclude(id=exclude_id)
+
+    remaining = running.aggregate(remaining=Sum(F('size') - Coalesce('live__downloaded', 0, output_field=BigIntegerField())))['remaining']
+    return max(0, remaining or 0)
+
+
+def available_space(volume, exclude_id=None):
+    """Free space on a volume minus the reserve and what running torrents still need"""
+
+    return (
+        free_space(volume)
+        - settings.TORRENT_DISK_RESERVE_BYTES
+        - committed_space(volume, exclude_id=exclude_id)
+    )
+
+
+def volume_activity(volume):
+    """Current write rate to a volume in KB/s, used for least-active placement"""
+
+    running = TorrentDownload.objects.filter(on_volume(volume), status='downloading')
+    return running.aggregate(rate=Sum('live__download_speed'))['rate'] or 0
+
+
+def check_admission(torrent, volume=None):
+    """Decide whether a torrent may start on a volume, returning (admitted, reason)"""
+
+    volume = volume or torrent_volume(torrent)
+    available = available_space(volume, exclude_id=torrent.id)
+    # Magnets without metadata have size 0, they only need some headroom left
+    needed = max(0, torrent.size - torrent.live_status.downloaded)
+
+    if available <= 0 or available < needed:
+        return False, (
+            f"Waiting for disk space: needs {TorrentDownload.format_bytes(needed)}, "
+            f"{TorrentDownload.format_bytes(max(0, available))} available"
+        )
+    return True, ''
+
+
+def place_torrent(torrent):
+    """Pick a volume for a torrent using the placement policy, returning (volume, reason)"""
+
+    # Data already on disk pins a torrent to its volume
+    if torrent.save_path:
+        admitted, reason = check_admission(torrent)
+        return (torrent.save_path if admitted else None), reason
+
+    volumes = download_volumes()
+    if not volumes:
+        return None, "Waiting for a download volume to be mounted"
+    policy = settings.TORRENT_VOLUME_PLACEMENT
+
+    if policy == 'round_robin':
+        start = next(_round_robin) % len(volumes)
+        candidates = volumes[start:] + volumes[:start]
+    elif policy == 'least_active':
+        candidates = sorted(volumes, key=lambda volume: (volume_activity(volume), -free_space(volume)))
+    else:
+        candidates = sorted(volumes, key=lambda volume: -available_space(volume))
+
+    reason = ''
+    for volume in candidates:
+        admitted, reason = check_admission(torrent, volume)
+        if admitted:
+            return volume, ''
+    return None, reason
+
+
+def cold_volume():
+    """Volume completed torrents are moved to, None when disabled"""
+
+    if not settings.TORRENT_COLD_VOLUME:
+        return None
+    return os.path.normpath(str(settings.TORRENT_COLD_VOLUME))
+
+
+def check_move(torrent, source, destination):
+    """Decide whether a torrent's data fits on the destination volume, returning (fits, reason)"""
+
+    try:
+        # Within one filesystem libtorrent only renames, nothing new is written
+        if os.stat(source).st_dev == os.stat(destination).st_dev:
+            return True, ''
+        available = free_space(destination) - settings.TORRENT_DISK_RESERVE_BYTES
+    except OSError as e:
+        return False, str(e)
+
+    if available < torrent.size:
+        return False, (
+            f"needs {TorrentDownload.format_bytes(torrent.size)}, "
+            f"{TorrentDownload.format_bytes(max(0, available))} available"
+        )
+    return True, ''
+
+
+def should_preallocate(size):
+    """Full allocation is only worth it for large torrents"""
+
+    return settings.TORRENT_PREALLOCATE and size >= settings.TORRENT_PREALLOCATE_MIN_SIZE
+
+
+def preallocate_files(info, save_path):
+    """Reserve the blocks of every file in a torrent without touching existing data"""
+
+    if not hasattr(os, 'posix_fallocate'):
+        return
+
+    files = info.files()
+    for index in range(files.num_files()):
+        size = files.file_size(index)
+        if size <= 0 or files.file_flags(index) & files.flag_pad_file:
+            continue
+
+        path = os.path.join(save_path, files.file_path(index))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            os.posix_fallocate(fd, 0, size)
+        finally:
+            os.close(fd)
+
+
+def metadata_path(torrent_id):
+    """Where a torrent's .torrent metadata is kept once it has been fetched"""
+
+    return os.path.join(settings.TORRENT_STATE_DIR, f"{torrent_id}.torrent")
+
+
+def save_metadata(torrent_id, info):
+    """Keep the metadata so later runs and verification don't need the swarm"""
+
+    import libtorrent as lt
+
+    path = metadata_path(torrent_id)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(lt.bencode(lt.create_torrent(info).generate()))
+    os.replace(temp_path, path)
+
+
+def load_metadata(torrent_id):
+    """Saved torrent_info for a torrent, None if metadata was never fetched"""
+
+    import libtorrent as lt
+
+    path = metadata_path(torrent_id)
+    if not os.path.exists(path):
+        return None
+    return lt.torrent_info(path)
+
+
+def resume_data_path(torrent_id):
+    """Where fast-resume data of a paused or preempted torrent is kept"""
+
+    return os.path.join(settings.TORRENT_STATE_DIR, f"{torrent_id}.fastresume")
+
+
+def save_resume_data(torrent_id, data):
+    """Write resume data from lt.write_resume_data_buf atomically"""
+
+    path = resume_data_path(torrent_id)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def load_resume_data(torrent_id):
+    """Raw resume data for lt.read_resume_data, None if the torrent was never paused"""
+
+    try:
+        with open(resume_data_path(torrent_id), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def remove_resume_data(torrent_id):
+    """Drop resume data once it no longer describes what is on disk"""
+
+    path = resume_data_path(torrent_id)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def remove_state_files(torrent_id):
+    """Forget everything the engine kept on disk for a deleted torrent"""
+
+    for path in [metadata_path(torrent_id), resume_data_path(torrent_id)]:
+        if os.path.exists(path):
+            os.remove(path)
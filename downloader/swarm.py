@@ -0,0 +1,219 @@
+# downloader/swarm.py - Pre-flight tracker and DHT scrapes of queued torrents
+import itertools
+import logging
+import random
+import socket
+import struct
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.utils import timezone
+from .models import TorrentDownload
+from . import session, shards, storage
+
+logger = logging.getLogger(__name__)
+
+# BEP 15 magic connection id and actions
+UDP_PROTOCOL_ID = 0x41727101980
+UDP_ACTION_CONNECT = 0
+UDP_ACTION_SCRAPE = 2
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def health_rank():
+    """Queue ordering expression, swarms known to have peers start before unknown ones"""
+
+    return Case(
+        When(Q(swarm_seeders__gt=0) | Q(swarm_dht_peers__gt=0), then=Value(1)),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def start_scrape_worker():
+    """Start the pre-flight scraper thread unless it is already running"""
+
+    global _worker
+    if not settings.TORRENT_SCRAPE_ENABLED:
+        return
+
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=run_scrape_worker)
+            _worker.daemon = True
+            _worker.start()
+
+
+def run_scrape_worker():
+    """Periodically scrape queued torrents whose swarm data is missing or stale"""
+
+    while True:
+        try:
+            stale = timezone.now() - timedelta(seconds=settings.TORRENT_SCRAPE_INTERVAL)
+            candidates = (
+                TorrentDownload.objects.filter(status='pending')
+                .filter(Q(swarm_checked_at__isnull=True) | Q(swarm_checked_at__lt=stale))
+                .order_by('-priority', 'queue_position')
+            )
+            # Each shard scrapes only the torrents it would download, never the same swarm twice
+            with closing(candidates.iterator()) as rows:
+                owned = (torrent for torrent in rows if shards.owns(torrent))
+                torrents = list(itertools.islice(owned, settings.TORRENT_SCRAPE_BATCH_SIZE))
+            if torrents:
+                with ThreadPoolExecutor(max_workers=settings.TORRENT_SCRAPE_WORKERS) as pool:
+                    list(pool.map(scrape_torrent, torrents))
+        except Exception as e:
+            logger.warning("Swarm scrape failed: %s", e)
+        finally:
+            close_old_connections()
+        time.sleep(settings.TORRENT_QUEUE_INTERVAL)
+
+
+def scrape_torrent(torrent):
+    """Scrape one queued torrent's trackers and the DHT"""
+
+    import libtorrent as lt
+
+    try:
+        params = lt.parse_magnet_uri(torrent.magnet_link)
+        info_hash = params.info_hashes.v1
+        trackers = list(params.trackers)
+
+        info = storage.load_metadata(str(torrent.id))
+        if info is not None:
+            trackers += [tracker.url for tracker in info.trackers()]
+
+        seeders = leechers = completed = None
+        if not info_hash.is_all_zeros():
+            for url in dict.fromkeys(trackers + list(settings.TORRENT_EXTRA_TRACKERS)):
+                counts = scrape_tracker(url, info_hash.to_bytes(), settings.TORRENT_SCRAPE_TIMEOUT)
+                if counts is None:
+                    continue
+                # Trackers see overlapping subsets of the swarm, the largest count is the safest estimate
+                seeders = max(seeders or 0, counts[0])
+                leechers = max(leechers or 0, counts[1])
+                completed = max(completed or 0, counts[2])
+
+        dht_peers = dht_peer_count(params.info_hashes.get_best())
+        record_swarm_health(torrent, seeders, leechers, completed, dht_peers)
+    except Exception as e:
+        logger.warning("Scraping %s failed: %s", torrent.name, e, extra={'torrent_id': str(torrent.id)})
+    finally:
+        close_old_connections()
+
+
+def record_swarm_health(torrent, seeders, leechers, completed, dht_peers):
+    """Store scrape counts and defer the torrent when its swarm looks dead"""
+
+    now = timezone.now()
+    update = {
+        'swarm_seeders': seeders,
+        'swarm_leechers': leechers,
+        'swarm_completed': completed,
+        'swarm_dht_peers': dht_peers,
+        'swarm_checked_at': now,
+    }
+
+    # Only a swarm that answered with nobody in it is dead, unreachable trackers prove nothing
+    answered = seeders is not None or dht_peers is not None
+    if answered and not seeders and not dht_peers:
+        next_check = now + timedelta(seconds=settings.TORRENT_SCRAPE_INTERVAL)
+        update['swarm_recheck_at'] = next_check
+        update['status_message'] = f"No seeders found, checking again at {timezone.localtime(next_check):%H:%M}"
+        logger.info("Deferring dead swarm: %s", torrent.name, extra={'torrent_id': str(torrent.id)})
+    else:
+        update['swarm_recheck_at'] = None
+        if torrent.status_message.startswith('No seeders found'):
+            update['status_message'] = ''
+
+    TorrentDownload.objects.filter(id=torrent.id, status='pending').update(**update)
+
+
+def dht_peer_count(info_hash):
+    """Peers the DHT returns for an info hash, None while this process has no DHT nodes to ask
+
+    Only a session the engine already runs is asked. A process that only
+    dispatches to Celery workers would otherwise start a full one to count peers.
+    """
+
+    import libtorrent as lt
+
+    ses = session.running_session()
+    if ses is None or not ses.status().dht_nodes:
+        return None
+
+    waiter = session.expect_alert(
+        lambda alert: isinstance(alert, lt.dht_get_peers_reply_alert) and alert.info_hash == info_hash,
+        lambda alert: alert.num_peers(),
+    )
+    ses.dht_get_peers(info_hash)
+    return waiter.wait(settings.TORRENT_SCRAPE_TIMEOUT)
+
+
+def scrape_tracker(url, info_hash, timeout):
+    """(seeders, leechers, completed) from one tracker, None when it can't be scraped"""
+
+    try:
+        if url.startswith('udp://'):
+            return scrape_udp(url, info_hash, timeout)
+        if url.startswith(('http://', 'https://')):
+            return scrape_http(url, info_hash, timeout)
+    except (OSError, ValueError, KeyError, struct.error):
+        pass
+    return None
+
+
+def scrape_http(url, info_hash, timeout):
+    """HTTP scrape following the announce to scrape URL convention"""
+
+    import libtorrent as lt
+
+    parts = urllib.parse.urlsplit(url)
+    head, _, last = parts.path.rpartition('/')
+    if not last.startswith('announce'):
+        return None
+
+    path = f"{head}/scrape{last[len('announce'):]}"
+    query = '&'.join(filter(None, [parts.query, f"info_hash={urllib.parse.quote(info_hash)}"]))
+    scrape_url = urllib.parse.urlunsplit((parts.scheme, parts.netloc, path, query, ''))
+
+    with urllib.request.urlopen(scrape_url, timeout=timeout) as response:
+        reply = lt.bdecode(response.read())
+
+    stats = reply[b'files'][info_hash]
+    return stats[b'complete'], stats[b'incomplete'], stats[b'downloaded']
+
+
+def scrape_udp(url, info_hash, timeout):
+    """UDP tracker scrape (BEP 15): connect, then scrape a single info hash"""
+
+    parts = urllib.parse.urlsplit(url)
+    address = (parts.hostname, parts.port or 80)
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+
+        transaction_id = random.getrandbits(32)
+        sock.sendto(struct.pack('>QII', UDP_PROTOCOL_ID, UDP_ACTION_CONNECT, transaction_id), address)
+        action, reply_id, connection_id = struct.unpack('>IIQ', sock.recv(16))
+        if action != UDP_ACTION_CONNECT or reply_id != transaction_id:
+            return None
+
+        transaction_id = random.getrandbits(32)
+        sock.sendto(struct.pack('>QII', connection_id, UDP_ACTION_SCRAPE, transaction_id) + info_hash, address)
+        reply = sock.recv(20)
+        action, reply_id = struct.unpack('>II', reply[:8])
+        if action != UDP_ACTION_SCRAPE or reply_id != transaction_id:
+            return None
+
+        seeders, completed, leechers = struct.unpack('>III', reply[8:20])
+        return seeders, leechers, completed
@@ -1,3 +1,1205 @@
-from django.test import TestCase
+# downloader/tests.py - Behavior tests for the engine, its background jobs and the web tier
+import base64
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+from io import StringIO
+from unittest import mock
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from .forms import TorrentForm, TorrentWebSeedsForm
+from .models import BandwidthSchedule, BandwidthSettings, ContentFile, DeletionJob, ThroughputRollup, TorrentDownload, TorrentLiveStatus, VerifyJob
+from . import bandwidth, cleanup, dedup, diagnostics, engine, events, executors, health, history, metrics, recovery, seeding, session, shards, storage, swarm, verify
 
-# Create your tests here.
+
+def create_torrent(**fields):
+    fields.setdefault('name', 'torrent')
+    fields.setdefault('magnet_link', f'magnet:?xt=urn:btih:{uuid.uuid4().hex[:32]}{"0" * 8}')
+    return TorrentDownload.objects.create(**fields)
+
+
+class RecordingExecutor:
+    """Executor that only records what it was asked to start, jobs in held keep their slots"""
+
+    local = True
+
+    def __init__(self, held=()):
+        self.held = [str(torrent_id) for torrent_id in held]
+        self.started = []
+
+    def submit(self, torrent_id, on_exit):
+        self.started.append(torrent_id)
+        return True
+
+    def running(self):
+        return self.held + self.started
+
+    def is_running(self, torrent_id):
+        return torrent_id in self.running()
+
+    def reclaim(self):
+        return 0
+
+
+@override_settings(TORRENT_ENGINE_RELEASE_GRACE=0, TORRENT_DELETE_MAX_FILES_PER_SECOND=0)
+class DeletionJobTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('downloader.cleanup.dispatch_queue')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def run_job(self, torrents):
+        previous_statuses = {str(torrent.id): torrent.status for torrent in torrents}
+        TorrentDownload.objects.filter(id__in=list(previous_statuses)).update(status='deleting')
+        job = DeletionJob.objects.create(total=len(torrents))
+        cleanup.run_deletion_job(str(job.id), previous_statuses)
+        job.refresh_from_db()
+        return job
+
+    def test_deletes_rows_and_files(self):
+        path = os.path.join(self.directory, 'data.bin')
+        with open(path, 'wb') as f:
+            f.write(b'x' * 100)
+        torrent = create_torrent(status='completed', file_path=path)
+
+        job = self.run_job([torrent])
+
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual(job.bytes_freed, 100)
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(TorrentDownload.objects.filter(id=torrent.id).exists())
+
+    def test_failed_torrent_is_reported_and_gets_its_status_back(self):
+        broken = create_torrent(name='broken', status='downloading', file_path=os.path.join(self.directory, 'broken'))
+        fine = create_torrent(status='completed')
+
+        with mock.patch('downloader.cleanup.delete_torrent_files', side_effect=PermissionError('read-only volume')):
+            job = self.run_job([broken, fine])
+
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('broken: read-only volume', job.error)
+        self.assertEqual(job.processed, 2)
+        self.assertIsNotNone(job.finished_at)
+
+        # The download job dropped its handle when the row went to deleting, the queue restarts it
+        broken.refresh_from_db()
+        self.assertEqual(broken.status, 'pending')
+        self.assertFalse(TorrentDownload.objects.filter(id=fine.id).exists())
+
+    @override_settings(TORRENT_DELETE_BATCH_SIZE=1)
+    def test_job_failure_restores_the_rows_it_never_reached(self):
+        deleted = create_torrent(status='completed')
+        untouched = create_torrent(status='paused')
+
+        # The progress save after the first batch fails, the final save still records the outcome
+        original_save = DeletionJob.save
+
+        def save(job, *args, **kwargs):
+            if 'processed' in (kwargs.get('update_fields') or ()):
+                raise RuntimeError('database gone')
+            return original_save(job, *args, **kwargs)
+
+        with mock.patch.object(DeletionJob, 'save', save):
+            job = self.run_job([deleted, untouched])
+
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('database gone', job.error)
+        self.assertFalse(TorrentDownload.objects.filter(id=deleted.id).exists())
+        untouched.refresh_from_db()
+        self.assertEqual(untouched.status, 'paused')
+
+
+@override_settings(TORRENT_ENGINE_MODE='external')
+class CleanupViewTests(TestCase):
+    def test_cleanup_failed_runs_a_deletion_job_and_shows_its_progress(self):
+        failed = create_torrent(status='failed')
+        completed = create_torrent(status='completed')
+
+        with mock.patch('downloader.cleanup.threading.Thread') as thread:
+            response = self.client.post(reverse('cleanup_failed'))
+
+        job = DeletionJob.objects.get()
+        self.assertEqual(job.total, 1)
+        thread.assert_called_once_with(target=cleanup.run_deletion_job, args=(str(job.id), {str(failed.id): 'failed'}))
+        self.assertRedirects(response, f"{reverse('torrent_list')}?deletion_job={job.id}", fetch_redirect_response=False)
+
+        failed.refresh_from_db()
+        completed.refresh_from_db()
+        self.assertEqual(failed.status, 'deleting')
+        self.assertEqual(completed.status, 'completed')
+
+        # The list page polls the job until it is done
+        self.assertContains(self.client.get(response.url), f"deletionJob('{job.id}')")
+
+
+@override_settings(TORRENT_DEDUP_ENABLED=True, TORRENT_DEDUP_METHOD='hardlink', TORRENT_DEDUP_MIN_FILE_SIZE=1, TORRENT_HASH_WORKERS=1)
+class DeduplicationTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def completed_torrent(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return create_torrent(name=name, status='completed', file_path=path)
+
+    def test_identical_files_are_linked_to_the_oldest_copy(self):
+        first = self.completed_torrent('first', b'a' * 4096)
+        self.assertEqual(dedup.deduplicate_torrent(first.id), 0)
+        second = self.completed_torrent('second', b'a' * 4096)
+        other = self.completed_torrent('other', b'b' * 4096)
+
+        self.assertEqual(dedup.deduplicate_torrent(second.id), 4096)
+        self.assertEqual(dedup.deduplicate_torrent(other.id), 0)
+
+        self.assertTrue(os.path.samefile(first.file_path, second.file_path))
+        self.assertFalse(os.path.samefile(first.file_path, other.file_path))
+        self.assertTrue(ContentFile.objects.get(torrent=second).linked)
+        self.assertEqual(dedup.shared_paths(first), {first.file_path})
+
+    def test_files_with_a_unique_size_are_never_hashed(self):
+        first = self.completed_torrent('first', b'a' * 4096)
+        second = self.completed_torrent('second', b'a' * 100)
+
+        dedup.deduplicate_torrent(first.id)
+        dedup.deduplicate_torrent(second.id)
+
+        self.assertEqual(set(ContentFile.objects.values_list('sha256', flat=True)), {''})
+
+    def test_repairs_get_a_private_copy_of_linked_files(self):
+        first = self.completed_torrent('first', b'a' * 4096)
+        second = self.completed_torrent('second', b'a' * 4096)
+        dedup.deduplicate_torrent(first.id)
+        dedup.deduplicate_torrent(second.id)
+
+        self.assertEqual(dedup.break_links(second), 1)
+
+        self.assertFalse(os.path.samefile(first.file_path, second.file_path))
+        self.assertEqual(os.stat(first.file_path).st_nlink, 1)
+        with open(second.file_path, 'rb') as f:
+            self.assertEqual(f.read(), b'a' * 4096)
+        self.assertFalse(ContentFile.objects.get(torrent=second).linked)
+
+
+@override_settings(TORRENT_HASH_WORKERS=1, TORRENT_VERIFY_PIECES_PER_TASK=2)
+class VerifyJobTests(TestCase):
+    PIECE_SIZE = 16384
+
+    def setUp(self):
+        import libtorrent as lt
+
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        state = override_settings(TORRENT_STATE_DIR=self.directory)
+        state.enable()
+        self.addCleanup(state.disable)
+
+        patcher = mock.patch('downloader.verify.dispatch_queue')
+        self.dispatch_queue = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Three pieces of random data, verified in two tasks
+        self.path = os.path.join(self.directory, 'data.bin')
+        with open(self.path, 'wb') as f:
+            f.write(os.urandom(self.PIECE_SIZE * 3))
+        files = lt.file_storage()
+        files.add_file('data.bin', self.PIECE_SIZE * 3)
+        creator = lt.create_torrent(files, self.PIECE_SIZE)
+        lt.set_piece_hashes(creator, self.directory)
+
+        self.torrent = create_torrent(status='completed', save_path=self.directory, file_path=self.path, size=self.PIECE_SIZE * 3)
+        storage.save_metadata(str(self.torrent.id), lt.torrent_info(creator.generate()))
+
+    def run_job(self):
+        job = VerifyJob.objects.create(torrent=self.torrent)
+        verify.run_verify_job(job)
+        job.refresh_from_db()
+        self.torrent.refresh_from_db()
+        return job
+
+    def test_intact_data_passes(self):
+        job = self.run_job()
+
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual((job.total_pieces, job.checked_pieces, job.corrupt_pieces), (3, 3, []))
+        self.assertFalse(job.repair_pending)
+        self.assertEqual(self.torrent.status, 'completed')
+
+    def test_corrupt_pieces_are_queued_for_repair(self):
+        with open(self.path, 'r+b') as f:
+            f.seek(self.PIECE_SIZE + 10)
+            f.write(b'corrupt')
+
+        job = self.run_job()
+
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual(job.corrupt_pieces, [1])
+        self.assertTrue(job.repair_pending)
+        self.assertEqual(self.torrent.status, 'pending')
+        self.assertEqual(self.torrent.status_message, 'Repairing 1 corrupt pieces')
+        self.dispatch_queue.assert_called_once_with()
+
+    def test_missing_metadata_fails_the_job(self):
+        storage.remove_state_files(str(self.torrent.id))
+
+        job = self.run_job()
+
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.error, 'No saved metadata for this torrent')
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(self.torrent.status, 'completed')
+
+
+SESSION_PROFILES = {
+    'fast': {'connections_limit': 500, 'seed_choking_algorithm': 'anti_leech'},
+    'quiet': {'active_downloads': 2},
+}
+
+
+@override_settings(TORRENT_SESSION_PROFILES=SESSION_PROFILES)
+class SessionProfileTests(TestCase):
+    def test_profile_overlays_the_base_settings(self):
+        import libtorrent as lt
+
+        pack = session.build_settings_pack('fast')
+
+        self.assertEqual(pack['connections_limit'], 500)
+        self.assertEqual(pack['seed_choking_algorithm'], int(lt.seed_choking_algorithm_t.anti_leech))
+        self.assertTrue(pack['enable_dht'])
+
+    def test_unknown_profile_is_a_configuration_error(self):
+        with self.assertRaises(ImproperlyConfigured):
+            session.build_settings_pack('missing')
+
+    def test_switching_profiles_resets_what_only_the_old_one_set(self):
+        import libtorrent as lt
+
+        running = mock.Mock()
+        with mock.patch('downloader.session.get_session', return_value=running), \
+                mock.patch.object(session, '_active_profile', 'fast'):
+            session.apply_profile('quiet')
+            self.assertEqual(session._active_profile, 'quiet')
+
+        applied = running.apply_settings.call_args.args[0]
+        self.assertEqual(applied['connections_limit'], lt.default_settings()['connections_limit'])
+        self.assertEqual(applied['active_downloads'], 2)
+
+
+class DuplicateTorrentTests(TestCase):
+    def form(self, magnet_link):
+        return TorrentForm(data={'magnet_link': magnet_link, 'priority': TorrentDownload.PRIORITY_NORMAL, 'web_seeds': ''})
+
+    def test_same_info_hash_is_rejected_whatever_else_the_magnet_says(self):
+        info_hash = 'ab' * 20
+        create_torrent(name='first', magnet_link=f'magnet:?xt=urn:btih:{info_hash}&dn=first')
+
+        form = self.form(f'magnet:?xt=urn:btih:{info_hash}&dn=again&tr=http%3A%2F%2Ftracker%2Fannounce')
+
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.non_field_errors(), ['This torrent is already in the list as "first".'])
+
+    def test_other_info_hashes_are_accepted(self):
+        create_torrent(magnet_link=f'magnet:?xt=urn:btih:{"ab" * 20}')
+
+        self.assertTrue(self.form(f'magnet:?xt=urn:btih:{"cd" * 20}&dn=other').is_valid())
+
+
+class SessionStateTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        state = override_settings(TORRENT_STATE_DIR=directory)
+        state.enable()
+        self.addCleanup(state.disable)
+
+    def test_saved_state_comes_back_under_the_configured_profile(self):
+        import libtorrent as lt
+
+        saved = lt.session_params()
+        saved.settings = {'connections_limit': 10, 'active_downloads': 7}
+        with open(session.state_path(), 'wb') as f:
+            f.write(lt.write_session_params_buf(saved))
+
+        params = session.load_session_params({'connections_limit': 500})
+
+        self.assertEqual(params.settings['connections_limit'], 500)
+        self.assertEqual(params.settings['active_downloads'], 7)
+
+    def test_unreadable_state_is_ignored(self):
+        with open(session.state_path(), 'wb') as f:
+            f.write(b'not bencoded')
+
+        params = session.load_session_params({'connections_limit': 500})
+
+        self.assertEqual(params.settings['connections_limit'], 500)
+
+    def test_each_shard_keeps_its_own_state_file(self):
+        self.assertEqual(os.path.basename(session.state_path()), 'session.state')
+        with mock.patch.object(shards, '_shard', (2, 4)):
+            self.assertEqual(os.path.basename(session.state_path()), 'session-2.state')
+
+
+class BandwidthTests(TestCase):
+    def at(self, day, hour):
+        """Local time on a day of the week of 19 October 2026, a Monday"""
+        return timezone.make_aware(datetime(2026, 10, 19 + day, hour))
+
+    def test_window_past_midnight_covers_the_next_morning(self):
+        window = BandwidthSchedule(day_of_week=0, start_time=dt_time(22), end_time=dt_time(6))
+
+        self.assertFalse(window.is_active(self.at(0, 21)))
+        self.assertTrue(window.is_active(self.at(0, 23)))
+        self.assertTrue(window.is_active(self.at(1, 5)))
+        self.assertFalse(window.is_active(self.at(1, 6)))
+        self.assertFalse(window.is_active(self.at(2, 5)))
+
+    def test_schedule_window_wins_over_the_base_limits(self):
+        BandwidthSettings.objects.create(pk=1, download_limit=1000, upload_limit=100)
+        BandwidthSchedule.objects.create(day_of_week=0, start_time=dt_time(22), end_time=dt_time(6), download_limit=50, upload_limit=10)
+
+        self.assertEqual(bandwidth.global_limits(self.at(1, 2)), (50, 10))
+        self.assertEqual(bandwidth.global_limits(self.at(1, 12)), (1000, 100))
+
+        BandwidthSettings.objects.filter(pk=1).update(schedule_enabled=False)
+        self.assertEqual(bandwidth.global_limits(self.at(1, 2)), (1000, 100))
+
+    @override_settings(TORRENT_PRIORITY_BANDWIDTH_SHARE=0.5)
+    def test_normal_torrents_share_what_priority_torrents_leave(self):
+        create_torrent(status='downloading', bandwidth_priority=True)
+        first = create_torrent(status='downloading')
+        second = create_torrent(status='downloading')
+
+        self.assertEqual(bandwidth.priority_caps(1000, 0), {str(first.id): (250, 0), str(second.id): (250, 0)})
+        # A cap never rounds down to 0, which would mean unlimited
+        self.assertEqual(bandwidth.priority_caps(1, 1)[str(first.id)], (1, 1))
+
+    def test_without_priority_torrents_nobody_is_capped(self):
+        create_torrent(status='downloading')
+
+        self.assertEqual(bandwidth.priority_caps(1000, 1000), {})
+
+    def test_torrent_limits_take_the_tightest_cap(self):
+        torrent = create_torrent(download_limit=300)
+
+        with mock.patch.dict(bandwidth.torrent_caps, {str(torrent.id): (200, 40)}):
+            self.assertEqual(bandwidth.torrent_limits(torrent), (200, 40))
+        self.assertEqual(bandwidth.torrent_limits(torrent), (300, 0))
+
+    def test_each_shard_gets_its_share_of_the_global_limits(self):
+        BandwidthSettings.objects.create(pk=1, download_limit=1000, upload_limit=0)
+        running = mock.Mock()
+
+        with mock.patch('downloader.session.get_session', return_value=running), \
+                mock.patch.object(shards, '_shard', (0, 2)), \
+                mock.patch.object(bandwidth, '_applied_limits', None):
+            bandwidth.apply_limits()
+            bandwidth.apply_limits()
+
+        # Unchanged limits are not pushed into the session again
+        running.apply_settings.assert_called_once_with({'download_rate_limit': 500 * 1024, 'upload_rate_limit': 0})
+
+
+@override_settings(TORRENT_MAX_ACTIVE_DOWNLOADS=2)
+class DispatchQueueTests(TestCase):
+    def setUp(self):
+        for target in ('engine.start_queue_ticker', 'swarm.start_scrape_worker', 'history.start_pruning_worker'):
+            patcher = mock.patch(f'downloader.{target}')
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        patcher = mock.patch('downloader.shards.runs_engine', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Every torrent fits on the volume it asks for
+        patcher = mock.patch('downloader.storage.place_torrent', side_effect=lambda torrent: (torrent.save_path, ''))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def dispatch(self, executor):
+        with mock.patch('downloader.executors.current', return_value=executor):
+            return engine.dispatch_queue()
+
+    def test_starts_by_priority_then_queue_position(self):
+        low = create_torrent(priority=TorrentDownload.PRIORITY_LOW)
+        second = create_torrent(queue_position=2)
+        first = create_torrent(queue_position=1)
+        high = create_torrent(priority=TorrentDownload.PRIORITY_HIGH, queue_position=5)
+
+        executor = RecordingExecutor()
+        started = self.dispatch(executor)
+
+        self.assertEqual(started, [str(high.id), str(first.id)])
+        self.assertNotIn(str(second.id), started)
+        self.assertNotIn(str(low.id), started)
+
+    def test_known_swarms_start_before_unknown_ones(self):
+        unknown = create_torrent(queue_position=1)
+        seeded = create_torrent(queue_position=2, swarm_seeders=3)
+
+        executor = RecordingExecutor()
+        with override_settings(TORRENT_MAX_ACTIVE_DOWNLOADS=1):
+            started = self.dispatch(executor)
+
+        self.assertEqual(started, [str(seeded.id)])
+        self.assertNotIn(str(unknown.id), started)
+
+    def test_skips_torrents_in_retry_backoff_or_waiting_for_a_rescrape(self):
+        later = timezone.now() + timedelta(hours=1)
+        create_torrent(next_retry_at=later)
+        create_torrent(swarm_recheck_at=later)
+        ready = create_torrent(next_retry_at=timezone.now() - timedelta(minutes=1))
+
+        self.assertEqual(self.dispatch(RecordingExecutor()), [str(ready.id)])
+
+    def test_critical_torrent_preempts_the_least_important_download(self):
+        normal = create_torrent(status='downloading', priority=TorrentDownload.PRIORITY_NORMAL)
+        low = create_torrent(status='downloading', priority=TorrentDownload.PRIORITY_LOW)
+        critical = create_torrent(priority=TorrentDownload.PRIORITY_CRITICAL)
+
+        executor = RecordingExecutor(held=[normal.id, low.id])
+        started = self.dispatch(executor)
+
+        self.assertEqual(started, [])
+        low.refresh_from_db()
+        normal.refresh_from_db()
+        self.assertEqual(low.status, 'pending')
+        self.assertEqual(low.status_message, 'Preempted by a critical torrent')
+        self.assertEqual(normal.status, 'downloading')
+
+        # Once the preempted job let go of its slot the critical torrent starts
+        executor.held.remove(str(low.id))
+        started = self.dispatch(executor)
+        self.assertEqual(started[0], str(critical.id))
+
+    def test_torrents_still_shutting_down_are_not_preempted_twice(self):
+        stopping = create_torrent(status='pending', priority=TorrentDownload.PRIORITY_LOW)
+        running = create_torrent(status='downloading', priority=TorrentDownload.PRIORITY_LOW)
+        create_torrent(priority=TorrentDownload.PRIORITY_CRITICAL)
+
+        self.dispatch(RecordingExecutor(held=[stopping.id, running.id]))
+
+        running.refresh_from_db()
+        self.assertEqual(running.status, 'downloading')
+
+
+@override_settings(TORRENT_EXTRA_TRACKERS=['udp://extra:80/announce'])
+class StallMonitorTests(TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('downloader.health.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.handle = mock.Mock()
+        self.handle.trackers.return_value = [{'url': 'udp://known:80/announce'}]
+
+    def test_reannounces_then_adds_trackers_then_gives_up(self):
+        monitor = health.StallMonitor(30)
+        self.assertTrue(monitor.check(self.handle, 100))
+
+        self.now += 10
+        self.assertTrue(monitor.check(self.handle, 100))
+        self.handle.force_dht_announce.assert_called_once_with()
+        self.handle.add_tracker.assert_not_called()
+
+        self.now += 10
+        self.assertTrue(monitor.check(self.handle, 100))
+        self.handle.add_tracker.assert_called_once_with({'url': 'udp://extra:80/announce', 'tier': 1})
+
+        self.now += 10
+        self.assertFalse(monitor.check(self.handle, 100))
+
+    def test_progress_starts_the_escalation_over(self):
+        monitor = health.StallMonitor(30)
+        monitor.check(self.handle, 100)
+        self.now += 25
+        monitor.check(self.handle, 100)
+
+        self.now += 10
+        self.assertTrue(monitor.check(self.handle, 200))
+        self.assertEqual(monitor.stage, 0)
+        self.now += 25
+        self.assertTrue(monitor.check(self.handle, 200))
+
+
+@override_settings(TORRENT_RETRY_BASE_DELAY=60, TORRENT_RETRY_MAX_DELAY=200, TORRENT_MAX_RETRIES=3)
+class RetryBackoffTests(TestCase):
+    def test_delay_doubles_up_to_the_cap(self):
+        for retry_count, delay in ((0, 60), (1, 120), (2, 200)):
+            torrent = create_torrent(status='downloading', retry_count=retry_count)
+            before = timezone.now()
+
+            self.assertTrue(health.retry_later(torrent, 'Stalled'))
+
+            torrent.refresh_from_db()
+            self.assertEqual(torrent.status, 'pending')
+            self.assertEqual(torrent.retry_count, retry_count + 1)
+            self.assertAlmostEqual((torrent.next_retry_at - before).total_seconds(), delay, delta=5)
+            self.assertTrue(torrent.status_message.startswith('Stalled, retrying at'))
+
+    def test_gives_up_after_the_last_retry(self):
+        torrent = create_torrent(status='downloading', retry_count=3)
+
+        self.assertFalse(health.retry_later(torrent, 'Stalled'))
+
+        torrent.refresh_from_db()
+        self.assertEqual(torrent.status, 'failed')
+        self.assertEqual(torrent.status_message, 'Stalled, gave up after 3 retries')
+
+    def test_rows_paused_meanwhile_stay_paused(self):
+        torrent = create_torrent(status='downloading')
+        TorrentDownload.objects.filter(id=torrent.id).update(status='paused')
+
+        health.retry_later(torrent, 'Stalled')
+
+        torrent.refresh_from_db()
+        self.assertEqual(torrent.status, 'paused')
+        self.assertIsNone(torrent.next_retry_at)
+
+
+@override_settings(TORRENT_SCRAPE_INTERVAL=600)
+class SwarmHealthTests(TestCase):
+    def test_empty_swarm_is_deferred_until_the_next_scrape(self):
+        torrent = create_torrent()
+
+        swarm.record_swarm_health(torrent, 0, 3, 10, 0)
+
+        torrent.refresh_from_db()
+        self.assertEqual((torrent.swarm_seeders, torrent.swarm_leechers, torrent.swarm_completed, torrent.swarm_dht_peers),
+                         (0, 3, 10, 0))
+        self.assertAlmostEqual((torrent.swarm_recheck_at - torrent.swarm_checked_at).total_seconds(), 600)
+        self.assertTrue(torrent.status_message.startswith('No seeders found'))
+
+    def test_unreachable_trackers_prove_nothing(self):
+        torrent = create_torrent()
+
+        swarm.record_swarm_health(torrent, None, None, None, None)
+
+        torrent.refresh_from_db()
+        self.assertIsNotNone(torrent.swarm_checked_at)
+        self.assertIsNone(torrent.swarm_recheck_at)
+        self.assertEqual(torrent.status_message, '')
+
+    def test_peers_clear_an_earlier_deferral(self):
+        torrent = create_torrent(swarm_recheck_at=timezone.now(), status_message='No seeders found, checking again at 12:00')
+
+        swarm.record_swarm_health(torrent, None, None, None, 4)
+
+        torrent.refresh_from_db()
+        self.assertIsNone(torrent.swarm_recheck_at)
+        self.assertEqual(torrent.status_message, '')
+
+    def test_only_queued_rows_are_updated(self):
+        torrent = create_torrent(status='downloading')
+
+        swarm.record_swarm_health(torrent, 0, 0, 0, 0)
+
+        torrent.refresh_from_db()
+        self.assertIsNone(torrent.swarm_checked_at)
+
+    def test_swarms_with_peers_rank_above_unknown_and_empty_ones(self):
+        seeded = create_torrent(swarm_seeders=2)
+        dht = create_torrent(swarm_dht_peers=5)
+        unknown = create_torrent()
+        empty = create_torrent(swarm_seeders=0, swarm_dht_peers=0)
+
+        ranks = dict(TorrentDownload.objects.annotate(rank=swarm.health_rank()).values_list('id', 'rank'))
+
+        self.assertEqual(ranks, {seeded.id: 1, dht.id: 1, unknown.id: 0, empty.id: 0})
+
+
+@override_settings(
+    TORRENT_SEEDING_ENABLED=True, TORRENT_SEED_RATIO=2.0, TORRENT_SEED_MAX_TIME=0,
+    TORRENT_MAX_ACTIVE_SEEDS=1, TORRENT_SEED_ONLY_WHILE_IDLE=False,
+)
+class SeedingPolicyTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('downloader.session.get_session')
+        self.session = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(seeding._seeds.clear)
+        self.addCleanup(history._buffers.clear)
+
+    def seed(self, torrent, uploaded, paused=False):
+        import libtorrent as lt
+
+        handle = mock.Mock()
+        handle.status.return_value = mock.Mock(
+            flags=lt.torrent_flags.paused if paused else 0, all_time_upload=uploaded, upload_rate=2048, num_peers=3,
+        )
+        seeding._seeds[str(torrent.id)] = handle
+        return handle
+
+    def reload(self, torrent):
+        return TorrentDownload.objects.select_related('live').get(id=torrent.id)
+
+    def test_ticks_write_only_the_live_row(self):
+        torrent = create_torrent(status='completed', size=1000, uploaded=100, seed_time=50, is_seeding=True)
+        self.seed(torrent, 300)
+
+        with CaptureQueriesContext(connection) as queries:
+            seeding.apply_seeding_policy(10)
+
+        writes = [query['sql'] for query in queries.captured_queries if query['sql'].startswith(('UPDATE', 'INSERT'))]
+        self.assertTrue(writes)
+        self.assertTrue(all('downloader_torrentlivestatus' in sql for sql in writes))
+
+        torrent = self.reload(torrent)
+        self.assertEqual((torrent.uploaded, torrent.seed_time), (100, 50))
+        self.assertEqual((torrent.live.uploaded, torrent.live.seed_time), (300, 60))
+        self.assertEqual(torrent.current_status_message, 'Seeding, ratio 0.30')
+
+    def test_seed_stops_at_the_ratio_and_the_torrent_row_catches_up(self):
+        torrent = create_torrent(status='completed', size=1000, seed_time=50, is_seeding=True)
+        handle = self.seed(torrent, 2500)
+
+        seeding.apply_seeding_policy(10)
+
+        torrent = self.reload(torrent)
+        self.assertFalse(torrent.is_seeding)
+        self.assertEqual((torrent.uploaded, torrent.seed_time), (2500, 60))
+        self.assertEqual(torrent.current_status_message, 'Seeding finished: ratio 2.50 reached')
+        self.assertEqual(torrent.live.upload_speed, 0)
+        self.assertIsNone(seeding.seeding_handle(str(torrent.id)))
+        self.session.return_value.remove_torrent.assert_called_once_with(handle)
+
+    @override_settings(TORRENT_SEED_RATIO=0, TORRENT_SEED_MAX_TIME=3600)
+    def test_seed_time_counts_only_while_running(self):
+        torrent = create_torrent(status='completed', size=1000, seed_time=3590, is_seeding=True)
+        self.seed(torrent, 0, paused=True)
+
+        seeding.apply_seeding_policy(10)
+        self.assertEqual(self.reload(torrent).current_status_message, 'Seeding queued')
+
+        seeding._seeds[str(torrent.id)].status.return_value.flags = 0
+        seeding.apply_seeding_policy(10)
+        self.assertEqual(self.reload(torrent).status_message, 'Seeding finished: seeded for 1.0h')
+
+    def test_least_seeded_torrents_get_the_slots(self):
+        ahead = create_torrent(status='completed', size=1000, is_seeding=True)
+        behind = create_torrent(status='completed', size=1000, is_seeding=True)
+        ahead_handle = self.seed(ahead, 900)
+        behind_handle = self.seed(behind, 100)
+
+        seeding.apply_seeding_policy(10)
+
+        behind_handle.resume.assert_called_once_with()
+        ahead_handle.pause.assert_called_once_with()
+
+    @override_settings(TORRENT_SEED_ONLY_WHILE_IDLE=True)
+    def test_seeds_wait_for_downloads_when_seeding_only_while_idle(self):
+        torrent = create_torrent(status='completed', size=1000, is_seeding=True)
+        handle = self.seed(torrent, 0)
+        create_torrent(status='downloading')
+
+        seeding.apply_seeding_policy(10)
+
+        handle.pause.assert_called_once_with()
+        handle.resume.assert_not_called()
+
+    def test_hand_off_replaces_an_old_seeding_message(self):
+        torrent = create_torrent(status='completed')
+        TorrentLiveStatus.objects.create(torrent=torrent, status_message='Seeding, ratio 0.50')
+
+        seeding.hand_off(torrent)
+
+        torrent = self.reload(torrent)
+        self.assertTrue(torrent.is_seeding)
+        self.assertEqual(torrent.current_status_message, 'Waiting for the engine to seed')
+
+    def test_adopt_resumes_owed_seeds_and_drops_finished_ones(self):
+        owed = create_torrent(status='completed', size=1000, is_seeding=True)
+        done = create_torrent(status='completed', size=1000, uploaded=5000, is_seeding=True)
+
+        with mock.patch('downloader.shards.owns', return_value=True), \
+                mock.patch('downloader.seeding.resume_seeding', return_value=True) as resume:
+            self.assertEqual(seeding.adopt(), 1)
+
+        self.assertEqual([call.args[0].id for call in resume.call_args_list], [owed.id])
+        done.refresh_from_db()
+        self.assertFalse(done.is_seeding)
+
+    def test_adopt_leaves_other_shards_seeds_alone(self):
+        torrent = create_torrent(status='completed', size=1000, is_seeding=True)
+
+        with mock.patch('downloader.shards.owns', return_value=False):
+            self.assertEqual(seeding.adopt(), 0)
+
+        torrent.refresh_from_db()
+        self.assertTrue(torrent.is_seeding)
+
+
+class WebSeedTests(TestCase):
+    def test_mirrors_are_trimmed_and_deduplicated(self):
+        form = TorrentWebSeedsForm(data={'web_seeds': ' http://mirror.example/a \n\nhttps://mirror.example/b\nhttp://mirror.example/a\n'}, instance=create_torrent())
+
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['web_seeds'], 'http://mirror.example/a\nhttps://mirror.example/b')
+
+    def test_only_http_mirrors_are_accepted(self):
+        form = TorrentWebSeedsForm(data={'web_seeds': 'ftp://mirror.example/a'}, instance=create_torrent())
+
+        self.assertFalse(form.is_valid())
+        self.assertIn('web_seeds', form.errors)
+
+    def test_engine_adds_the_mirrors_to_the_magnets_web_seeds(self):
+        torrent = create_torrent(
+            magnet_link=f'magnet:?xt=urn:btih:{"a" * 40}&ws=http%3A%2F%2Fmirror.example%2Fa',
+            web_seeds='http://mirror.example/a\nhttp://mirror.example/b',
+        )
+
+        self.assertEqual(engine.web_seeds(torrent), ['http://mirror.example/a', 'http://mirror.example/b'])
+
+
+@override_settings(TORRENT_MAX_ACTIVE_DOWNLOADS=5)
+class ShardTests(TestCase):
+    def setUp(self):
+        for name, value in (('_shard', None), ('_job', False)):
+            patcher = mock.patch.object(shards, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.dict(shards._assignments, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_torrents_belong_to_the_shard_their_info_hash_picks(self):
+        info_hash = '0' * 39 + '7'
+        first = create_torrent(magnet_link=f'magnet:?xt=urn:btih:{info_hash}')
+        again = create_torrent(magnet_link=f'magnet:?xt=urn:btih:{info_hash}&dn=again')
+
+        self.assertEqual(shards.shard_of(first, 4), 3)
+        self.assertEqual(shards.shard_of(again, 4), 3)
+
+        shards.configure(3, 4)
+        self.assertTrue(shards.owns(first))
+        shards.configure(0, 4)
+        self.assertFalse(shards.owns(first))
+
+    def test_slots_and_rates_are_split_across_shards(self):
+        shards.configure(0, 2)
+
+        self.assertEqual(shards.download_slots(), 3)
+        self.assertEqual(shards.rate_share(1000), 500)
+        self.assertEqual(shards.rate_share(0), 0)
+
+    def test_later_shards_shift_their_ports_and_state_files(self):
+        shards.configure(2, 3)
+
+        self.assertEqual(shards.listen_interfaces('0.0.0.0:6881,[::]:6881'), '0.0.0.0:6883,[::]:6883')
+        self.assertEqual(shards.state_suffix(), '-2')
+        self.assertFalse(shards.is_primary())
+
+    def test_job_processes_share_rates_over_every_download_slot(self):
+        shards.configure_job()
+
+        self.assertEqual(shards.rate_share(1000), 200)
+        self.assertEqual(shards.listen_interfaces('0.0.0.0:6881,[::]:6881'), '0.0.0.0:0,[::]:0')
+        self.assertFalse(shards.saves_state())
+        self.assertTrue(shards.runs_engine())
+
+
+class RequeueOrphansTests(TestCase):
+    def test_rows_without_a_running_job_go_back_to_the_queue(self):
+        orphan = create_torrent(status='downloading')
+        TorrentLiveStatus.objects.create(torrent=orphan, progress=0.4, download_speed=100.0, peers=5, eta_seconds=60)
+        running = create_torrent(status='downloading')
+        paused = create_torrent(status='paused')
+        job = VerifyJob.objects.create(torrent=create_torrent(status='completed'), status='running')
+
+        with mock.patch('downloader.executors.current', return_value=RecordingExecutor(held=[running.id])):
+            self.assertEqual(recovery.requeue_orphans(), 1)
+
+        orphan = TorrentDownload.objects.select_related('live').get(id=orphan.id)
+        self.assertEqual(orphan.status, 'pending')
+        self.assertEqual(orphan.status_message, 'Requeued after an engine restart')
+        # Progress stays, resume data lets the next download thread carry on from there
+        self.assertEqual((orphan.live.progress, orphan.live.download_speed, orphan.live.peers, orphan.live.eta_seconds),
+                         (0.4, 0, 0, None))
+
+        for torrent, status in ((running, 'downloading'), (paused, 'paused')):
+            torrent.refresh_from_db()
+            self.assertEqual(torrent.status, status)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'pending')
+
+    def test_celery_rows_outlive_the_web_process(self):
+        torrent = create_torrent(status='downloading')
+        executor = RecordingExecutor()
+        executor.local = False
+
+        with mock.patch('downloader.executors.current', return_value=executor):
+            self.assertEqual(recovery.requeue_orphans(), 0)
+
+        torrent.refresh_from_db()
+        self.assertEqual(torrent.status, 'downloading')
+
+
+class ExecutorClaimTests(TestCase):
+    def test_run_download_leaves_a_paused_row_alone(self):
+        torrent = create_torrent(status='paused')
+
+        engine.run_download(str(torrent.id))
+
+        torrent.refresh_from_db()
+        self.assertEqual(torrent.status, 'paused')
+
+    def test_celery_submit_dispatches_a_row_once(self):
+        torrent = create_torrent()
+        executor = executors.CeleryExecutor()
+
+        with mock.patch('downloader.tasks.download_torrent.delay') as delay:
+            self.assertTrue(executor.submit(str(torrent.id), None))
+            self.assertFalse(executor.submit(str(torrent.id), None))
+
+        torrent.refresh_from_db()
+        self.assertEqual(torrent.status, 'downloading')
+        delay.assert_called_once_with(str(torrent.id), str(torrent.lease_token))
+
+    def test_celery_submit_gives_the_row_back_when_the_broker_is_down(self):
+        torrent = create_torrent()
+
+        with mock.patch('downloader.tasks.download_torrent.delay', side_effect=ConnectionError):
+            with self.assertRaises(ConnectionError):
+                executors.CeleryExecutor().submit(str(torrent.id), None)
+
+        torrent.refresh_from_db()
+        self.assertEqual(torrent.status, 'pending')
+        self.assertIsNone(torrent.lease_token)
+
+    def test_expired_leases_are_requeued_and_their_jobs_lose_the_row(self):
+        expired = create_torrent(status='downloading', lease_token=uuid.uuid4(),
+                                 lease_expires_at=timezone.now() - timedelta(seconds=1))
+        held = create_torrent(status='downloading', lease_token=uuid.uuid4(),
+                              lease_expires_at=timezone.now() + timedelta(minutes=1))
+        stale = executors.Lease(expired.id, expired.lease_token)
+
+        self.assertEqual(executors.CeleryExecutor().reclaim(), 1)
+
+        expired.refresh_from_db()
+        held.refresh_from_db()
+        self.assertEqual(expired.status, 'pending')
+        self.assertEqual(held.status, 'downloading')
+        self.assertFalse(stale.renew())
+        self.assertTrue(executors.Lease(held.id, held.lease_token).renew())
+
+    def test_detached_jobs_return_with_their_download_and_leave_seeding_to_the_engine(self):
+        torrent = create_torrent()
+
+        with mock.patch.object(shards, '_job', False), mock.patch.object(seeding, '_hand_off', False), \
+                mock.patch('downloader.engine.run_download') as run_download:
+            executors.run_detached(str(torrent.id))
+
+            self.assertTrue(seeding.hands_off())
+            self.assertTrue(shards.runs_engine())
+        run_download.assert_called_once_with(str(torrent.id))
+
+
+class LiveStatusMigrationTests(TransactionTestCase):
+    migrate_from = [('downloader', '0012_web_seeds')]
+    migrate_to = [('downloader', '0013_live_status')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_live_fields_move_to_their_own_table(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        old_apps = executor.loader.project_state(self.migrate_from).apps
+        OldTorrent = old_apps.get_model('downloader', 'TorrentDownload')
+        torrent = OldTorrent.objects.create(
+            name='old', magnet_link='magnet:?xt=urn:btih:' + 'c' * 40,
+            progress=0.5, download_speed=120.0, upload_speed=3.0, downloaded=2048, peers=7, seeds=2,
+        )
+
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.migrate_to)
+        new_apps = executor.loader.project_state(self.migrate_to).apps
+        live = new_apps.get_model('downloader', 'TorrentLiveStatus').objects.get(torrent_id=torrent.id)
+
+        self.assertEqual((live.progress, live.download_speed, live.upload_speed, live.downloaded, live.peers, live.seeds),
+                         (0.5, 120.0, 3.0, 2048, 7, 2))
+        self.assertIsNone(live.eta_seconds)
+
+
+class ImportSqliteTests(TransactionTestCase):
+    SOURCE = 'import_test_source'
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'old.sqlite3')
+
+        # An older install, a few migrations behind the code
+        connections.settings[self.SOURCE] = {
+            **connections['default'].settings_dict, 'NAME': self.path, 'OPTIONS': {}, 'TEST': {},
+        }
+        self.addCleanup(connections.settings.pop, self.SOURCE, None)
+        self.addCleanup(connections.__delitem__, self.SOURCE)
+        call_command('migrate', 'downloader', '0012_web_seeds', database=self.SOURCE, verbosity=0)
+        with connections[self.SOURCE].cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO downloader_torrentdownload (id, name, magnet_link, web_seeds, status, status_message,"
+                " priority, queue_position, progress, download_speed, upload_speed, downloaded, peers, seeds, eta,"
+                " uploaded, size, retry_count, download_limit, upload_limit, bandwidth_priority, save_path,"
+                " file_path, is_multi_file, created_at, is_seeding, seed_time)"
+                " VALUES (%s, 'old', 'magnet:?xt=urn:btih:dd', '', 'completed', '', 1, 0, 1.0, 0, 0, 10, 0, 0, '',"
+                " 0, 10, 0, 0, 0, 0, '', '', 0, '2024-01-01 00:00:00', 0, 0)",
+                [uuid.UUID(int=1).hex],
+            )
+        connections[self.SOURCE].close()
+
+    def digest(self):
+        with open(self.path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def source_migration(self):
+        with sqlite3.connect(self.path) as db:
+            return db.execute(
+                "SELECT MAX(name) FROM django_migrations WHERE app = 'downloader'"
+            ).fetchone()[0]
+
+    def test_imports_rows_without_touching_the_source(self):
+        before = self.digest()
+
+        call_command('import_sqlite', self.path, stdout=StringIO())
+
+        torrent = TorrentDownload.objects.get(id=uuid.UUID(int=1))
+        self.assertEqual((torrent.name, torrent.size), ('old', 10))
+        self.assertEqual(torrent.live_status.downloaded, 10)
+        self.assertEqual(self.digest(), before)
+        self.assertEqual(self.source_migration(), '0012_web_seeds')
+
+
+class HistoryTests(TestCase):
+    def setUp(self):
+        self.torrent = create_torrent()
+        self.torrent_id = str(self.torrent.id)
+
+    def buffer_with(self, samples):
+        buffer = history.RingBuffer(100)
+        for sample in samples:
+            buffer.append(*sample)
+        buffer.flushed_until = samples[0][0] // history.MINUTE * history.MINUTE
+        return buffer
+
+    def test_ring_buffer_keeps_the_newest_samples_in_order(self):
+        buffer = history.RingBuffer(3)
+        for second in range(5):
+            buffer.append(float(second), second, 0, 1, 0.5)
+
+        self.assertEqual([sample[0] for sample in buffer.samples()], [2.0, 3.0, 4.0])
+        self.assertEqual([sample[0] for sample in buffer.samples(since=3.0)], [3.0, 4.0])
+
+    def test_minutes_roll_up_into_weighted_hours(self):
+        hour = (time.time() // history.HOUR - 1) * history.HOUR
+        buffer = self.buffer_with([
+            (hour + 10, 100.0, 10.0, 4, 0.1),
+            (hour + 20, 300.0, 10.0, 4, 0.2),
+            (hour + 70, 50.0, 20.0, 2, 0.3),
+        ])
+
+        history.flush(self.torrent_id, buffer, hour + history.HOUR)
+
+        minutes = ThroughputRollup.objects.filter(torrent=self.torrent, resolution=history.MINUTE).order_by('bucket_start')
+        self.assertEqual([(row.samples, row.download_avg, row.download_max) for row in minutes],
+                         [(2, 200.0, 300.0), (1, 50.0, 50.0)])
+
+        rolled = ThroughputRollup.objects.get(torrent=self.torrent, resolution=history.HOUR)
+        self.assertEqual(rolled.bucket_start, datetime.fromtimestamp(hour, tz=dt_timezone.utc))
+        self.assertEqual(rolled.samples, 3)
+        self.assertAlmostEqual(rolled.download_avg, 150.0)
+        self.assertEqual(rolled.download_max, 300.0)
+        self.assertAlmostEqual(rolled.progress, 0.3, places=5)
+
+    def test_partial_minutes_merge_with_the_earlier_flush(self):
+        minute = (time.time() // history.MINUTE - 5) * history.MINUTE
+        buffer = self.buffer_with([(minute + 1, 100.0, 0.0, 1, 0.1)])
+        history.flush(self.torrent_id, buffer, minute + 30)
+        buffer.append(minute + 40, 200.0, 0.0, 1, 0.2)
+        buffer.append(minute + 50, 300.0, 0.0, 1, 0.3)
+        history.flush(self.torrent_id, buffer, minute + history.MINUTE)
+
+        row = ThroughputRollup.objects.get(torrent=self.torrent, resolution=history.MINUTE)
+        self.assertEqual(row.samples, 3)
+        self.assertAlmostEqual(row.download_avg, 200.0)
+        self.assertAlmostEqual(row.progress, 0.3, places=5)
+
+    @override_settings(TORRENT_HISTORY_MINUTE_RETENTION=3600, TORRENT_HISTORY_HOUR_RETENTION=86400)
+    def test_prune_covers_torrents_that_no_longer_record(self):
+        now = timezone.now()
+        finished = create_torrent(status='completed')
+        for torrent in (self.torrent, finished):
+            for resolution, age in ((history.MINUTE, 7200), (history.MINUTE, 60),
+                                    (history.HOUR, 2 * 86400), (history.HOUR, 7200)):
+                ThroughputRollup.objects.create(
+                    torrent=torrent, resolution=resolution, bucket_start=now - timedelta(seconds=age), samples=1,
+                )
+
+        self.assertEqual(history.prune(), 4)
+        self.assertEqual(ThroughputRollup.objects.filter(torrent=finished).count(), 2)
+
+
+@override_settings(TORRENT_ENGINE_MODE='external')
+class MetricsTests(TestCase):
+    def setUp(self):
+        # Only the libtorrent counters need a session, the database gauges don't
+        patcher = mock.patch('downloader.session.running_session', return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def register(self, metric):
+        self.addCleanup(metrics._registry.remove, metric)
+        return metric
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.register(metrics.Histogram('test_seconds', 'Test durations', labels=('kind',), buckets=(0.1, 1.0)))
+        for value in (0.05, 0.5, 4.0):
+            histogram.observe(value, kind='a')
+
+        lines = metrics.render().splitlines()
+
+        self.assertIn('test_seconds_bucket{kind="a",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{kind="a",le="1.0"} 2', lines)
+        self.assertIn('test_seconds_bucket{kind="a",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_count{kind="a"} 3', lines)
+        self.assertIn('test_seconds_sum{kind="a"} 4.55', lines)
+
+    def test_label_values_are_escaped(self):
+        counter = self.register(metrics.Counter('test_total', 'Test events', labels=('path',)))
+        counter.inc(path='a"b\\c\nd')
+        counter.inc(2, path='a"b\\c\nd')
+
+        self.assertIn('test_total{path="a\\"b\\\\c\\nd"} 3', metrics.render().splitlines())
+
+    def test_web_tier_exports_queue_and_torrent_gauges(self):
+        create_torrent()
+        downloading = create_torrent(name='moving', status='downloading')
+        TorrentLiveStatus.objects.create(torrent=downloading, download_speed=2.0, progress=0.5)
+
+        text = metrics.render()
+
+        self.assertEqual(text.count('# HELP torrent_queue_depth '), 1)
+        self.assertIn('torrent_queue_depth{status="pending"} 1', text)
+        self.assertIn('torrent_queue_depth{status="failed"} 0', text)
+        self.assertIn(f'torrent_download_bytes_per_second{{torrent="{downloading.id}",name="moving"}} 2048.0', text)
+        self.assertIn(f'torrent_progress_ratio{{torrent="{downloading.id}",name="moving"}} 0.5', text)
+        self.assertTrue(text.endswith('\n'))
+
+    def test_engine_shards_leave_database_gauges_to_the_web_tier(self):
+        with mock.patch.object(shards, '_shard', (1, 2)):
+            text = metrics.render()
+
+        self.assertNotIn('torrent_queue_depth', text)
+        self.assertIn('# TYPE torrent_db_write_seconds histogram', text)
+
+    def test_instrumented_views_count_requests_by_status_code(self):
+        def count(code):
+            return metrics.HTTP_REQUESTS.values.get(('status', code), 0)
+
+        before = count(404)
+        response = self.client.get(reverse('torrent_status', args=[uuid.uuid4()]))
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(count(404), before + 1)
+
+
+class DiagnosticsEncodingTests(TestCase):
+    def test_bitfield_puts_the_first_piece_in_the_high_bit(self):
+        encoded = diagnostics.encode_bitfield([True, False, False, False, False, False, False, True, True])
+        self.assertEqual(base64.b64decode(encoded), bytes([0b10000001, 0b10000000]))
+
+    def test_runs_count_equal_neighbours(self):
+        self.assertEqual(diagnostics.encode_runs([3, 3, 3, 0, 5, 5]), [3, 3, 0, 1, 5, 2])
+        self.assertEqual(diagnostics.encode_runs([]), [])
+
+    def test_availability_uses_runs_for_uniform_swarms(self):
+        self.assertEqual(diagnostics.encode_availability([4] * 100), {'encoding': 'rle', 'data': [4, 100]})
+
+    def test_availability_falls_back_to_capped_bytes(self):
+        values = [index % 7 for index in range(50)] + [1000]
+        encoded = diagnostics.encode_availability(values)
+
+        self.assertEqual(encoded['encoding'], 'bytes')
+        self.assertEqual(list(base64.b64decode(encoded['data'])), values[:-1] + [diagnostics.AVAILABILITY_MAX])
+
+
+class EventsTests(TestCase):
+    def record(self, message='Stalled', **extra):
+        record = logging.LogRecord('downloader.engine', logging.WARNING, __file__, 1, message, (), None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_json_lines_carry_extra_fields_as_keys(self):
+        entry = json.loads(events.JsonFormatter().format(self.record(torrent_id='abc', info_hash='ff')))
+
+        self.assertEqual(
+            (entry['level'], entry['logger'], entry['message'], entry['torrent_id'], entry['info_hash']),
+            ('warning', 'downloader.engine', 'Stalled', 'abc', 'ff'),
+        )
+        self.assertTrue(entry['time'].endswith('+00:00'))
+
+    def test_text_lines_append_extra_fields(self):
+        line = events.TextFormatter('%(levelname)s %(message)s').format(self.record(torrent_id='abc'))
+
+        self.assertEqual(line, 'WARNING Stalled torrent_id=abc')
+
+    def test_torrent_logger_stamps_id_and_info_hash(self):
+        info_hash = 'ab' * 20
+        log = events.torrent_logger(logging.getLogger('downloader.engine'), 'abc', f'magnet:?xt=urn:btih:{info_hash}')
+
+        with self.assertLogs('downloader.engine', level='INFO') as logs:
+            log.info('Started', extra={'peers': 3})
+
+        record = logs.records[0]
+        self.assertEqual((record.torrent_id, record.info_hash, record.peers), ('abc', info_hash, 3))
+
+    def test_recent_events_are_kept_for_recently_logged_torrents(self):
+        handler = events.TorrentEventHandler(capacity=2, max_torrents=2)
+
+        with mock.patch.object(events, '_events', OrderedDict()):
+            for message in ('one', 'two', 'three'):
+                handler.emit(self.record(message, torrent_id='first'))
+            handler.emit(self.record('other', torrent_id='second'))
+            handler.emit(self.record('again', torrent_id='first'))
+            handler.emit(self.record('newest', torrent_id='third'))
+            handler.emit(self.record('untagged'))
+
+            self.assertEqual([event['message'] for event in events.recent_events('first')], ['again', 'three'])
+            self.assertEqual(events.recent_events('second'), [])
+            self.assertEqual(len(events._events), 2)
+
+    def test_throttle_counts_the_events_it_held_back(self):
+        now = [0.0]
+        throttle = events.Throttle(60)
+
+        with mock.patch('downloader.events.time.monotonic', side_effect=lambda: now[0]):
+            self.assertTrue(throttle.allow('peers'))
+            self.assertFalse(throttle.allow('peers'))
+            self.assertFalse(throttle.allow('peers'))
+            self.assertTrue(throttle.allow('other'))
+            now[0] = 60.0
+            self.assertTrue(throttle.allow('peers'))
+
+        self.assertEqual(throttle.suppressed_since('peers'), 2)
+        self.assertEqual(throttle.suppressed_since('peers'), 0)
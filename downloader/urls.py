@@ -12,14 +12,31 @@ urlpatterns = [
     path('resume/<uuid:torrent_id>/', views.resume_torrent, name='resume_torrent'),
     path('restart/<uuid:torrent_id>/', views.restart_torrent, name='restart_torrent'),
     path('delete/<uuid:torrent_id>/', views.delete_torrent, name='delete_torrent'),
+    path('verify/<uuid:torrent_id>/', views.verify_torrent, name='verify_torrent'),
+    path('move/<uuid:torrent_id>/up/', views.move_torrent, {'direction': 'up'}, name='move_torrent_up'),
+    path('move/<uuid:torrent_id>/down/', views.move_torrent, {'direction': 'down'}, name='move_torrent_down'),
+    path('priority/<uuid:torrent_id>/', views.set_torrent_priority, name='set_torrent_priority'),
+    path('limits/<uuid:torrent_id>/', views.set_torrent_limits, name='set_torrent_limits'),
+    path('web-seeds/<uuid:torrent_id>/', views.set_web_seeds, name='set_web_seeds'),
+    path('bandwidth/', views.set_bandwidth, name='set_bandwidth'),
     
     # File operations
     path('download/<uuid:torrent_id>/', views.download_file, name='download_file'),
     
     # API endpoints
     path('status/<uuid:torrent_id>/', views.get_torrent_status, name='torrent_status'),
+    path('history/<uuid:torrent_id>/', views.get_torrent_history, name='torrent_history'),
+    path('diagnostics/<uuid:torrent_id>/', views.get_torrent_diagnostics, name='torrent_diagnostics'),
+    path('jobs/deletion/<uuid:job_id>/', views.get_deletion_job_status, name='deletion_job_status'),
+    path('jobs/verify/<uuid:job_id>/', views.get_verify_job_status, name='verify_job_status'),
+    path('engine/settings/', views.get_engine_settings, name='engine_settings'),
+    path('engine/profile/', views.set_engine_profile, name='set_engine_profile'),
+    path('engine/bandwidth/', views.get_bandwidth_status, name='bandwidth_status'),
+    path('metrics', views.prometheus_metrics, name='metrics'),
+    path('profiling/', views.profiling_report, name='profiling_report'),
     
     # Bulk operations
     path('cleanup/completed/', views.cleanup_completed, name='cleanup_completed'),
     path('cleanup/failed/', views.cleanup_failed, name='cleanup_failed'),
+    path('verify/completed/', views.verify_completed, name='verify_completed'),
 ]
\ No newline at end of file
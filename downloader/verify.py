@@ -0,0 +1,134 @@
+# downloader/verify.py - Offline integrity verification of completed downloads
+import logging
+import os
+import threading
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from .models import TorrentDownload, VerifyJob
+from .engine import dispatch_queue
+from .hashing import process_pool, verify_pieces
+from . import dedup, seeding, shards, storage
+
+logger = logging.getLogger(__name__)
+
+# Single verifier thread, jobs run one after another so bulk checks don't flood the disks
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def schedule_verification(torrents):
+    """Queue verify jobs for completed torrents that aren't already queued"""
+
+    queued = VerifyJob.objects.filter(status__in=['pending', 'running']).values_list('torrent_id', flat=True)
+    candidates = torrents.filter(status='completed').exclude(id__in=queued)
+
+    jobs = VerifyJob.objects.bulk_create([VerifyJob(torrent=torrent) for torrent in candidates])
+    # An external engine's primary shard picks pending jobs up itself
+    if jobs and shards.runs_engine():
+        start_verify_worker()
+    return jobs
+
+
+def start_verify_worker():
+    """Start the verifier thread unless it is already running"""
+
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=run_verify_worker)
+            _worker.daemon = True
+            _worker.start()
+
+
+def run_verify_worker():
+    """Work through pending verify jobs in order"""
+
+    try:
+        while True:
+            job = VerifyJob.objects.filter(status='pending').select_related('torrent').first()
+            if job is None:
+                return
+            run_verify_job(job)
+    finally:
+        close_old_connections()
+
+
+def run_verify_job(job):
+    """Hash a torrent's data against its piece hashes and queue a repair for corrupt pieces"""
+
+    job.status = 'running'
+    job.save(update_fields=['status'])
+    torrent = job.torrent
+
+    try:
+        info = storage.load_metadata(str(torrent.id))
+        if info is None:
+            raise ValueError("No saved metadata for this torrent")
+        if not info.info_hashes().has_v1():
+            raise ValueError("Only torrents with v1 piece hashes can be verified")
+
+        job.total_pieces = info.num_pieces()
+        job.save(update_fields=['total_pieces'])
+
+        layout = file_layout(info, storage.torrent_volume(torrent))
+        step = settings.TORRENT_VERIFY_PIECES_PER_TASK
+
+        with process_pool(settings.TORRENT_HASH_WORKERS) as pool:
+            futures = [
+                pool.submit(
+                    verify_pieces, layout, info.piece_length(), info.total_size(), first,
+                    [info.hash_for_piece(index) for index in range(first, min(first + step, job.total_pieces))],
+                )
+                for first in range(0, job.total_pieces, step)
+            ]
+            # Results are collected in order so progress only ever moves forward
+            for future in futures:
+                job.corrupt_pieces.extend(future.result())
+                job.checked_pieces = min(job.total_pieces, job.checked_pieces + step)
+                job.save(update_fields=['checked_pieces', 'corrupt_pieces'])
+
+        job.status = 'completed'
+        if job.corrupt_pieces:
+            queue_repair(job)
+        logger.info("Verified %s: %d corrupt of %d pieces", torrent.name, len(job.corrupt_pieces), job.total_pieces, extra={'torrent_id': str(torrent.id)})
+    except Exception as e:
+        logger.error("Verification failed for %s: %s", torrent.name, e, extra={'torrent_id': str(torrent.id)})
+        job.status = 'failed'
+        job.error = str(e)
+    finally:
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at', 'repair_pending'])
+
+
+def file_layout(info, save_path):
+    """(path, offset, size) for every file in torrent order, pad files have no path"""
+
+    files = info.files()
+    return [
+        (
+            None if files.file_flags(index) & files.flag_pad_file else os.path.join(save_path, files.file_path(index)),
+            files.file_offset(index),
+            files.file_size(index),
+        )
+        for index in range(files.num_files())
+    ]
+
+
+def queue_repair(job):
+    """Send a torrent back to the queue to re-download only its corrupt pieces"""
+
+    # The engine adds the torrent again, so a seeding handle has to go first
+    seeding.stop_seeding(str(job.torrent_id))
+
+    # Rewritten pieces would land in every torrent sharing a hardlinked file
+    dedup.break_links(job.torrent)
+
+    # Saved before the torrent is queued, the engine reads it when re-adding the torrent
+    job.repair_pending = True
+    job.save(update_fields=['status', 'repair_pending'])
+    TorrentDownload.objects.filter(id=job.torrent_id, status='completed').update(
+        status='pending',
+        status_message=f"Repairing {len(job.corrupt_pieces)} corrupt pieces",
+    )
+    dispatch_queue()
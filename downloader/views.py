@@ -1,22 +1,24 @@
 # downloader/views.py - All Functional Views
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse, FileResponse
+from django.urls import reverse
+from django.http import JsonResponse, FileResponse, HttpResponse, Http404
 from django.contrib import messages
 from django.views.decorators.http import require_POST, require_http_methods
 from django.core.paginator import Paginator
-from django.db.models import Q
+from django.db.models import Count, Q
+import logging
 import os
-import shutil
+import uuid
 import zipfile
-import threading
-import time
-from .models import TorrentDownload
-from .forms import TorrentForm
+from .models import TorrentDownload, TorrentLiveStatus, DeletionJob, VerifyJob, BandwidthSettings
+from .forms import TorrentForm, TorrentLimitsForm, TorrentWebSeedsForm, BandwidthSettingsForm
+from .cleanup import start_deletion_job
+from .engine import dispatch_queue, move_in_queue
+from .verify import schedule_verification
+from . import bandwidth, dedup, diagnostics, events, history, metrics, profiling, session, shards, storage
 from django.conf import settings
-from django.utils import timezone
 
-# Global dictionary to track download threads
-download_threads = {}
+logger = logging.getLogger(__name__)
 
 def torrent_list(request):
     """Main page showing all torrents with pagination and search"""
@@ -24,8 +26,8 @@ def torrent_list(request):
     # Get search query
     search_query = request.GET.get('search', '')
     
-    # Filter torrents based on search
-    torrents = TorrentDownload.objects.all()
+    # Filter torrents based on search, live counters come along in the same query
+    torrents = TorrentDownload.objects.select_related('live')
     if search_query:
         torrents = torrents.filter(
             Q(name__icontains=search_query) | 
@@ -40,304 +42,66 @@ def torrent_list(request):
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     
-    # Calculate statistics
-    stats = {
-        'total': TorrentDownload.objects.count(),
-        'downloading': TorrentDownload.objects.filter(status='downloading').count(),
-        'completed': TorrentDownload.objects.filter(status='completed').count(),
-        'failed': TorrentDownload.objects.filter(status='failed').count(),
-        'pending': TorrentDownload.objects.filter(status='pending').count(),
-        'paused': TorrentDownload.objects.filter(status='paused').count(),
-    }
+    # Calculate statistics in one query instead of one per status
+    stats = TorrentDownload.objects.aggregate(
+        total=Count('id'),
+        downloading=Count('id', filter=Q(status='downloading')),
+        completed=Count('id', filter=Q(status='completed')),
+        failed=Count('id', filter=Q(status='failed')),
+        pending=Count('id', filter=Q(status='pending')),
+        paused=Count('id', filter=Q(status='paused')),
+    )
     
     # Create form for adding new torrents
     form = TorrentForm()
+    bandwidth_form = BandwidthSettingsForm(instance=BandwidthSettings.load())
+    
+    # Deletion jobs still running, plus the one just started so its outcome shows even if it was quick
+    job_filter = Q(status__in=('pending', 'running'))
+    try:
+        job_filter |= Q(id=uuid.UUID(request.GET.get('deletion_job', '')))
+    except ValueError:
+        pass
+    deletion_jobs = DeletionJob.objects.filter(job_filter).order_by('created_at')
     
     context = {
         'torrents': page_obj.object_list,
         'page_obj': page_obj,
         'is_paginated': page_obj.has_other_pages(),
         'form': form,
+        'bandwidth_form': bandwidth_form,
         'stats': stats,
         'search_query': search_query,
+        'deletion_jobs': deletion_jobs,
     }
     
     return render(request, 'downloader/index.html', context)
 
-def download_torrent_sync(torrent_id):
-    """Synchronous torrent download function compatible with libtorrent 2.0.9"""
-    try:
-        try:
-            import libtorrent as lt
-        except ImportError:
-            print("libtorrent not available, marking torrent as failed")
-            try:
-                torrent = TorrentDownload.objects.get(id=torrent_id)
-                torrent.status = 'failed'
-                torrent.save()
-            except TorrentDownload.DoesNotExist:
-                pass
-            return
-
-        torrent = TorrentDownload.objects.get(id=torrent_id)
-        torrent.status = 'downloading'
-        torrent.save()
-
-        print(f"Starting download for: {torrent.name}")
-        print(f"libtorrent version: {getattr(lt, '__version__', 'unknown')}")
-
-        # Create session - your version works with basic session
-        ses = lt.session()
-        
-        # Apply settings using the older method since settings_pack isn't available
-        try:
-            # For libtorrent 2.0.9 without settings_pack, use apply_settings
-            settings = {
-                'user_agent': f'libtorrent/{getattr(lt, "__version__", "2.0.9")}',
-                'enable_upnp': True,
-                'enable_natpmp': True,
-                'enable_dht': True,
-                'enable_lsd': True,
-                'enable_outgoing_utp': True,
-                'enable_incoming_utp': True,
-            }
-            
-            # Try different methods to apply settings
-            if hasattr(ses, 'apply_settings'):
-                ses.apply_settings(settings)
-                print("✅ Settings applied using apply_settings")
-            elif hasattr(ses, 'set_settings'):
-                ses.set_settings(settings)
-                print("✅ Settings applied using set_settings")
-            else:
-                print("⚠️ No settings method found, using defaults")
-                
-        except Exception as e:
-            print(f"⚠️ Settings application failed: {e}, continuing with defaults")
-
-        # Listen on ports
-        try:
-            ses.listen_on(6881, 6891)
-            print("✅ Listening on ports 6881-6891")
-        except Exception as e:
-            print(f"⚠️ Listen port setup failed: {e}")
-
-        # Add DHT routers
-        try:
-            ses.add_dht_router("router.utorrent.com", 6881)
-            ses.add_dht_router("router.bittorrent.com", 6881)
-            ses.add_dht_router("dht.transmissionbt.com", 6881)
-            print("✅ DHT routers added")
-        except Exception as e:
-            print(f"⚠️ DHT router setup failed: {e}")
-
-        # Add torrent using add_torrent_params (available in your version)
-        try:
-            from django.conf import settings as django_settings
-            params = lt.add_torrent_params()
-            params.url = torrent.magnet_link
-            params.save_path = str(django_settings.TORRENT_DOWNLOAD_DIR)
-            
-            # Set storage mode if available
-            if hasattr(lt, 'storage_mode_t'):
-                params.storage_mode = lt.storage_mode_t.storage_mode_sparse
-                
-            handle = ses.add_torrent(params)
-            print(f"✅ Torrent added successfully")
-                
-        except Exception as e:
-            print(f"❌ Error adding torrent: {e}")
-            torrent.status = 'failed'
-            torrent.save()
-            return
-
-        # Wait for metadata
-        timeout = 300  # 5 minutes
-        start_time = time.time()
-        print(f"Waiting for metadata for torrent: {torrent.name}")
-
-        while not handle.has_metadata():
-            if time.time() - start_time > timeout:
-                print(f"❌ Metadata timeout for torrent {torrent_id}")
-                torrent.status = 'failed'
-                torrent.save()
-                try:
-                    ses.remove_torrent(handle)
-                except:
-                    pass
-                return
-
-            time.sleep(1)
-
-            try:
-                torrent.refresh_from_db()
-                if torrent.status == 'paused':
-                    print(f"⏸️ Torrent paused: {torrent.name}")
-                    try:
-                        ses.remove_torrent(handle)
-                    except:
-                        pass
-                    return
-            except TorrentDownload.DoesNotExist:
-                print(f"🗑️ Torrent deleted: {torrent_id}")
-                try:
-                    ses.remove_torrent(handle)
-                except:
-                    pass
-                return
-
-        # Metadata received
-        try:
-            info = handle.get_torrent_info()
-            torrent.name = info.name()
-            torrent.size = info.total_size()
-            torrent.is_multi_file = info.num_files() > 1
-            torrent.save()
-            print(f"✅ Metadata received. Starting download: {torrent.name} ({torrent.size} bytes, {info.num_files()} files)")
-        except Exception as e:
-            print(f"❌ Error getting torrent info: {e}")
-            torrent.status = 'failed'
-            torrent.save()
-            return
-
-        # Download loop
-        last_progress_update = 0
-        consecutive_errors = 0
-        max_consecutive_errors = 10
-        
-        while True:
-            try:
-                status = handle.status()
-                if status.progress >= 1:
-                    print("✅ Download completed!")
-                    break
-                    
-                consecutive_errors = 0  # Reset error counter on success
-                
-            except Exception as e:
-                consecutive_errors += 1
-                print(f"⚠️ Error getting status (attempt {consecutive_errors}): {e}")
-                if consecutive_errors >= max_consecutive_errors:
-                    print(f"❌ Too many consecutive errors, failing torrent")
-                    torrent.status = 'failed'
-                    torrent.save()
-                    return
-                time.sleep(5)
-                continue
-                
-            time.sleep(2)
-
-            # Check if torrent was paused or deleted
-            try:
-                torrent.refresh_from_db()
-                if torrent.status == 'paused':
-                    print(f"⏸️ Download paused: {torrent.name}")
-                    try:
-                        ses.remove_torrent(handle)
-                    except:
-                        pass
-                    return
-            except TorrentDownload.DoesNotExist:
-                print(f"🗑️ Torrent deleted during download: {torrent_id}")
-                try:
-                    ses.remove_torrent(handle)
-                except:
-                    pass
-                return
-
-            # Update progress
-            try:
-                status = handle.status()
-                torrent.progress = status.progress
-                torrent.download_speed = status.download_rate / 1024  # KB/s
-                torrent.upload_speed = status.upload_rate / 1024
-                torrent.downloaded = status.total_done
-                torrent.peers = status.num_peers
-                torrent.seeds = status.num_seeds
-
-                # ETA calculation
-                if status.download_rate > 0:
-                    remaining = torrent.size - torrent.downloaded
-                    eta_seconds = remaining / status.download_rate
-                    if eta_seconds < 60:
-                        torrent.eta = f"{int(eta_seconds)}s"
-                    elif eta_seconds < 3600:
-                        torrent.eta = f"{int(eta_seconds / 60)}m"
-                    else:
-                        torrent.eta = f"{int(eta_seconds // 3600)}h {int((eta_seconds % 3600) / 60)}m"
-                else:
-                    torrent.eta = "∞"
-
-                torrent.save()
-
-                # Log every 10% progress
-                current_progress = int(torrent.progress * 10)
-                if current_progress > last_progress_update:
-                    last_progress_update = current_progress
-                    print(f"📊 Progress: {torrent.progress * 100:.1f}% - {torrent.download_speed:.1f} KB/s - Peers: {torrent.peers}/{torrent.seeds} - {torrent.name}")
-                    
-            except Exception as e:
-                print(f"⚠️ Error updating progress: {e}")
-
-        # Download complete
-        try:
-            info = handle.get_torrent_info()
-            torrent.status = 'completed'
-            torrent.progress = 1.0
-            torrent.completed_at = timezone.now()
-            torrent.file_path = os.path.join(django_settings.TORRENT_DOWNLOAD_DIR, info.name())
-            torrent.save()
-
-            print(f"🎉 Download completed: {torrent.name}")
-        except Exception as e:
-            print(f"❌ Error completing download: {e}")
-            torrent.status = 'failed'
-            torrent.save()
-
-        try:
-            ses.remove_torrent(handle)
-        except:
-            pass
-
-        if torrent_id in download_threads:
-            del download_threads[torrent_id]
-
-    except Exception as e:
-        print(f"❌ Download error for {torrent_id}: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        
-        try:
-            torrent = TorrentDownload.objects.get(id=torrent_id)
-            torrent.status = 'failed'
-            torrent.save()
-        except TorrentDownload.DoesNotExist:
-            pass
-
-        if torrent_id in download_threads:
-            del download_threads[torrent_id]
-
 @require_http_methods(["GET", "POST"])
 def add_torrent(request):
     """Add a new torrent download"""
     
     if request.method == 'POST':
-        form = TorrentForm(request.POST)
+        form = TorrentForm(request.POST, request.FILES)
         if form.is_valid():
             try:
                 torrent = form.save(commit=False)
                 torrent.name = form.cleaned_data.get('name', 'Unknown Torrent')
-                torrent.save()
                 
-                # Start download in background thread
-                thread = threading.Thread(target=download_torrent_sync, args=(str(torrent.id),))
-                thread.daemon = True
-                thread.start()
-                
-                # Track the thread
-                download_threads[str(torrent.id)] = thread
+                # An uploaded .torrent already has its metadata, no swarm lookup needed
+                info = form.cleaned_data.get('torrent_info')
+                if info is not None:
+                    torrent.size = info.total_size()
+                    torrent.is_multi_file = info.num_files() > 1
+                torrent.save()
+                if info is not None:
+                    storage.save_metadata(str(torrent.id), info)
                 
-                messages.success(request, f'Torrent "{torrent.name}" added successfully and download started!')
+                # Start download in background thread if a slot is free
+                if str(torrent.id) in dispatch_queue():
+                    messages.success(request, f'Torrent "{torrent.name}" added successfully and download started!')
+                else:
+                    messages.success(request, f'Torrent "{torrent.name}" added successfully and queued.')
                 return redirect('torrent_list')
                 
             except Exception as e:
@@ -373,15 +137,13 @@ def resume_torrent(request, torrent_id):
     
     if torrent.status == 'paused':
         torrent.status = 'pending'
+        torrent.next_retry_at = None
+        torrent.swarm_recheck_at = None
         torrent.save()
+        TorrentLiveStatus.objects.filter(torrent=torrent).delete()
         
-        # Start download in background thread
-        thread = threading.Thread(target=download_torrent_sync, args=(str(torrent.id),))
-        thread.daemon = True
-        thread.start()
-        
-        # Track the thread
-        download_threads[str(torrent.id)] = thread
+        # Start download in background thread if a slot is free
+        dispatch_queue()
         
         messages.success(request, f'Torrent "{torrent.name}" has been resumed.')
     else:
@@ -398,22 +160,15 @@ def restart_torrent(request, torrent_id):
     if torrent.status == 'failed':
         # Reset torrent state
         torrent.status = 'pending'
-        torrent.progress = 0.0
-        torrent.download_speed = 0.0
-        torrent.upload_speed = 0.0
-        torrent.downloaded = 0
-        torrent.peers = 0
-        torrent.seeds = 0
-        torrent.eta = ''
+        torrent.status_message = ''
+        torrent.retry_count = 0
+        torrent.next_retry_at = None
+        torrent.swarm_recheck_at = None
         torrent.save()
+        TorrentLiveStatus.objects.filter(torrent=torrent).delete()
         
-        # Start download in background thread
-        thread = threading.Thread(target=download_torrent_sync, args=(str(torrent.id),))
-        thread.daemon = True
-        thread.start()
-        
-        # Track the thread
-        download_threads[str(torrent.id)] = thread
+        # Start download in background thread if a slot is free
+        dispatch_queue()
         
         messages.success(request, f'Torrent "{torrent.name}" has been restarted.')
     else:
@@ -423,43 +178,23 @@ def restart_torrent(request, torrent_id):
 
 @require_POST
 def delete_torrent(request, torrent_id):
-    """Delete a torrent and its files"""
+    """Delete a torrent and its files in the background"""
     
     torrent = get_object_or_404(TorrentDownload, id=torrent_id)
-    torrent_name = torrent.name
-    
-    # Stop any running download thread
-    if str(torrent_id) in download_threads:
-        del download_threads[str(torrent_id)]
     
-    # Delete files if they exist
-    files_deleted = False
-    if torrent.file_path and os.path.exists(torrent.file_path):
-        try:
-            if os.path.isdir(torrent.file_path):
-                shutil.rmtree(torrent.file_path)
-                files_deleted = True
-            else:
-                os.remove(torrent.file_path)
-                files_deleted = True
-            
-            # Also delete zip file if exists
-            zip_path = f"{torrent.file_path}.zip"
-            if os.path.exists(zip_path):
-                os.remove(zip_path)
-                
-        except Exception as e:
-            messages.error(request, f'Error deleting files: {str(e)}')
+    if torrent.status == 'deleting':
+        messages.warning(request, f'Torrent "{torrent.name}" is already being deleted.')
+        return redirect('torrent_list')
     
-    # Delete database record
-    torrent.delete()
+    job = start_deletion_job(TorrentDownload.objects.filter(id=torrent.id))
     
-    if files_deleted:
-        messages.success(request, f'Torrent "{torrent_name}" and its files have been deleted successfully.')
-    else:
-        messages.success(request, f'Torrent "{torrent_name}" has been deleted successfully.')
+    messages.success(request, f'Torrent "{torrent.name}" is being deleted in the background.')
+    return redirect_to_deletion_job(job)
+
+def redirect_to_deletion_job(job):
+    """Back to the list, which polls the job's progress"""
     
-    return redirect('torrent_list')
+    return redirect(f"{reverse('torrent_list')}?deletion_job={job.id}")
 
 def download_file(request, torrent_id):
     """Download completed torrent files"""
@@ -486,15 +221,15 @@ def download_file(request, torrent_id):
             zip_path = f"{file_path}.zip"
             
             # Create zip file if it doesn't exist
-            if not os.path.exists(zip_path):
-                print(f"Creating zip file for: {torrent.name}")
+            if not os.path.exists(zip_path) and not dedup.reuse_archive(torrent, zip_path):
+                logger.info("Creating zip file for: %s", torrent.name, extra={'torrent_id': str(torrent.id)})
                 with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
                     for root, dirs, files in os.walk(file_path):
                         for file in files:
                             file_full_path = os.path.join(root, file)
                             arcname = os.path.relpath(file_full_path, file_path)
                             zipf.write(file_full_path, arcname)
-                print(f"Zip file created: {zip_path}")
+                logger.info("Zip file created: %s", zip_path, extra={'torrent_id': str(torrent.id)})
             
             # Serve zip file
             response = FileResponse(
@@ -521,12 +256,15 @@ def download_file(request, torrent_id):
         messages.error(request, f'Error serving file "{torrent.name}": {str(e)}')
         return redirect('torrent_list')
 
+@metrics.instrumented('status')
 def get_torrent_status(request, torrent_id):
     """API endpoint to get real-time torrent status"""
     
+    # Outside the try so deleted torrents answer 404 instead of 500
+    torrent = get_object_or_404(TorrentDownload.objects.select_related('live'), id=torrent_id)
+    live = torrent.live_status
+    
     try:
-        torrent = get_object_or_404(TorrentDownload, id=torrent_id)
-        
         data = {
             'id': str(torrent.id),
             'name': torrent.name,
@@ -534,12 +272,18 @@ def get_torrent_status(request, torrent_id):
             'status_display': torrent.get_status_display(),
             'progress': round(torrent.progress_percentage, 1),
             'download_speed': torrent.download_speed_human,
-            'upload_speed': f"{torrent.format_bytes(torrent.upload_speed * 1024)}/s",
+            'upload_speed': f"{torrent.format_bytes(live.upload_speed * 1024)}/s",
             'downloaded': torrent.downloaded_human,
             'size': torrent.size_human,
-            'peers': torrent.peers,
-            'seeds': torrent.seeds,
-            'eta': torrent.eta or '∞',
+            'peers': live.peers,
+            'seeds': live.seeds,
+            'eta': live.eta_display,
+            'eta_seconds': live.eta_seconds,
+            'status_message': torrent.current_status_message,
+            'uploaded': torrent.format_bytes(torrent.uploaded_total),
+            'ratio': round(torrent.seed_ratio, 2),
+            'is_seeding': torrent.is_seeding,
+            'swarm': torrent.swarm_summary,
             'created_at': torrent.created_at.strftime('%Y-%m-%d %H:%M:%S'),
             'is_multi_file': torrent.is_multi_file,
         }
@@ -552,10 +296,57 @@ def get_torrent_status(request, torrent_id):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+# Ranges the history API and the detail page chart offer, in seconds
+HISTORY_RANGES = {
+    '15m': 15 * 60,
+    '1h': 3600,
+    '6h': 6 * 3600,
+    '24h': 24 * 3600,
+    '7d': 7 * 24 * 3600,
+    '30d': 30 * 24 * 3600,
+}
+
+@metrics.instrumented('history')
+def get_torrent_history(request, torrent_id):
+    """API endpoint with a torrent's throughput over a range, e.g. ?range=24h"""
+    
+    torrent = get_object_or_404(TorrentDownload, id=torrent_id)
+    range_name = request.GET.get('range', '1h')
+    if range_name not in HISTORY_RANGES:
+        return JsonResponse({'error': f"range must be one of {', '.join(HISTORY_RANGES)}"}, status=400)
+    
+    data = history.history(str(torrent.id), HISTORY_RANGES[range_name])
+    data['range'] = range_name
+    data['fields'] = ['time', 'download_speed', 'upload_speed', 'peers', 'progress']
+    return JsonResponse(data)
+
+@metrics.instrumented('diagnostics')
+def get_torrent_diagnostics(request, torrent_id):
+    """API endpoint with the peers, trackers and pieces of a torrent running in this process"""
+    
+    torrent = get_object_or_404(TorrentDownload, id=torrent_id)
+    
+    # Handles only exist in the process whose session runs the torrent
+    handle = diagnostics.find_handle(torrent)
+    if handle is None:
+        if not shards.runs_engine():
+            reason = 'Downloads run in external engine processes, diagnostics are only available there'
+        else:
+            reason = 'The torrent is not loaded in this process, it is neither downloading nor seeding here'
+        return JsonResponse({'available': False, 'reason': reason})
+    
+    try:
+        data = diagnostics.snapshot(handle)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+    
+    data['available'] = True
+    return JsonResponse(data)
+
 def torrent_detail(request, torrent_id):
     """Detailed view of a single torrent"""
     
-    torrent = get_object_or_404(TorrentDownload, id=torrent_id)
+    torrent = get_object_or_404(TorrentDownload.objects.select_related('live'), id=torrent_id)
     
     # Get file list if torrent is completed and is multi-file
     files = []
@@ -573,11 +364,15 @@ def torrent_detail(request, torrent_id):
                         'size_bytes': file_size,
                     })
         except Exception as e:
-            print(f"Error reading files: {e}")
+            logger.warning("Error reading files: %s", e, extra={'torrent_id': str(torrent.id)})
     
     context = {
         'torrent': torrent,
         'files': files,
+        'limits_form': TorrentLimitsForm(instance=torrent),
+        'history_ranges': list(HISTORY_RANGES),
+        # Only what this process logged, external engine shards keep their own
+        'events': events.recent_events(torrent.id),
     }
     
     return render(request, 'downloader/torrent_detail.html', context)
@@ -586,40 +381,249 @@ def cleanup_completed(request):
     """Remove all completed torrents"""
     
     if request.method == 'POST':
-        completed_torrents = TorrentDownload.objects.filter(status='completed')
-        count = completed_torrents.count()
-        
-        for torrent in completed_torrents:
-            # Delete files
-            if torrent.file_path and os.path.exists(torrent.file_path):
-                try:
-                    if os.path.isdir(torrent.file_path):
-                        shutil.rmtree(torrent.file_path)
-                    else:
-                        os.remove(torrent.file_path)
-                    
-                    # Also delete zip file if exists
-                    zip_path = f"{torrent.file_path}.zip"
-                    if os.path.exists(zip_path):
-                        os.remove(zip_path)
-                except Exception as e:
-                    print(f"Error deleting files for {torrent.name}: {e}")
-        
-        # Delete from database
-        completed_torrents.delete()
+        job = start_deletion_job(TorrentDownload.objects.filter(status='completed'))
         
-        messages.success(request, f'Successfully removed {count} completed torrents and their files.')
+        messages.success(request, f'Removing {job.total} completed torrents and their files in the background.')
+        return redirect_to_deletion_job(job)
+    
+    return redirect('torrent_list')
+
+@require_POST
+def move_torrent(request, torrent_id, direction):
+    """Move a queued torrent up or down within its priority level"""
+    
+    torrent = get_object_or_404(TorrentDownload, id=torrent_id)
+    
+    if torrent.status != 'pending':
+        messages.warning(request, f'Only queued torrents can be moved, "{torrent.name}" is {torrent.get_status_display().lower()}.')
+    elif move_in_queue(torrent, direction):
+        messages.success(request, f'Moved "{torrent.name}" {direction} in the queue.')
+    
+    return redirect('torrent_list')
+
+@require_POST
+def set_torrent_priority(request, torrent_id):
+    """Change a torrent's priority, a critical one may preempt running downloads"""
+    
+    torrent = get_object_or_404(TorrentDownload, id=torrent_id)
+    priority = request.POST.get('priority', '')
+    
+    if not priority.isdigit() or int(priority) not in dict(TorrentDownload.PRIORITY_CHOICES):
+        messages.error(request, 'Invalid priority.')
+        return redirect('torrent_list')
+    
+    torrent.priority = int(priority)
+    torrent.save(update_fields=['priority'])
+    dispatch_queue()
+    
+    messages.success(request, f'Priority of "{torrent.name}" set to {torrent.get_priority_display()}.')
+    return redirect('torrent_list')
+
+@require_POST
+def set_torrent_limits(request, torrent_id):
+    """Change a torrent's rate limits while it keeps downloading"""
+    
+    torrent = get_object_or_404(TorrentDownload, id=torrent_id)
+    form = TorrentLimitsForm(request.POST, instance=torrent)
+    
+    if form.is_valid():
+        # Only the limit columns, the download thread owns the rest of the row
+        form.save(commit=False).save(update_fields=form.Meta.fields)
+        apply_bandwidth_limits(request)
+        messages.success(request, f'Bandwidth limits for "{torrent.name}" updated.')
+    else:
+        for field, errors in form.errors.items():
+            for error in errors:
+                messages.error(request, f'{field}: {error}')
+    
+    return redirect('torrent_detail', torrent_id=torrent.id)
+
+@require_POST
+def set_web_seeds(request, torrent_id):
+    """Change a torrent's HTTP mirrors, a running download picks new ones up right away"""
+    
+    torrent = get_object_or_404(TorrentDownload, id=torrent_id)
+    form = TorrentWebSeedsForm(request.POST, instance=torrent)
+    
+    if form.is_valid():
+        form.save(commit=False).save(update_fields=['web_seeds'])
+        messages.success(request, f'Mirrors for "{torrent.name}" updated.')
+    else:
+        for field, errors in form.errors.items():
+            for error in errors:
+                messages.error(request, f'{field}: {error}')
+    
+    return redirect('torrent_list')
+
+@require_POST
+def set_bandwidth(request):
+    """Change the global rate limits at runtime"""
+    
+    form = BandwidthSettingsForm(request.POST, instance=BandwidthSettings.load())
+    
+    if form.is_valid():
+        form.save()
+        apply_bandwidth_limits(request)
+        messages.success(request, 'Global bandwidth limits updated.')
+    else:
+        for field, errors in form.errors.items():
+            for error in errors:
+                messages.error(request, f'{field}: {error}')
     
     return redirect('torrent_list')
 
+def apply_bandwidth_limits(request):
+    """Push changed limits to the running session right away instead of on the next scheduler tick"""
+    
+    # External engine shards pick the new limits up on their next scheduler tick
+    if not shards.runs_engine():
+        return
+    
+    try:
+        bandwidth.apply_limits()
+    except Exception as e:
+        messages.warning(request, f'Limits saved, but could not be applied yet: {str(e)}')
+
+@require_POST
+def verify_torrent(request, torrent_id):
+    """Check a completed torrent's files against its piece hashes"""
+    
+    torrent = get_object_or_404(TorrentDownload, id=torrent_id)
+    
+    if torrent.status != 'completed':
+        messages.warning(request, f'Cannot verify torrent "{torrent.name}" in {torrent.get_status_display()} state.')
+    elif schedule_verification(TorrentDownload.objects.filter(id=torrent.id)):
+        messages.success(request, f'Verification of "{torrent.name}" has been scheduled.')
+    else:
+        messages.warning(request, f'Torrent "{torrent.name}" is already being verified.')
+    
+    return redirect('torrent_list')
+
+@require_POST
+def verify_completed(request):
+    """Schedule verification of all completed torrents"""
+    
+    jobs = schedule_verification(TorrentDownload.objects.all())
+    
+    messages.success(request, f'Scheduled verification of {len(jobs)} completed torrents.')
+    return redirect('torrent_list')
+
 def cleanup_failed(request):
     """Remove all failed torrents"""
     
     if request.method == 'POST':
-        failed_torrents = TorrentDownload.objects.filter(status='failed')
-        count = failed_torrents.count()
-        failed_torrents.delete()
+        # Failed downloads leave partial data, archives and state files behind, the job removes those too
+        job = start_deletion_job(TorrentDownload.objects.filter(status='failed'))
         
-        messages.success(request, f'Successfully removed {count} failed torrents.')
+        messages.success(request, f'Removing {job.total} failed torrents and their files in the background.')
+        return redirect_to_deletion_job(job)
     
     return redirect('torrent_list')
+
+@metrics.instrumented('deletion_job')
+def get_deletion_job_status(request, job_id):
+    """API endpoint to get background deletion progress"""
+    
+    job = get_object_or_404(DeletionJob, id=job_id)
+    
+    data = {
+        'id': str(job.id),
+        'status': job.status,
+        'total': job.total,
+        'processed': job.processed,
+        'progress': round(job.progress_percentage, 1),
+        'files_deleted': job.files_deleted,
+        'bytes_freed': TorrentDownload.format_bytes(job.bytes_freed),
+        'error': job.error,
+    }
+    
+    if job.finished_at:
+        data['finished_at'] = job.finished_at.strftime('%Y-%m-%d %H:%M:%S')
+    
+    return JsonResponse(data)
+
+@metrics.instrumented('verify_job')
+def get_verify_job_status(request, job_id):
+    """API endpoint to get integrity verification progress"""
+    
+    job = get_object_or_404(VerifyJob, id=job_id)
+    
+    data = {
+        'id': str(job.id),
+        'torrent_id': str(job.torrent_id),
+        'status': job.status,
+        'total_pieces': job.total_pieces,
+        'checked_pieces': job.checked_pieces,
+        'progress': round(job.progress_percentage, 1),
+        'corrupt_pieces': job.corrupt_pieces,
+        'repair_pending': job.repair_pending,
+        'error': job.error,
+    }
+    
+    if job.finished_at:
+        data['finished_at'] = job.finished_at.strftime('%Y-%m-%d %H:%M:%S')
+    
+    return JsonResponse(data)
+
+@metrics.instrumented('engine_settings')
+def get_engine_settings(request):
+    """API endpoint to inspect the active libtorrent performance profile"""
+    
+    try:
+        return JsonResponse(session.active_settings())
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=503)
+
+@require_POST
+def set_engine_profile(request):
+    """API endpoint to switch the running session to another performance profile until the next restart"""
+    
+    profile = request.POST.get('profile', '')
+    if profile not in settings.TORRENT_SESSION_PROFILES:
+        return JsonResponse({'error': f"Unknown profile '{profile}'"}, status=400)
+    
+    # External engine shards run their own sessions, they take TORRENT_SESSION_PROFILE from their environment
+    if not shards.runs_engine():
+        return JsonResponse({'error': 'The engine runs in separate processes, set TORRENT_SESSION_PROFILE there'}, status=409)
+    
+    try:
+        session.apply_profile(profile)
+        return JsonResponse(session.active_settings())
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=503)
+
+@metrics.instrumented('bandwidth')
+def get_bandwidth_status(request):
+    """API endpoint to get the effective global and per-torrent limits"""
+    
+    base = BandwidthSettings.load()
+    window = bandwidth.active_window()
+    download_limit, upload_limit = bandwidth.global_limits()
+    
+    data = {
+        'download_limit': download_limit,
+        'upload_limit': upload_limit,
+        'base_download_limit': base.download_limit,
+        'base_upload_limit': base.upload_limit,
+        'schedule_enabled': base.schedule_enabled,
+        'schedule_window': str(window) if window else None,
+        'torrent_caps': {
+            torrent_id: {'download_limit': down, 'upload_limit': up}
+            for torrent_id, (down, up) in bandwidth.torrent_caps.items()
+        },
+    }
+    
+    return JsonResponse(data)
+
+def prometheus_metrics(request):
+    """Prometheus scrape endpoint, engine shards serve their own on TORRENT_METRICS_PORT"""
+    
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+def profiling_report(request):
+    """Per-URL latency, query counts and the slowest recent requests, only while TORRENT_PROFILING is on"""
+    
+    if not settings.TORRENT_PROFILING:
+        raise Http404('Profiling is disabled, set TORRENT_PROFILING=True')
+    
+    return JsonResponse(profiling.report())
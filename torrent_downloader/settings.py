@@ -1,6 +1,6 @@
 
 from pathlib import Path
-from decouple import config
+from decouple import config, Csv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -32,6 +32,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First so its total covers every other middleware, a no-op unless TORRENT_PROFILING is on
+    'downloader.profiling.ProfilingMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
@@ -67,13 +69,43 @@ WSGI_APPLICATION = "torrent_downloader.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# SQLite by default, tuned for many download threads writing while requests read
+# (see downloader/database.py). Set POSTGRES_HOST to use PostgreSQL instead and
+# `manage.py import_sqlite db.sqlite3` to carry existing data over.
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "NAME": config('SQLITE_PATH', default=str(BASE_DIR / "db.sqlite3")),
+        "OPTIONS": {
+            "timeout": config('SQLITE_BUSY_TIMEOUT', default=20, cast=int),  # seconds a writer waits for the lock
+        },
     }
 }
 
+if config('POSTGRES_HOST', default=''):
+    DATABASES['default'] = {
+        "ENGINE": "django.db.backends.postgresql",
+        "HOST": config('POSTGRES_HOST'),
+        "PORT": config('POSTGRES_PORT', default=5432, cast=int),
+        "NAME": config('POSTGRES_DB', default='torrent_downloader'),
+        "USER": config('POSTGRES_USER', default='postgres'),
+        "PASSWORD": config('POSTGRES_PASSWORD', default=''),
+        "OPTIONS": {
+            "connect_timeout": 10,
+        },
+        # Behind PgBouncer in transaction mode server-side cursors break
+        "DISABLE_SERVER_SIDE_CURSORS": config('POSTGRES_PGBOUNCER', default=False, cast=bool),
+    }
+
+# Persistent connections only where they get closed reliably: WSGI request threads or PgBouncer's pool.
+# Under daphne (ASGI) Django's per-thread connections are not reliably closed, so each request gets its own
+PERSISTENT_CONNECTIONS = (
+    config('WEB_SERVER', default='asgi') == 'wsgi'
+    or DATABASES['default'].get('DISABLE_SERVER_SIDE_CURSORS', False)
+)
+DATABASES['default']['CONN_MAX_AGE'] = config('DB_CONN_MAX_AGE', default=600 if PERSISTENT_CONNECTIONS else 0, cast=int)
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -121,5 +153,202 @@ MEDIA_ROOT = BASE_DIR / 'media'
 TORRENT_DOWNLOAD_DIR = BASE_DIR / 'downloads'
 TORRENT_DOWNLOAD_DIR.mkdir(exist_ok=True)
 
+# Storage volumes downloads are spread over: most_free, least_active or round_robin
+TORRENT_DOWNLOAD_VOLUMES = config('TORRENT_DOWNLOAD_VOLUMES', default='', cast=Csv())
+TORRENT_VOLUME_PLACEMENT = config('TORRENT_VOLUME_PLACEMENT', default='most_free')
+# Completed torrents are moved here when set
+TORRENT_COLD_VOLUME = config('TORRENT_COLD_VOLUME', default='')
+TORRENT_MOVE_STORAGE_TIMEOUT = 3600  # seconds
+
+# Cross-torrent deduplication of completed downloads: hardlink or reflink
+TORRENT_DEDUP_ENABLED = config('TORRENT_DEDUP_ENABLED', default=False, cast=bool)
+TORRENT_DEDUP_METHOD = config('TORRENT_DEDUP_METHOD', default='hardlink')
+TORRENT_DEDUP_MIN_FILE_SIZE = config('TORRENT_DEDUP_MIN_FILE_SIZE', default=1024 ** 2, cast=int)
+TORRENT_HASH_WORKERS = config('TORRENT_HASH_WORKERS', default=0, cast=int)  # 0 = one per core
+
+# libtorrent session
+TORRENT_LISTEN_INTERFACES = config('TORRENT_LISTEN_INTERFACES', default='0.0.0.0:6881,[::]:6881')
+TORRENT_DHT_BOOTSTRAP_NODES = 'router.utorrent.com:6881,router.bittorrent.com:6881,dht.transmissionbt.com:6881'
+TORRENT_SESSION_PROFILE = config('TORRENT_SESSION_PROFILE', default='balanced')
+TORRENT_SESSION_STATE_INTERVAL = 300  # seconds between session state saves
+
+# Bandwidth: priority torrents get this share of a limited link, schedule checked every interval
+TORRENT_PRIORITY_BANDWIDTH_SHARE = 0.8
+TORRENT_BANDWIDTH_INTERVAL = 30  # seconds
+
+# Named settings_pack overlays. libtorrent 2.0 has no half-open limit or
+# block cache any more: connection_speed caps connection attempts per second
+# and max_queued_disk_bytes bounds buffered disk writes instead.
+TORRENT_SESSION_PROFILES = {
+    'low_memory': {
+        'connections_limit': 50,
+        'connection_speed': 5,
+        'max_peerlist_size': 500,
+        'max_queued_disk_bytes': 8 * 1024 ** 2,
+        'aio_threads': 2,
+        'hashing_threads': 1,
+        'file_pool_size': 20,
+        'send_buffer_watermark': 64 * 1024,
+        'send_buffer_low_watermark': 8 * 1024,
+        'recv_socket_buffer_size': 64 * 1024,
+        'send_socket_buffer_size': 64 * 1024,
+        'unchoke_slots_limit': 4,
+        'choking_algorithm': 'fixed_slots_choker',
+    },
+    'balanced': {
+        'connections_limit': 200,
+        'connection_speed': 30,
+        'max_peerlist_size': 3000,
+        'max_queued_disk_bytes': 64 * 1024 ** 2,
+        'aio_threads': 4,
+        'hashing_threads': 2,
+        'file_pool_size': 100,
+        'send_buffer_watermark': 512 * 1024,
+        'send_buffer_low_watermark': 16 * 1024,
+        'unchoke_slots_limit': 8,
+        'choking_algorithm': 'fixed_slots_choker',
+    },
+    'seedbox': {
+        'connections_limit': 2000,
+        'connection_speed': 200,
+        'max_peerlist_size': 10000,
+        'max_out_request_queue': 1500,
+        'max_queued_disk_bytes': 512 * 1024 ** 2,
+        'aio_threads': 16,
+        'hashing_threads': 4,
+        'file_pool_size': 500,
+        'send_buffer_watermark': 3 * 1024 ** 2,
+        'send_buffer_low_watermark': 1024 ** 2,
+        'send_buffer_watermark_factor': 150,
+        'recv_socket_buffer_size': 1024 ** 2,
+        'send_socket_buffer_size': 1024 ** 2,
+        'choking_algorithm': 'rate_based_choker',
+        'seed_choking_algorithm': 'fastest_upload',
+    },
+}
+
+# Saved .torrent metadata and other engine state
+TORRENT_STATE_DIR = BASE_DIR / 'state'
+TORRENT_STATE_DIR.mkdir(exist_ok=True)
+
+# Offline verification: pieces hashed per process pool task
+TORRENT_VERIFY_PIECES_PER_TASK = 256
+
+# Download engine: 'embedded' runs downloads in the web process, 'external' leaves
+# them to `manage.py run_engine --shards N` and the web tier only enqueues
+TORRENT_ENGINE_MODE = config('TORRENT_ENGINE_MODE', default='embedded')
+TORRENT_ENGINE_SHARDS = config('TORRENT_ENGINE_SHARDS', default=1, cast=int)
+TORRENT_ENGINE_POLL_INTERVAL = 2  # seconds between queue checks in engine shards
+TORRENT_ENGINE_RELEASE_GRACE = 15  # seconds the web tier gives shards to drop deleted torrents
+TORRENT_ENGINE_RESTART_DELAY = 5  # seconds before restarting a crashed shard, doubled while it keeps crashing
+
+# Where download jobs run: 'thread' in the engine process, 'process' in a child
+# process per download, 'celery' on workers started with `celery -A torrent_downloader worker`
+TORRENT_EXECUTOR = config('TORRENT_EXECUTOR', default='thread')
+
+# Celery, only used by the celery executor
+CELERY_BROKER_URL = config('CELERY_BROKER_URL', default='redis://localhost:6379/0')
+CELERY_ACCEPT_CONTENT = ['json']
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_TIMEZONE = 'UTC'
+# Downloads and archives get their own queues so zips never wait behind multi-hour downloads:
+# celery -A torrent_downloader worker -Q engine / -Q archive
+CELERY_TASK_ROUTES = {
+    'downloader.tasks.download_torrent': {'queue': 'engine'},
+    'downloader.tasks.create_zip_file': {'queue': 'archive'},
+}
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# Celery download jobs renew a lease on their row, the dispatcher requeues rows whose lease ran out
+TORRENT_LEASE_TTL = config('TORRENT_LEASE_TTL', default=120, cast=int)  # seconds
+TORRENT_LEASE_HEARTBEAT = 30  # seconds between renewals
+
+# Download queue and disk space admission control
+TORRENT_MAX_ACTIVE_DOWNLOADS = config('TORRENT_MAX_ACTIVE_DOWNLOADS', default=5, cast=int)
+TORRENT_RESUME_DATA_TIMEOUT = 30  # seconds to wait for libtorrent's resume data
+TORRENT_RESUME_DATA_INTERVAL = config('TORRENT_RESUME_DATA_INTERVAL', default=60, cast=int)  # seconds between saves while downloading
+TORRENT_DISK_RESERVE_BYTES = config('TORRENT_DISK_RESERVE_BYTES', default=2 * 1024 ** 3, cast=int)
+TORRENT_PREALLOCATE = config('TORRENT_PREALLOCATE', default=False, cast=bool)
+TORRENT_PREALLOCATE_MIN_SIZE = config('TORRENT_PREALLOCATE_MIN_SIZE', default=1024 ** 3, cast=int)
+TORRENT_QUEUE_INTERVAL = 30  # seconds between dispatches for torrents whose retry backoff expired
+
+# Stall recovery: reannounce after a third of a window without progress,
+# add extra trackers after two thirds, then give the slot up and retry later
+TORRENT_METADATA_TIMEOUT = config('TORRENT_METADATA_TIMEOUT', default=300, cast=int)  # seconds
+TORRENT_STALL_TIMEOUT = config('TORRENT_STALL_TIMEOUT', default=900, cast=int)  # seconds
+TORRENT_MAX_RETRIES = config('TORRENT_MAX_RETRIES', default=8, cast=int)
+TORRENT_RETRY_BASE_DELAY = 60  # seconds, doubled on every retry
+TORRENT_RETRY_MAX_DELAY = 6 * 3600  # seconds
+TORRENT_EXTRA_TRACKERS = config(
+    'TORRENT_EXTRA_TRACKERS',
+    default='udp://tracker.opentrackr.org:1337/announce,udp://open.stealth.si:80/announce,udp://tracker.torrent.eu.org:451/announce',
+    cast=Csv(),
+)
+
+# Seeding after completion, a torrent stops at the target ratio or the max seed time (0 = no limit).
+# While downloads run seeds are capped, or paused entirely when seeding only while idle
+TORRENT_SEEDING_ENABLED = config('TORRENT_SEEDING_ENABLED', default=True, cast=bool)
+TORRENT_SEED_RATIO = config('TORRENT_SEED_RATIO', default=1.0, cast=float)
+TORRENT_SEED_MAX_TIME = config('TORRENT_SEED_MAX_TIME', default=24 * 3600, cast=int)  # seconds
+TORRENT_MAX_ACTIVE_SEEDS = config('TORRENT_MAX_ACTIVE_SEEDS', default=3, cast=int)
+TORRENT_SEED_ONLY_WHILE_IDLE = config('TORRENT_SEED_ONLY_WHILE_IDLE', default=False, cast=bool)
+TORRENT_SEED_UPLOAD_LIMIT_WHILE_DOWNLOADING = 50  # KB/s per seed, 0 = unlimited
+TORRENT_SEED_MAX_CONNECTIONS_WHILE_DOWNLOADING = 10
+TORRENT_SEED_INTERVAL = 10  # seconds
+
+# Pre-flight swarm scrapes of queued torrents, dead swarms are deferred until the next scrape
+TORRENT_SCRAPE_ENABLED = config('TORRENT_SCRAPE_ENABLED', default=True, cast=bool)
+TORRENT_SCRAPE_INTERVAL = config('TORRENT_SCRAPE_INTERVAL', default=1800, cast=int)  # seconds
+TORRENT_SCRAPE_TIMEOUT = 10  # seconds per tracker or DHT lookup
+TORRENT_SCRAPE_BATCH_SIZE = 20  # queued torrents scraped per round
+TORRENT_SCRAPE_WORKERS = 4
+
+# Throughput history: a sample per download tick kept in memory, rolled up into
+# minute rows and those into hour rows, each pruned after its retention
+TORRENT_HISTORY_BUFFER_SIZE = 900  # samples per torrent
+TORRENT_HISTORY_MINUTE_RETENTION = 2 * 24 * 3600  # seconds
+TORRENT_HISTORY_HOUR_RETENTION = 90 * 24 * 3600  # seconds
+TORRENT_HISTORY_PRUNE_INTERVAL = 3600  # seconds between retention passes over all torrents
+
+# Prometheus metrics: the web tier serves /metrics, engine shards started by
+# run_engine serve theirs on this port plus the shard index (0 = off)
+TORRENT_METRICS_PORT = config('TORRENT_METRICS_PORT', default=0, cast=int)
+
+# Logging: JSON lines by default, TORRENT_LOG_FORMAT=text for a terminal. Records about a
+# torrent carry its id and info hash and are also kept in memory for its detail page
+TORRENT_LOG_FORMAT = config('TORRENT_LOG_FORMAT', default='json')
+TORRENT_LOG_LEVEL = config('TORRENT_LOG_LEVEL', default='INFO')
+TORRENT_PROGRESS_LOG_INTERVAL = 60  # seconds between progress lines of one download
+TORRENT_EVENTS_PER_TORRENT = 100
+
+# Request profiling: query count, DB, template and total time per URL name, reported at
+# /profiling/ and sent as Server-Timing headers. Off by default, it wraps every query
+TORRENT_PROFILING = config('TORRENT_PROFILING', default=False, cast=bool)
+TORRENT_PROFILING_WINDOW = 500  # recent requests kept per URL name
+TORRENT_PROFILING_SLOW_MS = config('TORRENT_PROFILING_SLOW_MS', default=500, cast=int)
+TORRENT_PROFILING_SLOW_KEEP = 100  # slow requests kept for the report
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'downloader.events.JsonFormatter'},
+        'text': {'()': 'downloader.events.TextFormatter', 'format': '%(asctime)s %(levelname)s %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': TORRENT_LOG_FORMAT},
+        'torrent_events': {'class': 'downloader.events.TorrentEventHandler', 'capacity': TORRENT_EVENTS_PER_TORRENT},
+    },
+    'loggers': {
+        'downloader': {'handlers': ['console', 'torrent_events'], 'level': TORRENT_LOG_LEVEL, 'propagate': False},
+    },
+}
+
+# Background deletion: files removed per second and DB rows deleted per batch
+TORRENT_DELETE_MAX_FILES_PER_SECOND = config('TORRENT_DELETE_MAX_FILES_PER_SECOND', default=200, cast=int)
+TORRENT_DELETE_BATCH_SIZE = config('TORRENT_DELETE_BATCH_SIZE', default=50, cast=int)
+TORRENT_DELETE_ENGINE_WAIT = 30  # seconds to wait for the engine to drop a handle
+
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"